@@ -0,0 +1,212 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Local stand-ins for the testbed hardware.
+
+FakeDigi emulates the web server and the telnet server of the Digi Connect
+boxes, DeadDigi a wedged box, FakeSerial the serial device of a mote. The
+scripts in bin/ replace motelist, tos-bsl, the install commands and the
+TinyOS Listen tool.
+"""
+
+import os
+import tty
+import socket
+import fcntl
+import errno
+import time
+import random
+import threading
+import SocketServer
+import BaseHTTPServer
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
+
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn,
+        BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+class _ThreadingTCPServer(SocketServer.ThreadingMixIn,
+        SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+
+class _RCIHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        digi = self.server.digi
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        # Like the real boxes, ask for the credentials if the request has
+        # none.
+        if self.headers.get("Authorization") is None:
+            digi.count("challenges")
+            self.send_response(401)
+            self.send_header("WWW-Authenticate",
+                    'Basic realm="Digi Connect ME"')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        time.sleep(digi.latency + random.random() * digi.jitter)
+        if random.random() < digi.failureRate:
+            digi.count("failures")
+            self.send_error(503)
+            return
+
+        digi.count("requests")
+        reply = '<rci_reply version="1.1"></rci_reply>\n'
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _TelnetHandler(SocketServer.BaseRequestHandler):
+
+    def handle(self):
+        self.request.sendall("login: ")
+
+
+class FakeDigi:
+    """Emulates the Digi Connect boxes of a Quanto testbed.
+
+    The /UE/rci endpoint answers every request after latency plus up to
+    jitter seconds, and fails with probability failureRate. All nodes share
+    the servers, so nodes are configured with ip 127.0.0.1:httpPort and
+    QuantoTestbedMote.TELNET_PORT has to be set to telnetPort.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, failureRate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failureRate = failureRate
+        self.counts = {"requests": 0, "challenges": 0, "failures": 0}
+        self.lock = threading.Lock()
+
+        self.http = _ThreadingHTTPServer(("127.0.0.1", 0), _RCIHandler)
+        self.http.digi = self
+        self.httpPort = self.http.server_address[1]
+        self.telnet = _ThreadingTCPServer(("127.0.0.1", 0), _TelnetHandler)
+        self.telnetPort = self.telnet.server_address[1]
+        for server in [self.http, self.telnet]:
+            p = threading.Thread(target=server.serve_forever)
+            p.setDaemon(True)
+            p.start()
+
+    def count(self, key):
+        self.lock.acquire()
+        self.counts[key] += 1
+        self.lock.release()
+
+    def host(self):
+        return "127.0.0.1:%d"%(self.httpPort,)
+
+    def close(self):
+        for server in [self.http, self.telnet]:
+            server.shutdown()
+            server.server_close()
+
+
+class DeadDigi:
+    """A wedged Digi Connect box, whose web server accepts connections but
+    never answers."""
+
+    def __init__(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.listen(1024)
+        self.port = self.socket.getsockname()[1]
+        self.connections = []
+        self.running = True
+        p = threading.Thread(target=self._accept)
+        p.setDaemon(True)
+        p.start()
+
+    def _accept(self):
+        while self.running:
+            try:
+                (connection, address) = self.socket.accept()
+            except socket.error:
+                break
+            self.connections.append(connection)
+
+    def host(self):
+        return "127.0.0.1:%d"%(self.port,)
+
+    def close(self):
+        self.running = False
+        self.socket.close()
+        for c in self.connections:
+            c.close()
+
+
+class FakeSerial:
+    """Serial device of a mote, emulated by a pseudo terminal.
+
+    After start, a thread writes rate packets of packetSize bytes per second
+    to the device, which is readable at path, until stop is called. Packets
+    that do not fit into the buffer of the terminal because nobody reads
+    them are counted in dropped.
+    """
+
+    def __init__(self, packetSize=16, rate=10.0):
+        self.packetSize = packetSize
+        self.rate = rate
+        (self.master, self.slave) = os.openpty()
+        tty.setraw(self.slave)
+        flags = fcntl.fcntl(self.master, fcntl.F_GETFL)
+        fcntl.fcntl(self.master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.path = os.ttyname(self.slave)
+        self.running = False
+        self.sent = 0
+        self.dropped = 0
+        self.thread = None
+
+    def _emit(self):
+        packet = "".join([chr(i % 256) for i in range(self.packetSize)])
+        start = time.time()
+        while self.running:
+            try:
+                os.write(self.master, packet)
+            except OSError, e:
+                if e.errno != errno.EAGAIN:
+                    break
+                self.dropped += 1
+            self.sent += 1
+            delay = start + self.sent / self.rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._emit)
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+
+def fake_environment(motes):
+    """Return a copy of os.environ that puts the stand-ins in bin/ first on
+    the PATH. motes is the file name of the list for the fake motelist."""
+    env = dict(os.environ)
+    env["PATH"] = BIN + os.pathsep + env.get("PATH", "")
+    env["MNI_FAKE_MOTELIST"] = motes
+    return env
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# vim: ts=4 et sw=4 sts=4
+
+"""Benchmark of the fleet operations of MNI on emulated hardware.
+
+Creates fleets of the given sizes out of the stand-ins in fakes.py and
+measures the time of creating the MNI object, reset_all, install_all,
+pressing the user buttons with a schedule (Quanto fleets only, the
+percentiles are those of the skews) and connect_serial_to_file_all. With
+--hub-size, the installs of the nodes share emulated USB hubs that fail
+when overloaded, and --hub-limit sets the resource limit of MNI for the
+hubs. For every operation it reports the wall time, the throughput in nodes
+(or serial messages) per second, percentiles of the per node latency, the
+number of per node failures and the CPU time and peak memory of the
+benchmark process and its children.
+
+usage: python benchmarks/fleet.py -n 10,100,1000 --latency 0.02
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import optparse
+import tempfile
+import resource
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from mni import mni
+from mni import node
+from mni import rci
+from mni import schedule
+import fakes
+
+COLUMNS = ["fleet", "nodes", "operation", "wall_s", "per_s", "p50_ms",
+        "p90_ms", "p99_ms", "errors", "user_s", "sys_s", "maxrss_mb"]
+
+
+def percentile(values, p):
+    """Nearest rank percentile p (0-100) of values, or None if empty."""
+    if len(values) == 0:
+        return None
+    values = sorted(values)
+    rank = int(round(p / 100.0 * (len(values) - 1)))
+    return values[rank]
+
+
+class Timing:
+    """Per node latencies and failures of one operation."""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+
+    def wrap(self, nodes, method):
+        """Time every call of method on nodes. Exceptions are counted as
+        errors and raised again, for the *_all methods of MNI to report."""
+        for n in nodes:
+            original = getattr(n, method)
+            def timed(original=original):
+                start = time.time()
+                try:
+                    try:
+                        return original()
+                    except Exception:
+                        self.errors += 1
+                        raise
+                finally:
+                    self.latencies.append(time.time() - start)
+            setattr(n, method, timed)
+
+    def unwrap(self, nodes, method):
+        for n in nodes:
+            delattr(n, method)
+
+
+def measure(results, fleet, size, operation, function, timing=None):
+    """Run function and append a row with its measurements to results.
+    function returns the number of items it processed, or None for one item
+    per node."""
+
+    selfBefore = resource.getrusage(resource.RUSAGE_SELF)
+    childrenBefore = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.time()
+    items = function()
+    wall = time.time() - start
+    selfAfter = resource.getrusage(resource.RUSAGE_SELF)
+    childrenAfter = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    if items is None:
+        items = size
+    if timing is None:
+        timing = Timing()
+
+    row = {
+        "fleet": fleet,
+        "nodes": size,
+        "operation": operation,
+        "wall_s": wall,
+        "per_s": items / wall,
+        "p50_ms": percentile(timing.latencies, 50),
+        "p90_ms": percentile(timing.latencies, 90),
+        "p99_ms": percentile(timing.latencies, 99),
+        "errors": timing.errors,
+        "user_s": (selfAfter.ru_utime - selfBefore.ru_utime) +
+            (childrenAfter.ru_utime - childrenBefore.ru_utime),
+        "sys_s": (selfAfter.ru_stime - selfBefore.ru_stime) +
+            (childrenAfter.ru_stime - childrenBefore.ru_stime),
+        # peak of the benchmark process, ru_maxrss is in kilobytes on Linux
+        "maxrss_mb": selfAfter.ru_maxrss / 1024.0,
+    }
+    for key in ["p50_ms", "p90_ms", "p99_ms"]:
+        if row[key] is not None:
+            row[key] *= 1000.0
+    results.append(row)
+    print_row(row)
+
+
+def print_header():
+    print "%-7s %6s %-10s %8s %9s %8s %8s %8s %6s %7s %7s %9s"%tuple(COLUMNS)
+    sys.stdout.flush()
+
+
+def print_row(row):
+    values = []
+    for key in COLUMNS:
+        value = row[key]
+        if value is None:
+            values.append("-")
+        elif isinstance(value, float):
+            values.append("%.2f"%(value,))
+        else:
+            values.append(str(value))
+    print "%-7s %6s %-10s %8s %9s %8s %8s %8s %6s %7s %7s %9s"%tuple(values)
+    sys.stdout.flush()
+
+
+def write_config(fileName, nodeType, nodes, options):
+    f = open(fileName, "w")
+    f.write("[Nodes]\nnumNodes: %d\ntype: %s\nmakeCmd: true\n"%(
+        len(nodes), nodeType))
+    f.write("listenCmd: %s %s $serial %d\n\n"%(sys.executable,
+        os.path.join(fakes.BIN, "fake-listen"), options.packetSize))
+    installCmd = "%s %s %f %f"%(sys.executable,
+            os.path.join(fakes.BIN, "fake-install"), options.installDelay,
+            options.installFailureRate)
+    for (i, nodeOptions) in enumerate(nodes):
+        command = installCmd
+        if options.hubSize > 0:
+            # every hubSize nodes share an emulated USB hub
+            hub = "hub%d"%(i / options.hubSize,)
+            hubDirectory = os.path.join(os.path.dirname(fileName), hub)
+            if not os.path.exists(hubDirectory):
+                os.mkdir(hubDirectory)
+            command += " %s %d"%(hubDirectory, options.hubCapacity)
+            nodeOptions["resources"] = hub
+        f.write("[Node%d]\nid: %d\ninstallCmd: %s\n"%(i + 1, i + 1,
+            command))
+        for key in nodeOptions:
+            f.write("%s: %s\n"%(key, nodeOptions[key]))
+        f.write("\n")
+    if options.hubLimit > 0:
+        f.write("[Resources]\ndefault: %d\n"%(options.hubLimit,))
+    f.close()
+
+
+def run_fleet(fleet, size, options, results):
+    directory = tempfile.mkdtemp(prefix="mni-bench-")
+    serials = [fakes.FakeSerial(options.packetSize, options.rate)
+            for i in range(size)]
+    digi = None
+    dead = None
+    try:
+        if fleet == "telos":
+            motes = os.path.join(directory, "motes")
+            f = open(motes, "w")
+            for (i, s) in enumerate(serials):
+                f.write("FAKE%05d %s\n"%(i, s.path))
+            f.close()
+            os.environ.update(fakes.fake_environment(motes))
+            nodes = [{"serialid": "FAKE%05d"%(i,)} for i in range(size)]
+            nodeType = "TelosMote"
+        else:
+            digi = fakes.FakeDigi(options.latency, options.jitter,
+                    options.failureRate)
+            node.QuantoTestbedMote.TELNET_PORT = digi.telnetPort
+            nodes = [{"ip": digi.host(), "serial": s.path, "timeoffset": 0}
+                    for s in serials]
+            if options.dead > 0:
+                dead = fakes.DeadDigi()
+                for n in nodes[:options.dead]:
+                    n["ip"] = dead.host()
+            nodeType = "QuantoTestbedMote"
+
+        configFile = os.path.join(directory, "config.ini")
+        write_config(configFile, nodeType, nodes, options)
+
+        m = []
+        def create():
+            m.append(mni.MNI(configFile))
+        measure(results, fleet, size, "init", create)
+        m = m[0]
+
+        timing = Timing()
+        timing.wrap(m.get_nodes(), "reset")
+        def reset():
+            m.reset_all()
+        measure(results, fleet, size, "reset_all", reset, timing)
+        timing.unwrap(m.get_nodes(), "reset")
+
+        timing = Timing()
+        timing.wrap(m.get_nodes(), "install")
+        def install():
+            try:
+                m.install_all()
+            except mni.InstallError:
+                pass
+        measure(results, fleet, size, "install", install, timing)
+        timing.unwrap(m.get_nodes(), "install")
+
+        if fleet == "quanto":
+            # the latencies of this row are the skews of the actions
+            timing = Timing()
+            def press():
+                s = schedule.Schedule()
+                s.press(m.get_nodes(), 0.0)
+                results = s.run()
+                timing.latencies = [r["skew"] for r in results]
+                timing.errors = len([r for r in results
+                    if r["error"] is not None])
+                return len(results)
+            measure(results, fleet, size, "schedule", press, timing)
+
+        for s in serials:
+            s.start()
+        def capture():
+            m.connect_serial_to_file_all(os.path.join(directory, "bench"),
+                    timeout=options.captureTime)
+            return sum([n.get_message_counter() for n in m.get_nodes()])
+        measure(results, fleet, size, "capture", capture)
+    finally:
+        for s in serials:
+            s.close()
+        if digi is not None:
+            print "RCI requests: %(requests)d, challenges: %(challenges)d,\
+ failures: %(failures)d"%digi.counts
+            results[-1]["rci"] = dict(digi.counts)
+            digi.close()
+        if dead is not None:
+            dead.close()
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--nodes",
+            action="store", type="string", dest="sizes", default="10,100",
+            help="comma separated list of fleet sizes.")
+    parser.add_option("-f", "--fleet",
+            action="append", type="choice", choices=["telos", "quanto"],
+            dest="fleets", default=None,
+            help="fleet type, telos (motelist and tos-bsl) or quanto (Digi\
+ Connect boxes). Can be given several times, default both.")
+    parser.add_option("--latency",
+            action="store", type="float", dest="latency", default=0.01,
+            help="latency of the emulated RCI in seconds.")
+    parser.add_option("--jitter",
+            action="store", type="float", dest="jitter", default=0.01,
+            help="maximum additional random RCI latency in seconds.")
+    parser.add_option("--failure-rate",
+            action="store", type="float", dest="failureRate", default=0.0,
+            help="probability that an RCI request fails.")
+    parser.add_option("--dead",
+            action="store", type="int", dest="dead", default=0,
+            help="number of nodes of a Quanto fleet whose Digi Connect box\
+ accepts connections but never answers.")
+    parser.add_option("--rci-timeout",
+            action="store", type="float", dest="rciTimeout",
+            default=rci.RCI.TIMEOUT,
+            help="timeout of an RCI request attempt in seconds.")
+    parser.add_option("--install-delay",
+            action="store", type="float", dest="installDelay", default=0.5,
+            help="duration of an install in seconds.")
+    parser.add_option("--install-failure-rate",
+            action="store", type="float", dest="installFailureRate",
+            default=0.0,
+            help="probability that an install fails.")
+    parser.add_option("--hub-size",
+            action="store", type="int", dest="hubSize", default=0,
+            help="number of nodes that share an emulated USB hub, 0 for no\
+ hubs.")
+    parser.add_option("--hub-capacity",
+            action="store", type="int", dest="hubCapacity", default=2,
+            help="installs a hub transfers at full speed. More are slower\
+ and fail more often.")
+    parser.add_option("--hub-limit",
+            action="store", type="int", dest="hubLimit", default=0,
+            help="limit of installs and resets per hub in the [Resources]\
+ section of the configuration, 0 for no limit.")
+    parser.add_option("--packet-size",
+            action="store", type="int", dest="packetSize", default=16,
+            help="size of the emulated serial packets in bytes.")
+    parser.add_option("--rate",
+            action="store", type="float", dest="rate", default=20.0,
+            help="serial packets per second and node.")
+    parser.add_option("--capture-time",
+            action="store", type="float", dest="captureTime", default=5.0,
+            help="duration of the serial capture in seconds.")
+    parser.add_option("-o", "--output",
+            action="store", type="string", dest="output", default=None,
+            help="also write the results as JSON to this file, to compare\
+ runs.")
+    (options, args) = parser.parse_args()
+
+    # every node needs a pseudo terminal and the pipes of its Listen process
+    (soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    rci.RCI.TIMEOUT = options.rciTimeout
+    fleets = options.fleets or ["telos", "quanto"]
+    results = []
+    print_header()
+    for fleet in fleets:
+        for size in [int(s) for s in options.sizes.split(",")]:
+            run_fleet(fleet, size, options, results)
+
+    if options.output is not None:
+        f = open(options.output, "w")
+        json.dump({"options": options.__dict__, "results": results}, f,
+                indent=2)
+        f.close()
+
+
+if __name__ == "__main__":
+    main()
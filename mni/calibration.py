@@ -0,0 +1,371 @@
+# vim: ts=4 et sw=4 sts=4
+
+import os
+import sys
+import imp
+import ast
+import json
+import time
+import bisect
+import tempfile
+import threading
+import ConfigParser
+
+
+class CalibrationTable:
+    """Compiled form of a Quanto calibration.
+
+    The calibration application reports a dictionary keyed by the numeric
+    value of the calibration resistor, where each value is a dictionary with
+    the keys 'res', 'freq' and 'E' (see QuantoTestbedMote.calibrate). Looking
+    up the energy per iCount for a given frequency used to scan this
+    dictionary on every call. The table keeps the calibration points sorted
+    by increasing resistor value in flat lists, so that a lookup is a single
+    binary search.
+    """
+
+    def __init__(self, frequencies={}):
+        keys = frequencies.keys()
+        keys.sort()
+        self.resistors = [frequencies[k]['res'] for k in keys]
+        self.freqs = [float(frequencies[k]['freq']) for k in keys]
+        self.energies = [float(frequencies[k]['E']) for k in keys]
+        # Frequencies decrease with increasing resistor values. bisect
+        # expects increasing values, so we search the negated frequencies.
+        self._negFreqs = [-f for f in self.freqs]
+
+    def __len__(self):
+        return len(self.freqs)
+
+    def get_energy(self, icount, time):
+        """Return the energy in milli Joule consumed by icount iCounts during
+        time seconds, or -1 if the table is empty."""
+
+        if len(self.freqs) == 0:
+            return -1
+
+        if time <= 0:
+            return 0.0
+        frequency = icount / float(time)
+
+        # index of the first calibration point with a frequency below ours
+        i = bisect.bisect_right(self._negFreqs, -frequency)
+        last = len(self.freqs) - 1
+        if i >= last:
+            # the given frequency is below our lowest frequency measurement.
+            return icount * self.energies[last]
+        if i == 0:
+            # the given frequency is above our highest frequency measurement.
+            return icount * self.energies[0]
+
+        # interpolate between the two calibration frequencies
+        df = self.freqs[i-1] - self.freqs[i]
+        dE = self.energies[i-1] - self.energies[i]
+
+        return icount * (
+                (frequency - self.freqs[i]) / df * dE + self.energies[i])
+
+    def get_power(self, icount, time):
+        """Average power in milli Watt consumed during time seconds."""
+        if time <= 0:
+            return 0.0
+
+        return self.get_energy(icount, time) / float(time)
+
+    def get_power_array(self, icount, time):
+        """get_power for NumPy arrays of iCounts and times, all larger than
+        0, or -1 for all of them if the table is empty."""
+
+        # only the analysis needs NumPy
+        import numpy
+        icount = numpy.asarray(icount, dtype=float)
+        time = numpy.asarray(time, dtype=float)
+        if len(self.freqs) == 0:
+            return -numpy.ones(len(time))
+        if len(self.freqs) == 1:
+            return icount * self.energies[0] / time
+
+        frequency = icount / time
+        i = numpy.searchsorted(self._negFreqs, -frequency, side="right")
+        last = len(self.freqs) - 1
+        freqs = numpy.array(self.freqs)
+        energies = numpy.array(self.energies)
+        # the same cases as in get_energy
+        below = numpy.clip(i, 1, max(last, 1))
+        df = freqs[below-1] - freqs[below]
+        dE = energies[below-1] - energies[below]
+        perICount = numpy.where(df != 0,
+                (frequency - freqs[below]) / numpy.where(df != 0, df, 1) * dE
+                + energies[below], energies[below])
+        perICount = numpy.where(i >= last, energies[last], perICount)
+        perICount = numpy.where(i == 0, energies[0], perICount)
+        return icount * perICount / time
+
+
+class CalibrationStore:
+    """Versioned on-disk database of Quanto calibrations.
+
+    Every node has its own JSON file in the store directory, holding the full
+    history of calibrations for that node together with their dates. Files
+    are only read when a node's calibration is requested, and parsed
+    calibrations are cached, so loading a large testbed reads exactly one
+    small file per node and never evaluates any code.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory="calibration"):
+        self.directory = directory
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _file_name(self, key):
+        key = str(key).replace(os.sep, "_")
+        return os.path.join(self.directory, "%s.json"%(key,))
+
+    def _read(self, key):
+        # Called with self._lock held.
+        if key in self._cache:
+            return self._cache[key]
+
+        fileName = self._file_name(key)
+        if not os.path.exists(fileName):
+            history = []
+        else:
+            f = open(fileName, "r")
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+            if data.get("version") != self.VERSION:
+                raise ValueError, "Unsupported calibration file version in %s"%(
+                        fileName,)
+            history = data["history"]
+
+        self._cache[key] = history
+        return history
+
+    def _write(self, key, history):
+        # Called with self._lock held. Write to a temporary file first, so
+        # that a crash never leaves a truncated calibration behind.
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        fileName = self._file_name(key)
+        fd, tmpName = tempfile.mkstemp(dir=self.directory)
+        f = os.fdopen(fd, "w")
+        try:
+            json.dump({"version": self.VERSION, "node": str(key),
+                "history": history}, f, indent=1)
+        finally:
+            f.close()
+        os.rename(tmpName, fileName)
+
+    def add(self, key, frequencies, date=None):
+        """Append a calibration for the node identified by key to its
+        history. frequencies has the format expected by
+        QuantoTestbedMote.calibrate."""
+
+        if date is None:
+            date = time.time()
+        points = []
+        for k in sorted(frequencies.keys()):
+            f = frequencies[k]
+            points.append([k, f['res'], f['freq'], f['E']])
+
+        self._lock.acquire()
+        try:
+            history = list(self._read(key))
+            history.append({"timestamp": date, "date": time.ctime(date),
+                "calibration": points})
+            self._write(key, history)
+            self._cache[key] = history
+        finally:
+            self._lock.release()
+
+    def history(self, key):
+        """Return the list of (timestamp, frequencies) tuples stored for a
+        node, oldest first."""
+
+        self._lock.acquire()
+        try:
+            history = self._read(key)
+        finally:
+            self._lock.release()
+
+        return [(entry["timestamp"], self._to_frequencies(entry))
+                for entry in history]
+
+    def latest(self, key):
+        """Return the most recent calibration of a node, or None."""
+
+        self._lock.acquire()
+        try:
+            history = self._read(key)
+        finally:
+            self._lock.release()
+
+        if len(history) == 0:
+            return None
+        return self._to_frequencies(history[-1])
+
+    def has_calibration(self, key):
+        return self.latest(key) is not None
+
+    def import_ini(self, fileName, keys=None):
+        """Import a legacy calibration.ini file as written by older versions
+        of QuantoMNI.calibrate_all, only for the nodes in keys if given. The
+        dictionaries in that file are read as literals only, so the file can
+        not execute code. Calibrations without a date get the modification
+        time of the file. A calibration whose date is already in the
+        history of its node is skipped, so importing a file again adds
+        nothing. Returns the keys of the imported calibrations."""
+
+        config = ConfigParser.RawConfigParser()
+        config.read(fileName)
+
+        imported = []
+        for section in config.sections():
+            if not config.has_option(section, "calibration"):
+                continue
+            key = section
+            if key.startswith("Node"):
+                key = key[len("Node"):]
+            if keys is not None and key not in keys:
+                continue
+            frequencies = ast.literal_eval(config.get(section, "calibration"))
+            date = None
+            if config.has_option(section, "calibrationDate"):
+                try:
+                    date = time.mktime(time.strptime(
+                        config.get(section, "calibrationDate")))
+                except ValueError:
+                    pass
+            if date is None:
+                date = os.path.getmtime(fileName)
+            if date in [t for (t, f) in self.history(key)]:
+                continue
+            self.add(key, frequencies, date)
+            imported.append(key)
+
+        return imported
+
+    def _to_frequencies(self, entry):
+        frequencies = {}
+        for (k, res, freq, E) in entry["calibration"]:
+            frequencies[k] = {'res': res, 'freq': freq, 'E': E}
+        return frequencies
+
+
+_calibratequanto = None
+_calibratequantoLock = threading.Lock()
+
+def calibratequanto_directory():
+    """The directory of the CalibrateQuanto application in $TOSROOT."""
+    return os.path.join(os.environ['TOSROOT'],
+            "apps/quantoApps/CalibrateQuanto")
+
+def load_calibratequanto():
+    """Import the calibratequanto module of the CalibrateQuanto application
+    in $TOSROOT by its absolute path. The module is only loaded once, and
+    the working directory of the process is never changed."""
+
+    global _calibratequanto
+    _calibratequantoLock.acquire()
+    try:
+        if _calibratequanto is None:
+            directory = calibratequanto_directory()
+            # the module imports the message classes generated next to it
+            if directory not in sys.path:
+                sys.path.append(directory)
+            _calibratequanto = imp.load_source("calibratequanto",
+                    os.path.join(directory, "calibratequanto.py"))
+    finally:
+        _calibratequantoLock.release()
+    return _calibratequanto
+
+def close_calibratequanto(cq):
+    """Close the serial source a CalibrateQuanto object listens on, so the
+    serial port of its node is free again. The application listens through
+    a TinyOS MoteIF, whose finishAll closes its sources."""
+    if hasattr(cq, "close"):
+        cq.close()
+    elif hasattr(cq, "mif"):
+        cq.mif.finishAll()
+
+
+class CalibrationListener(threading.Thread):
+    """Thread that listens for the calibration of a single node.
+
+    After the thread finished, frequencies holds the calibration of the
+    node, or error the exception raised while listening. The thread is a
+    daemon, so a node that never reports does not keep the process alive.
+    After cancel, a calibration that still arrives is thrown away, so
+    neither the node nor the store see it, and the serial port of the node
+    is closed.
+    """
+
+    def __init__(self, node, store=None):
+        threading.Thread.__init__(self, name="calibrate-%s"%(node.ip,))
+        self.setDaemon(True)
+        self.node = node
+        self.store = store
+        self.frequencies = None
+        self.error = None
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.cq = None
+
+    def cancel(self):
+        """Give up on the node, e.g. because its deadline passed."""
+        self.lock.acquire()
+        try:
+            self.cancelled = True
+            if self.cq is not None:
+                close_calibratequanto(self.cq)
+        finally:
+            self.lock.release()
+
+    def _cancelled_error(self):
+        return CalibrationCancelled("calibration of %s was cancelled"%(
+            self.node.ip,))
+
+    def run(self):
+        try:
+            cq = load_calibratequanto().CalibrateQuanto(
+                    serial="serial@%s:epic"%(self.node.serial,),
+                    repeat=False,
+                    debug=False)
+            self.lock.acquire()
+            try:
+                self.cq = cq
+                if self.cancelled:
+                    close_calibratequanto(cq)
+                    self.error = self._cancelled_error()
+                    return
+            finally:
+                self.lock.release()
+            cq.listen()
+            self.lock.acquire()
+            try:
+                if self.cancelled:
+                    self.error = self._cancelled_error()
+                    return
+                self.frequencies = cq.frequencies
+                self.node.calibrate(self.frequencies)
+                if self.store is not None:
+                    self.store.add(self.node.ip, self.frequencies)
+            finally:
+                self.lock.release()
+        except Exception, e:
+            if self.cancelled:
+                # listen fails once cancel closed the serial source
+                self.error = self._cancelled_error()
+            else:
+                self.error = e
+
+
+class CalibrationCancelled(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
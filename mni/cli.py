@@ -0,0 +1,340 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""The mni command and its subcommands.
+
+This module is imported on every start of the mni command, so it must only
+import what the control commands need. Everything that pulls in NumPy or
+the log parsers is imported by the subcommands that use it.
+"""
+
+import sys
+import atexit
+import optparse
+import daemon
+import tracing
+import metrics
+
+USAGE = """usage: mni COMMAND [options]
+
+Commands:
+%s
+Run 'mni COMMAND --help' for the options of a command."""
+
+
+def _parser(name, usage=""):
+    parser = optparse.OptionParser(prog="mni %s"%(name,), usage=usage)
+    parser.add_option("-c", "--config",
+            action="store", type="string", dest="config",
+            default="config.ini",
+            help="testbed configuration file.")
+    parser.add_option("-s", "--socket",
+            action="store", type="string", dest="socket",
+            default=daemon.DEFAULT_SOCKET,
+            help="unix socket of the mni daemon.")
+    parser.add_option("--local",
+            action="store_true", dest="local", default=False,
+            help="do not use the mni daemon, even if it is running.")
+    parser.add_option("--plain",
+            action="store_true", dest="plain", default=False,
+            help="use a plain MNI instead of a QuantoMNI.")
+    parser.add_option("--skip-bad",
+            action="store_true", dest="skipBad", default=False,
+            help="leave out the nodes that failed the last 'mni status', if\
+ it is recent. Does not apply to commands sent to the daemon.")
+    parser.add_option("--trace",
+            action="callback", type="string", callback=_trace_option,
+            help="write a trace of the command in the Chrome trace event\
+ format to TRACE. Commands sent to the daemon are not traced.")
+    return parser
+
+
+def _trace_option(option, opt, value, parser):
+    tracing.enable()
+    atexit.register(tracing.export, value)
+
+
+def _skip_nodes(options):
+    if not options.skipBad:
+        return None
+    import status
+    return status.bad_sections(status.load_cache(
+        maxAge=status.DEFAULT_MAX_AGE, configFile=options.config))
+
+
+def _add_node_option(parser):
+    parser.add_option("-n", "--node",
+            action="append", type="int", dest="nodes", default=None,
+            help="id of a node to use. Can be given several times, the\
+ default is all nodes.")
+
+
+def _execute(options, command, nodes=None, **args):
+    # Run a daemon command, on the daemon if one is listening and else
+    # on a MNI created just for this command.
+    reply = None
+    if not options.local:
+        reply = daemon.try_command(command, nodes, options.socket, **args)
+    if reply is None:
+        d = daemon.MNIDaemon(options.config, quanto=not options.plain,
+                skipNodes=_skip_nodes(options))
+        reply = d.execute({"command": command, "nodes": nodes,
+            "args": args})
+    return reply
+
+
+def _node_command(name, command, description):
+    def run(argv):
+        parser = _parser(name, "%%prog [options]\n\n%s"%(description,))
+        _add_node_option(parser)
+        (options, args) = parser.parse_args(argv)
+        reply = _execute(options, command, options.nodes)
+        return daemon.print_errors(reply)
+    return run
+
+
+def list_nodes(argv):
+    parser = _parser("list", "%prog [options]\n\nList the configured nodes.")
+    (options, args) = parser.parse_args(argv)
+    reply = _execute(options, "list")
+    for n in reply["result"]:
+        print "Node %d, IP: %s, serial: %s"%(n["id"], n["ip"], n["serial"])
+    return daemon.print_errors(reply)
+
+
+def install(argv):
+    parser = _parser("install",
+            "%prog [options]\n\nCompile the application and install it.")
+    _add_node_option(parser)
+    parser.add_option("--no-compile",
+            action="store_false", dest="compile", default=True,
+            help="install the application without compiling it first.")
+    (options, args) = parser.parse_args(argv)
+    reply = _execute(options, "install", options.nodes,
+            compile=options.compile)
+    return daemon.print_errors(reply)
+
+
+def analyze(argv):
+    parser = _parser("analyze", "%prog [options]\n\n\
+Parse the Quanto logs of a measurement and estimate the state powers.")
+    parser.add_option("-b", "--base",
+            action="store", type="string", dest="base", default="quanto",
+            help="base file name of the logs.")
+    parser.add_option("-B", "--bootstrap",
+            action="store", type="int", dest="bootstrap", default=0,
+            help="number of bootstrap replicates for confidence intervals.")
+    parser.add_option("-P", "--processes",
+            action="store", type="int", dest="processes", default=None,
+            help="number of worker processes, default one per CPU.")
+    parser.add_option("--no-parse",
+            action="store_false", dest="parse", default=True,
+            help="use the existing .pwr files, e.g. those of mni simulate.")
+    (options, args) = parser.parse_args(argv)
+
+    import quanto
+    m = quanto.QuantoMNI(options.config)
+    m.calibrate_all(readFromFile=True)
+    if options.parse:
+        m.parse_quanto_log_all(baseFileName=options.base)
+        m.process_quanto_log_all(baseFileName=options.base)
+    m.get_energy_per_quanto_state_all(baseFileName=options.base,
+            convexOpt=True, processes=options.processes,
+            bootstrap=options.bootstrap)
+
+    for n in m.get_nodes():
+        p = n.statePower
+        sys.stdout.write("Node %d, IP: %s "%(n.id, n.ip))
+        states = p.keys()
+        states.sort()
+        for state in states:
+            sys.stdout.write("%s %4.2f mW, "%(state, p[state]))
+        sys.stdout.write("\n")
+        print "Average Power: %.2f mW"%(n.averagePower,)
+        print "Always Off States: ", n.alwaysOffStates
+        print "Always On States: ", n.alwaysOnStates
+    return 0
+
+
+def simulate(argv):
+    parser = _parser("simulate", "%prog [options]\n\n\
+Write .pwr files with known state powers for the SimulatedQuantoMote nodes\
+ of the configuration, and store their calibration.")
+    parser.add_option("-b", "--base",
+            action="store", type="string", dest="base", default="quanto",
+            help="base file name of the logs.")
+    parser.add_option("-i", "--intervals",
+            action="store", type="int", dest="intervals", default=None,
+            help="number of intervals per node.")
+    parser.add_option("-S", "--size",
+            action="store", type="float", dest="size", default=None,
+            help="size of every .pwr file in megabytes.")
+    parser.add_option("--calibration-dir",
+            action="store", type="string", dest="calibrationDir",
+            default="calibration",
+            help="calibration store the calibrations are added to.")
+    (options, args) = parser.parse_args(argv)
+    if options.intervals is None and options.size is None:
+        parser.error("either --intervals or --size is required")
+
+    import simulate
+    import calibration
+    if options.plain:
+        import mni
+        m = mni.MNI(options.config)
+    else:
+        import quanto
+        m = quanto.QuantoMNI(options.config)
+    size = None
+    if options.size is not None:
+        size = int(options.size * 1024 * 1024)
+    written = simulate.write_measurement(m, options.base, options.intervals,
+            size)
+    store = calibration.CalibrationStore(options.calibrationDir)
+    for n in m.get_nodes():
+        if n.id in written:
+            store.add(n.ip, n.frequencies)
+            print "Node %d: %d intervals in %s.pwr"%(n.id, written[n.id],
+                    m.log_file_name(n, options.base))
+    return 0
+
+
+def show_status(argv):
+    parser = _parser("status", "%prog [options]\n\n\
+Check all configured nodes at once without configuring them: their Digi\
+ Connect box, serial device and motelist entry. The report is cached for\
+ --skip-bad.")
+    parser.add_option("-t", "--timeout",
+            action="store", type="float", dest="timeout", default=None,
+            help="seconds to wait for a Digi Connect box.")
+    parser.add_option("--cache",
+            action="store", type="string", dest="cache", default=None,
+            help="file the report is written to, default status.json.")
+    parser.add_option("--json",
+            action="store_true", dest="json", default=False,
+            help="print the report as JSON.")
+    (options, args) = parser.parse_args(argv)
+
+    import status
+    timeout = options.timeout
+    if timeout is None:
+        timeout = status.RCI_TIMEOUT
+    report = status.sweep(options.config, timeout)
+    status.write_cache(report, options.cache or status.DEFAULT_CACHE)
+
+    if options.json:
+        import json
+        print json.dumps(report, indent=2, sort_keys=True)
+        return len(status.bad_sections(report)) > 0 and 1 or 0
+
+    results = report["nodes"].values()
+    results.sort(key=lambda r: int(r["section"][len("Node"):]))
+    for r in results:
+        checks = r["checks"]
+        names = checks.keys()
+        names.sort()
+        failed = ["%s: %s"%(name, checks[name]["error"]) for name in names
+                if not checks[name]["ok"]]
+        sys.stdout.write("%-8s id %-4s %-4s %s\n"%(r["section"], r["id"],
+            r["ok"] and "ok" or "BAD", "; ".join(failed)))
+    print "Checked %d nodes in %.2f s"%(len(results), report["seconds"])
+    return len(status.bad_sections(report)) > 0 and 1 or 0
+
+
+def run_daemon(argv):
+    parser = _parser("daemon", "%prog [options]\n\n\
+Keep the nodes configured and serve commands until stopped. The other\
+ commands use the daemon if it listens on their socket.")
+    parser.add_option("--stop",
+            action="store_true", dest="stop", default=False,
+            help="shut down the daemon listening on the socket.")
+    parser.add_option("--metrics-port",
+            action="store", type="int", dest="metricsPort", default=None,
+            help="serve metrics in the Prometheus text format on this port\
+ of localhost.")
+    parser.add_option("--metrics-socket",
+            action="store", type="string", dest="metricsSocket",
+            default=None,
+            help="serve metrics in the Prometheus text format on this unix\
+ socket.")
+    (options, args) = parser.parse_args(argv)
+
+    if options.stop:
+        daemon.send_command("shutdown", socketPath=options.socket)
+        return 0
+
+    if daemon.is_running(options.socket):
+        sys.stderr.write("A daemon is already listening on %s\n"%(
+            options.socket,))
+        return 1
+
+    d = daemon.MNIDaemon(options.config, options.socket, not options.plain,
+            _skip_nodes(options))
+    sys.stdout.write("Serving nodes: ")
+    for n in d.mni.get_nodes():
+        sys.stdout.write("%d "%(n.id,))
+    sys.stdout.write("\non %s\n"%(options.socket,))
+    if options.metricsPort is not None or options.metricsSocket is not None:
+        metrics.serve(options.metricsPort, options.metricsSocket)
+        sys.stdout.write("Metrics on %s\n"%(options.metricsSocket or
+            "http://localhost:%d/metrics"%(options.metricsPort,),))
+    sys.stdout.flush()
+
+    try:
+        d.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+# (name, function, description), in the order of the usage message
+COMMANDS = [
+    ("list", list_nodes, "list the configured nodes"),
+    ("reset", _node_command("reset", "reset", "Reset the nodes."),
+        "reset nodes"),
+    ("stop", _node_command("stop", "stop", "Stop the nodes."),
+        "stop nodes"),
+    ("start", _node_command("start", "start", "Start stopped nodes."),
+        "start stopped nodes"),
+    ("press", _node_command("press", "press_usr",
+        "Press the user button of the nodes."),
+        "press the user button"),
+    ("serial", _node_command("serial", "serial_mode",
+        "Connect the serial port of the nodes to the mote."),
+        "put nodes into serial mode"),
+    ("programming", _node_command("programming", "programming_mode",
+        "Connect the serial port of the nodes to the bootstrap loader."),
+        "put nodes into programming mode"),
+    ("status", show_status, "check which nodes are ready"),
+    ("install", install, "compile and install the application"),
+    ("analyze", analyze, "estimate the state powers from Quanto logs"),
+    ("simulate", simulate, "write logs of simulated Quanto nodes"),
+    ("daemon", run_daemon, "run the mni daemon"),
+]
+
+
+def main(argv=None):
+    """Run the mni command with the arguments argv, by default those of the
+    process. Returns the exit status."""
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    commands = {}
+    lines = ""
+    for (name, function, description) in COMMANDS:
+        commands[name] = function
+        lines += "  %-12s %s\n"%(name, description)
+
+    if len(argv) == 0 or argv[0] in ("-h", "--help"):
+        print USAGE%(lines,)
+        return 0
+    if argv[0] not in commands:
+        sys.stderr.write("Unknown command %s\n\n"%(argv[0],))
+        sys.stderr.write(USAGE%(lines,) + "\n")
+        return 1
+
+    try:
+        return commands[argv[0]](argv[1:])
+    except daemon.DaemonError, e:
+        sys.stderr.write("ERROR: %s\n"%(e,))
+        return 1
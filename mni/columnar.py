@@ -0,0 +1,200 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Parsed Quanto intervals in columns on disk.
+
+A columns directory, by convention the name of the .pwr file with .cols
+appended, holds a NumPy .npy file per column and a meta.json with the state
+names, the time offset of the node and the number of intervals:
+
+    signatures.npy  activeStates of every distinct signature, one row each
+    signature.npy   index into signatures of every interval
+    time.npy        duration of every interval in seconds
+    icount.npy      iCounts of every interval
+
+open_columns memory-maps the columns, so reopening a large measurement
+costs no parsing, and load_intervals hands them to the analysis:
+
+    c = columnar.open_columns("quanto.10.0.0.1.log.pwr.cols")
+    print c.states, len(c), c.time.sum()
+    intervals = columnar.load_intervals(c.directory, n.calibrationTable,
+            n.ip)
+"""
+
+import os
+import json
+import array
+import numpy
+
+VERSION = 1
+EXTENSION = ".cols"
+META = "meta.json"
+COLUMNS = [("signatures", numpy.int32), ("signature", numpy.int32),
+        ("time", numpy.float64), ("icount", numpy.int64)]
+
+
+class Columns:
+    """The memory-mapped columns of a columns directory, see open_columns.
+    meta is the dictionary of meta.json."""
+
+    def __init__(self, directory, meta, signatures, signature, time, icount):
+        self.directory = directory
+        self.meta = meta
+        self.states = meta["states"]
+        self.timeoffset = meta["timeoffset"]
+        self.signatures = signatures
+        self.signature = signature
+        self.time = time
+        self.icount = icount
+
+    def __len__(self):
+        return len(self.time)
+
+
+def columns_name(pwrFileName):
+    return pwrFileName + EXTENSION
+
+
+def write_columns(directory, states, signatures, signature, time, icount,
+        timeoffset=0):
+    """Write the columns of a node, in the form statepower.load_columns
+    takes them, to directory. meta.json is written last, so a directory
+    without it is incomplete."""
+
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    metaFile = os.path.join(directory, META)
+    if os.path.exists(metaFile):
+        os.remove(metaFile)
+
+    signatures = numpy.array(signatures, dtype=numpy.int32).reshape(
+            (len(signatures), len(states)))
+    values = {"signatures": signatures, "signature": signature,
+            "time": time, "icount": icount}
+    for (name, dtype) in COLUMNS:
+        numpy.save(os.path.join(directory, name + ".npy"),
+                numpy.asarray(values[name], dtype=dtype))
+
+    meta = {"version": VERSION, "states": list(states),
+            "timeoffset": timeoffset, "intervals": len(time)}
+    f = open(metaFile + ".tmp", "w")
+    json.dump(meta, f, indent=2, sort_keys=True)
+    f.close()
+    os.rename(metaFile + ".tmp", metaFile)
+
+
+def open_columns(directory):
+    """Memory-map the columns in directory. Returns a Columns."""
+
+    f = open(os.path.join(directory, META))
+    try:
+        meta = json.load(f)
+    finally:
+        f.close()
+    if meta.get("version") != VERSION:
+        raise ColumnarError, "%s has version %s, not %d"%(directory,
+                meta.get("version"), VERSION)
+
+    columns = {}
+    for (name, dtype) in COLUMNS:
+        columns[name] = numpy.load(os.path.join(directory, name + ".npy"),
+                mmap_mode="r")
+    if len(columns["time"]) != meta["intervals"]:
+        raise ColumnarError, "%s has %d intervals instead of %d"%(directory,
+                len(columns["time"]), meta["intervals"])
+    return Columns(directory, meta, columns["signatures"],
+            columns["signature"], columns["time"], columns["icount"])
+
+
+def is_current(directory, pwrFileName):
+    """Whether the columns in directory are complete and not older than the
+    .pwr file, if there is one."""
+
+    metaFile = os.path.join(directory, META)
+    if not os.path.exists(metaFile):
+        return False
+    if not os.path.exists(pwrFileName):
+        return True
+    return os.path.getmtime(metaFile) >= os.path.getmtime(pwrFileName)
+
+
+def convert_pwr_file(pwrFileName, directory=None, timeoffset=0):
+    """Parse a .pwr file once and write its intervals as columns, by default
+    to columns_name(pwrFileName). Like load_pwr_file, a change of the
+    number of states drops the intervals before it. Returns the directory.
+    """
+
+    if directory is None:
+        directory = columns_name(pwrFileName)
+
+    states = []
+    # signature as in the file -> index into signatures
+    index = {}
+    signatures = []
+    signature = array.array("i")
+    time = array.array("d")
+    icount = array.array("l")
+
+    f = open(pwrFileName, "r")
+    for line in f:
+        if line.startswith("#states:"):
+            newStates = line.split()[1:]
+            if len(newStates) != len(states):
+                index = {}
+                signatures = []
+                signature = array.array("i")
+                time = array.array("d")
+                icount = array.array("l")
+            states = newStates
+            continue
+        if len(states) == 0:
+            continue
+
+        l = line.rsplit(None, 3)
+        if len(l) != 4:
+            continue
+        try:
+            #time is in uS, convert it to seconds
+            t = float(l[1])/1e6
+            c = int(l[2])
+            int(l[3])
+        except ValueError:
+            continue
+
+        i = index.get(l[0])
+        if i is None:
+            activeStates = l[0].split()
+            if len(activeStates) != len(states):
+                continue
+            try:
+                activeStates = [s != '-' and int(s) or 0
+                        for s in activeStates]
+            except ValueError:
+                continue
+            i = len(signatures)
+            index[l[0]] = i
+            signatures.append(activeStates)
+        signature.append(i)
+        time.append(t)
+        icount.append(c)
+    f.close()
+
+    write_columns(directory, states, signatures, signature, time, icount,
+            timeoffset)
+    return directory
+
+
+def load_intervals(directory, table, ip, sparse=False):
+    """The intervals in directory as statepower.PwrIntervals, see
+    statepower.load_columns."""
+
+    import statepower
+    c = open_columns(directory)
+    return statepower.load_columns(c.states, c.signatures.tolist(),
+            c.signature, c.time, c.icount, table, ip, sparse)
+
+
+class ColumnarError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
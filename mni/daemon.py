@@ -0,0 +1,224 @@
+# vim: ts=4 et sw=4 sts=4
+
+import os
+import sys
+import json
+import socket
+import threading
+import SocketServer
+import schedule
+
+# The scripts talk to a daemon listening on this socket in the current
+# directory, next to the config.ini it serves.
+DEFAULT_SOCKET = "mni.sock"
+
+
+class MNIDaemon:
+    """Keeps an MNI object and its nodes alive between commands.
+
+    Creating an MNI parses the configuration, runs motelist, probes every
+    node and builds its RCI connection. The daemon does this once and then
+    executes commands on the configured nodes that it receives over a Unix
+    domain socket, one JSON object per line (see send_command).
+    """
+
+    # command -> name of the node method that implements it
+    NODE_COMMANDS = {
+            "reset": "reset",
+            "stop": "stop",
+            "start": "start",
+            "push_usr": "push_usr",
+            "release_usr": "release_usr",
+            "serial_mode": "serial_mode",
+            "programming_mode": "programming_mode",
+    }
+
+    def __init__(self, configFile="config.ini", socketPath=DEFAULT_SOCKET,
+            quanto=True, skipNodes=None):
+        if quanto:
+            import quanto
+            self.mni = quanto.QuantoMNI(configFile, skipNodes=skipNodes)
+        else:
+            import mni
+            self.mni = mni.MNI(configFile, skipNodes=skipNodes)
+        self.socketPath = socketPath
+        self.server = None
+        # *_all methods and captures must not overlap
+        self.lock = threading.Lock()
+
+    def _select(self, ids):
+        if ids is None:
+            return self.mni.get_nodes()
+        ids = [str(id) for id in ids]
+        nodes = [n for n in self.mni.get_nodes() if str(n.id) in ids]
+        if len(nodes) != len(ids):
+            raise DaemonError, "Unknown node id in %s"%(", ".join(ids),)
+        return nodes
+
+    def _for_nodes(self, nodes, method):
+        # Run a node method on all nodes at once, collecting the errors.
+        errors = {}
+        failures = self.mni.call_all(method, nodes)
+        for id in failures:
+            errors[str(id)] = failures[id]
+        return errors
+
+    def execute(self, request):
+        """Execute a request dictionary and return the reply dictionary."""
+
+        command = request.get("command")
+        nodes = self._select(request.get("nodes"))
+        args = request.get("args", {})
+        result = None
+        errors = {}
+
+        if command in self.NODE_COMMANDS:
+            errors = self._for_nodes(nodes, self.NODE_COMMANDS[command])
+        elif command == "press_usr":
+            # hold the button like the scripts do, so the nodes notice
+            s = schedule.Schedule()
+            s.press(nodes, 0.0, args.get("duration", schedule.PRESS_DURATION))
+            for r in s.run():
+                e = r["error"]
+                if e is not None and str(r["node"]) not in errors:
+                    errors[str(r["node"])] = "%s: %s"%(e.__class__.__name__,
+                            e)
+        elif command == "list":
+            result = []
+            for n in nodes:
+                result.append({"id": n.id,
+                    "ip": getattr(n, "ip", None),
+                    "serial": getattr(n, "serial", None)})
+        elif command == "install":
+            self.lock.acquire()
+            try:
+                if args.get("compile", True):
+                    self.mni.compile()
+                result = self.mni.install_all(nodes)
+            finally:
+                self.lock.release()
+        elif command == "capture_start":
+            self.lock.acquire()
+            try:
+                for n in nodes:
+                    n.reset_message_counter()
+                self.mni.connect_serial_to_file_all(args["baseFileName"],
+                        blocking=False, nodes=nodes)
+            finally:
+                self.lock.release()
+        elif command == "capture_stop":
+            self.lock.acquire()
+            try:
+                self.mni.disconnect_serial_to_file_all(nodes)
+            finally:
+                self.lock.release()
+        elif command == "capture_status":
+            result = {}
+            for n in nodes:
+                result[str(n.id)] = n.get_message_counter()
+        elif command == "shutdown":
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            raise DaemonError, "Unknown command %s"%(command,)
+
+        return {"ok": len(errors) == 0, "result": result, "errors": errors}
+
+    def serve_forever(self):
+        """Listen on the socket until a shutdown command arrives."""
+
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+        self.server = _Server(self.socketPath, _Handler)
+        self.server.daemon = self
+        os.chmod(self.socketPath, 0600)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            os.remove(self.socketPath)
+            self.mni.disconnect_serial_to_file_all()
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                reply = self.server.daemon.execute(json.loads(line))
+            except Exception, e:
+                reply = {"ok": False, "result": None, "errors": {},
+                        "error": "%s: %s"%(e.__class__.__name__, e)}
+            self.wfile.write(json.dumps(reply) + "\n")
+            self.wfile.flush()
+
+
+def is_running(socketPath=DEFAULT_SOCKET):
+    """Check whether a daemon is listening on socketPath."""
+    if not os.path.exists(socketPath):
+        return False
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            s.connect(socketPath)
+            return True
+        except socket.error:
+            return False
+    finally:
+        s.close()
+
+
+def send_command(command, nodes=None, socketPath=DEFAULT_SOCKET, **args):
+    """Send a command to the daemon on socketPath and return its reply.
+
+    nodes is a list of node ids, or None for all nodes. The reply is a
+    dictionary with the keys ok, result and errors, where errors maps the
+    ids of failed nodes to an error message. Raises DaemonError if the
+    daemon could not execute the command at all.
+    """
+
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(socketPath)
+        f = s.makefile("rw")
+        f.write(json.dumps({"command": command, "nodes": nodes,
+            "args": args}) + "\n")
+        f.flush()
+        line = f.readline()
+    finally:
+        s.close()
+
+    if line == "":
+        raise DaemonError, "The daemon closed the connection"
+    reply = json.loads(line)
+    if "error" in reply:
+        raise DaemonError, reply["error"]
+    return reply
+
+
+def try_command(command, nodes=None, socketPath=DEFAULT_SOCKET, **args):
+    """Like send_command, but returns None if no daemon is running, so the
+    caller can fall back to doing the work itself."""
+    if not is_running(socketPath):
+        return None
+    return send_command(command, nodes, socketPath, **args)
+
+
+def print_errors(reply):
+    """Print the per node errors of a reply to stderr. Returns the exit
+    status for a script: 0 if all nodes succeeded, 1 otherwise."""
+    for id in sorted(reply["errors"].keys()):
+        sys.stderr.write("ERROR: node %s: %s\n"%(id, reply["errors"][id]))
+    if reply["ok"]:
+        return 0
+    return 1
+
+
+class DaemonError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return self.value
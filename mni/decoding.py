@@ -0,0 +1,318 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Decoding of Quanto messages while they are captured.
+
+A DecodingSink is an output function of the ManagedSubproc that logs the
+serial output of a node. It decodes every line as it arrives and appends the
+intervals to the IntervalColumns of the node, feeds them to an
+OnlineStateEstimator, and writes them to the .pwr file of the node on a
+writer thread. Once the capture stopped and the sink is closed, the .pwr
+file and the columns, in memory and on disk (see columnar), are complete,
+so the parse step can be skipped if the sink decoded intervals:
+
+    sink = decoding.DecodingSink(pwrFileName="quanto.10.0.0.1.log.pwr")
+    ... capture with sink among the stdout_fns ...
+    sink.close()
+    if len(sink.columns) > 0:
+        intervals = sink.columns.intervals(n.calibrationTable, n.ip)
+
+The sink decodes the hex packets the TinyOS Listen tool prints with a
+ListenDecoder. Listen commands that print the interval lines of a .pwr file
+instead, starting with its "#states:" line, are understood as well. For
+output that is neither, the sink writes neither a .pwr file nor columns, and
+the log has to go through read_log.py as before.
+"""
+
+import sys
+import array
+import struct
+import Queue
+import binascii
+import threading
+import metrics
+
+# power state resources of the Quanto firmware as (resource id, name), in
+# the order of the state columns
+DEFAULT_RESOURCES = [(0, "LED0"), (1, "LED1"), (2, "LED2"), (3, "CPU"),
+        (4, "RADIO"), (5, "FLASH"), (6, "SENSOR"), (7, "SERIAL")]
+
+
+class IntervalColumns:
+    """Intervals of a node in columns: the index into signatures, the time
+    in seconds and the iCounts of every interval. signatures holds the
+    activeStates of the distinct signatures, in the order they first
+    appeared."""
+
+    def __init__(self, states=None):
+        self.lock = threading.Lock()
+        self.states = None
+        self.set_states(states or [])
+
+    def set_states(self, states):
+        """Set the names of the states. Like load_pwr_file, a different
+        number of states discards the intervals so far."""
+        self.lock.acquire()
+        try:
+            if self.states is None or len(states) != len(self.states):
+                self.signatures = []
+                self.signatureIndex = {}
+                self.signature = array.array("i")
+                self.time = array.array("d")
+                self.icount = array.array("l")
+            self.states = list(states)
+        finally:
+            self.lock.release()
+
+    def append(self, activeStates, time, icount):
+        if len(activeStates) != len(self.states):
+            return
+        key = tuple(activeStates)
+        self.lock.acquire()
+        try:
+            i = self.signatureIndex.get(key)
+            if i is None:
+                i = len(self.signatures)
+                self.signatureIndex[key] = i
+                self.signatures.append(list(activeStates))
+            self.signature.append(i)
+            self.time.append(time)
+            self.icount.append(icount)
+        finally:
+            self.lock.release()
+
+    def __len__(self):
+        return len(self.time)
+
+    def intervals(self, table, ip, sparse=False):
+        """The intervals as statepower.PwrIntervals, see
+        statepower.load_columns."""
+        import statepower
+        self.lock.acquire()
+        try:
+            columns = (list(self.states), list(self.signatures),
+                    self.signature[:], self.time[:], self.icount[:])
+        finally:
+            self.lock.release()
+        return statepower.load_columns(*(columns + (table, ip, sparse)))
+
+
+class ListenDecoder:
+    """Decoder of the Quanto log messages of a node in the hex packets the
+    TinyOS Listen tool prints, one packet per line.
+
+    A packet starts with the serial dispatch byte, the destination and
+    source address, the payload length, the group and the AM type. The
+    payload of a log message is a sequence of entries with a type, a
+    resource id, the time in microseconds, the iCounts so far and an
+    argument, in network byte order. Between two entries lies an interval
+    during which the power states set by the TYPE_POWER_STATE entries so far
+    were active. resources lists the (resource id, name) pairs of the power
+    states; entries of other resources do not change them. amType, if
+    given, drops packets of other AM types.
+    """
+
+    HEADER = 8
+    ENTRY = struct.Struct(">BBIIH")
+    TYPE_POWER_STATE = 5
+
+    def __init__(self, resources=DEFAULT_RESOURCES, amType=None):
+        self.states = [name for (id, name) in resources]
+        self.columns = dict([(id, i)
+            for (i, (id, name)) in enumerate(resources)])
+        self.amType = amType
+        self.powerStates = [0] * len(resources)
+        # time and iCounts of the last entry
+        self.last = None
+
+    def decode(self, line):
+        """Return the list of intervals (activeStates, time in seconds,
+        icount) that end with the entries of the packet in line, or None if
+        line is no packet."""
+        try:
+            data = bytearray(binascii.unhexlify("".join(line.split())))
+        except TypeError:
+            return None
+        if len(data) < self.HEADER or data[0] != 0:
+            return None
+        length = data[5]
+        if len(data) < self.HEADER + length:
+            return None
+        if self.amType is not None and data[7] != self.amType:
+            return None
+
+        payload = str(data[self.HEADER:self.HEADER + length])
+        size = self.ENTRY.size
+        intervals = []
+        for offset in range(0, length - size + 1, size):
+            (type, resource, time, icount, arg) = self.ENTRY.unpack_from(
+                    payload, offset)
+            if self.last is not None:
+                # both counters wrap around
+                dt = (time - self.last[0]) % 2**32
+                ic = (icount - self.last[1]) % 2**32
+                if dt > 0:
+                    intervals.append((list(self.powerStates), dt / 1e6, ic))
+            self.last = (time, icount)
+            if type == self.TYPE_POWER_STATE and resource in self.columns:
+                self.powerStates[self.columns[resource]] = arg
+        return intervals
+
+
+class DecodingSink:
+    """Output function of a serial capture that decodes the Quanto messages
+    of a node into columns, an estimator and a .pwr file.
+
+    estimator, e.g. a statepower.OnlineStateEstimator, gets the state names
+    and intervals as they are decoded. An error of the estimator is written
+    to stderr once and counted in estimatorErrors; the capture goes on. The decoded lines are written to
+    pwrFileName, if given, by a writer thread, so a slow disk does not hold
+    up the capture. The number of lines waiting for it is the
+    mni_decode_queue_depth metric of track. close writes the columns to
+    columnsDirectory, if given, with the timeoffset of the node. Neither
+    the .pwr file nor the columns are written if no line could be decoded.
+    listenDecoder decodes the Listen packets, by default a ListenDecoder
+    of the DEFAULT_RESOURCES.
+    """
+
+    def __init__(self, columns=None, estimator=None, pwrFileName=None,
+            columnsDirectory=None, timeoffset=0, track="testbed",
+            listenDecoder=None):
+        if columns is None:
+            columns = IntervalColumns()
+        self.columns = columns
+        if listenDecoder is None:
+            listenDecoder = ListenDecoder()
+        self.listenDecoder = listenDecoder
+        # whether the lines are those of a .pwr file, which start with a
+        # "#states:" line
+        self.pwrLines = False
+        self.estimator = estimator
+        self.pwrFileName = pwrFileName
+        self.columnsDirectory = columnsDirectory
+        self.timeoffset = timeoffset
+        self.track = track
+        self.queueDepth = metrics.DECODE_QUEUE_DEPTH.labels(track)
+        self.estimatorErrors = 0
+        # number of lines that were decoded, and that were not
+        self.decoded = 0
+        self.skipped = 0
+
+        self.queue = Queue.Queue()
+        self.writer = None
+        if pwrFileName is not None:
+            self.writer = threading.Thread(target=self._write)
+            self.writer.setDaemon(True)
+            self.writer.start()
+
+    def decode_line(self, line):
+        """Decode a line of the serial output. Returns the state names of a
+        "#states:" line, a list of (activeStates, time in seconds, icount)
+        tuples of the intervals in a Listen packet, a tuple of an interval
+        line, or None if the line is neither."""
+        l = line.split()
+        if len(l) > 0 and l[0] == "#states:":
+            self.pwrLines = True
+            return l[1:]
+        if not self.pwrLines:
+            return self.listenDecoder.decode(line)
+        if len(l) != len(self.columns.states) + 3 or \
+                len(self.columns.states) == 0:
+            return None
+        try:
+            activeStates = [s != "-" and int(s) or 0 for s in l[:-3]]
+            #time is in uS, convert it to seconds
+            return (activeStates, float(l[-3])/1e6, int(l[-2]))
+        except ValueError:
+            return None
+
+    def __call__(self, line):
+        decoded = self.decode_line(line)
+        if decoded is None:
+            self.skipped += 1
+            return
+        self.decoded += 1
+
+        if isinstance(decoded, tuple):
+            self._add(*decoded)
+        elif self.pwrLines:
+            self._set_states(decoded)
+        else:
+            if self.columns.states != self.listenDecoder.states:
+                self._set_states(self.listenDecoder.states)
+            for interval in decoded:
+                self._add(*interval)
+
+    def _set_states(self, states):
+        self.columns.set_states(states)
+        self._estimate("set_states", states)
+        self._put("#states: %s\n"%(" ".join(states),))
+
+    def _add(self, activeStates, time, icount):
+        self.columns.append(activeStates, time, icount)
+        self._estimate("add_interval", activeStates, time, icount)
+        self._put("%s %d %d 1\n"%(" ".join([s and str(s) or "-"
+            for s in activeStates]), int(round(time * 1e6)), icount))
+
+    def _estimate(self, method, *args):
+        # runs in the output thread of the capture, which must not die
+        if self.estimator is None:
+            return
+        try:
+            getattr(self.estimator, method)(*args)
+        except Exception, e:
+            self.estimatorErrors += 1
+            if self.estimatorErrors == 1:
+                sys.stderr.write("ERROR: State estimation of %s failed: \
+%s: %s\n"%(self.track, e.__class__.__name__, e))
+
+    def _put(self, line):
+        if self.writer is None:
+            return
+        self.queue.put(line)
+        # the length of the deque of the queue needs no lock, unlike qsize
+        self.queueDepth.set(len(self.queue.queue))
+
+    def _write(self):
+        # the file is only created once there is something to write
+        f = None
+        closed = False
+        while not closed:
+            lines = [self.queue.get()]
+            # write what piled up in one go
+            try:
+                while True:
+                    lines.append(self.queue.get_nowait())
+            except Queue.Empty:
+                pass
+            self.queueDepth.set(self.queue.qsize())
+            if lines[-1] is None:
+                closed = True
+                lines.pop()
+            if len(lines) == 0:
+                continue
+            if f is None:
+                f = open(self.pwrFileName, "w")
+            f.write("".join(lines))
+        if f is not None:
+            f.close()
+
+    def close(self):
+        """Wait until all decoded lines are written, close the .pwr file and
+        write the columns. Call it once the capture stopped."""
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+            self.writer = None
+            self.queueDepth.set(0)
+        if self.columnsDirectory is not None and len(self.columns) > 0:
+            # the analysis needs NumPy anyway
+            import columnar
+            c = self.columns
+            c.lock.acquire()
+            try:
+                columnar.write_columns(self.columnsDirectory, c.states,
+                        c.signatures, c.signature, c.time, c.icount,
+                        self.timeoffset)
+            finally:
+                c.lock.release()
+            self.columnsDirectory = None
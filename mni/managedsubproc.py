@@ -9,6 +9,8 @@ import os
 import time
 import sys
 import threading
+import tracing
+import metrics
 
 
 class ManagedSubproc:
@@ -17,7 +19,7 @@ class ManagedSubproc:
     def __init__(self, command_line,
             stdout_disk=None, stdout_fid=None, stdout_fns=[],
             stderr_disk=None, stderr_fid=None, stderr_fns=[],
-            stdin_fid=None):
+            stdin_fid=None, trace_track=tracing.TESTBED):
         """Prepare a subprocess.  After creation the subprocess is
         started by executing the object's start function.  Execution is
         stoped by executing the object's stop function.
@@ -44,6 +46,10 @@ class ManagedSubproc:
         stderr_fns:
                 Each function in this list is called for each line
                 of stderr.
+
+        trace_track:
+                Track of the tracing span that covers the lifetime
+                of the process.
         """
 
         self.command_line = command_line.split()
@@ -57,6 +63,11 @@ class ManagedSubproc:
         self.stdout_manager = None
         self.stderr_manager = None
         self.has_started = False
+        self.trace_track = trace_track
+        self.start_time = None
+        # only one thread may reap the child, see _reap
+        self.reap_lock = threading.Lock()
+        self.exit_recorded = False
 
 
     def start(self):
@@ -66,6 +77,9 @@ class ManagedSubproc:
         if(not self.stdin_fid):
             self.stdin_fid = subprocess.PIPE
 
+        self.start_time = time.time()
+        metrics.SUBPROCESS_STARTS.labels(self.trace_track,
+                os.path.basename(self.command_line[0])).inc()
         self.child = subprocess.Popen(self.command_line, stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE, stdin=self.stdin_fid)
 
@@ -111,7 +125,7 @@ class ManagedSubproc:
 
         # Poll is catches cases where process is currently in a defunct
         # state.
-        if self.child.poll() != None:
+        if self._reap(False) != None:
             return True
 
         # TODO: Is this needed in addition to the poll?
@@ -166,6 +180,33 @@ class ManagedSubproc:
         if disk_file:
             disk_file.close()
 
+    def _reap(self, block):
+        """Poll, or with block wait for, the child and record its exit the
+        first time it is found dead. Returns the exit code or None.
+
+        Popen is not thread safe: if two threads reap the same child, the
+        loser gets ECHILD and takes 0 as exit code. The lock makes sure the
+        exit code is only taken from the thread that reaped the child."""
+
+        self.reap_lock.acquire()
+        try:
+            if block:
+                returncode = self.child.wait()
+            else:
+                returncode = self.child.poll()
+            if returncode != None and not self.exit_recorded:
+                self.exit_recorded = True
+                command = os.path.basename(self.command_line[0])
+                metrics.SUBPROCESS_EXITS.labels(self.trace_track, command,
+                        returncode).inc()
+                tracing.record(command, "subprocess", self.trace_track,
+                        self.start_time, time.time(),
+                        {"command": " ".join(self.command_line),
+                            "exitCode": returncode})
+            return returncode
+        finally:
+            self.reap_lock.release()
+
 
     def _stop_child_process(self):
         """Uses signals of escalating severity to kill PID."""
@@ -176,7 +217,7 @@ class ManagedSubproc:
                 signal.SIGHUP, signal.SIGKILL]:
             os.kill(self.child.pid, sig)
             if self.is_dead(): break
-        self.child.wait()
+        self._reap(True)
         return
 
 
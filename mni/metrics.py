@@ -0,0 +1,278 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Live metrics of MNI in the Prometheus text format.
+
+MNI, RCI and ManagedSubproc update the metrics defined at the bottom of this
+module all the time, which costs a dictionary lookup and a lock per update.
+Metrics of a node carry a node label with its trace track name, see
+tracing.node_track. serve makes them available over HTTP on a local port or
+a Unix socket:
+
+    metrics.serve(port=9123)
+
+    $ curl -s localhost:9123/metrics | grep mni_serial_messages_total
+"""
+
+import os
+import time
+import bisect
+import threading
+import SocketServer
+import BaseHTTPServer
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value):
+        return "%d"%(value,)
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{%s}"%(",".join(['%s="%s"'%(name, str(value).replace(
+        "\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for (name, value) in pairs]),)
+
+
+class _Value:
+    """Value of a counter or gauge for one combination of label values."""
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        self.lock.acquire()
+        self.value += amount
+        self.lock.release()
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def set(self, value):
+        self.value = value
+
+    def samples(self, name):
+        return [(name, (), self.value)]
+
+
+class _HistogramValue:
+    """Bucket counts, sum and count of a histogram for one combination of
+    label values."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        self.lock.acquire()
+        self.counts[i] += 1
+        self.sum += value
+        self.lock.release()
+
+    def samples(self, name):
+        self.lock.acquire()
+        counts = list(self.counts)
+        total = self.sum
+        self.lock.release()
+
+        samples = []
+        cumulative = 0
+        for (bound, count) in zip(self.buckets + [float("inf")], counts):
+            cumulative += count
+            samples.append((name + "_bucket", (("le", _format_value(bound)),),
+                cumulative))
+        samples.append((name + "_sum", (), total))
+        samples.append((name + "_count", (), cumulative))
+        return samples
+
+
+class Metric:
+    """A metric with a value per combination of label values.
+
+    labels returns the value for the given label values, which has inc,
+    dec and set for counters and gauges, and observe for histograms.
+    Callers that update a value often should keep it instead of calling
+    labels every time.
+    """
+
+    def __init__(self, name, help, type, labelNames=(), buckets=None):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labelNames = tuple(labelNames)
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+        self.function = None
+
+    def labels(self, *values):
+        values = tuple([str(v) for v in values])
+        value = self.values.get(values)
+        if value is None:
+            if len(values) != len(self.labelNames):
+                raise ValueError, "%s has the labels %s"%(self.name,
+                        ", ".join(self.labelNames))
+            self.lock.acquire()
+            value = self.values.get(values)
+            if value is None:
+                if self.type == "histogram":
+                    value = _HistogramValue(self.buckets)
+                else:
+                    value = _Value()
+                self.values[values] = value
+            self.lock.release()
+        return value
+
+    def set_function(self, function):
+        """Compute the values when the metrics are read. function returns a
+        dictionary that maps tuples of label values to values."""
+        self.function = function
+
+    def remove(self, *values):
+        self.lock.acquire()
+        self.values.pop(tuple([str(v) for v in values]), None)
+        self.lock.release()
+
+    def exposition(self):
+        lines = ["# HELP %s %s"%(self.name, self.help),
+                "# TYPE %s %s"%(self.name, self.type)]
+        if self.function is not None:
+            values = self.function()
+            items = [(k, _Value()) for k in values]
+            for (k, v) in items:
+                v.set(values[k])
+        else:
+            self.lock.acquire()
+            items = self.values.items()
+            self.lock.release()
+        items.sort()
+        for (labelValues, value) in items:
+            for (name, extra, sample) in value.samples(self.name):
+                lines.append("%s%s %s"%(name, _format_labels(self.labelNames,
+                    labelValues, extra), _format_value(sample)))
+        return "\n".join(lines) + "\n"
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelNames=()):
+        return self.register(Metric(name, help, "counter", labelNames))
+
+    def gauge(self, name, help, labelNames=()):
+        return self.register(Metric(name, help, "gauge", labelNames))
+
+    def histogram(self, name, help, labelNames=(), buckets=None):
+        if buckets is None:
+            buckets = DEFAULT_BUCKETS
+        return self.register(Metric(name, help, "histogram", labelNames,
+            list(buckets)))
+
+    def exposition(self):
+        """All metrics in the Prometheus text format."""
+        return "".join([m.exposition() for m in self.metrics])
+
+
+# seconds, from a fast RCI request to a slow install
+DEFAULT_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+        10.0, 30.0, 60.0, 120.0]
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.exposition()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _TCPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _UnixServer(SocketServer.ThreadingMixIn,
+        SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(port=None, socketPath=None, host="127.0.0.1", registry=None):
+    """Serve the metrics on port of host, or on the Unix socket socketPath,
+    in a background thread. Returns the server, call its shutdown method
+    to stop it."""
+
+    if registry is None:
+        registry = REGISTRY
+    if socketPath is not None:
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        server = _UnixServer(socketPath, _Handler)
+    else:
+        server = _TCPServer((host, port), _Handler)
+    server.registry = registry
+    p = threading.Thread(target=server.serve_forever)
+    p.setDaemon(True)
+    p.start()
+    return server
+
+
+# the metrics of MNI
+REGISTRY = Registry()
+
+SERIAL_MESSAGES = REGISTRY.counter("mni_serial_messages_total",
+        "Messages received from the serial port of a node.", ["node"])
+SERIAL_BYTES = REGISTRY.counter("mni_serial_bytes_total",
+        "Bytes of serial output logged for a node.", ["node"])
+SERIAL_LAST_MESSAGE = REGISTRY.gauge("mni_serial_last_message_timestamp_seconds",
+        "Unix time of the last message received from a node.", ["node"])
+SERIAL_RESTARTS = REGISTRY.counter("mni_serial_restarts_total",
+        "Serial capture processes of a node that were replaced while still\
+ running.", ["node"])
+RCI_SECONDS = REGISTRY.histogram("mni_rci_request_seconds",
+        "Duration of RCI requests to the Digi Connect box of a node.",
+        ["node", "request"])
+RCI_ERRORS = REGISTRY.counter("mni_rci_errors_total",
+        "Failed RCI requests.", ["node"])
+RCI_AVAILABLE = REGISTRY.gauge("mni_rci_device_available",
+        "1 if a Digi Connect box accepts requests, 0 while it counts as\
+ dead.", ["device"])
+INSTALL_SECONDS = REGISTRY.histogram("mni_install_seconds",
+        "Duration of installing the application on a node.", ["node"])
+INSTALL_FAILURES = REGISTRY.counter("mni_install_failures_total",
+        "Failed installs on a node.", ["node"])
+RESOURCE_IN_USE = REGISTRY.gauge("mni_resource_in_use",
+        "Nodes that currently use a shared resource, see resources.py.",
+        ["resource"])
+RESOURCE_WAIT_SECONDS = REGISTRY.histogram("mni_resource_wait_seconds",
+        "Time a node waited for its shared resources.", ["node"])
+DECODE_QUEUE_DEPTH = REGISTRY.gauge("mni_decode_queue_depth",
+        "Decoded lines of a node waiting to be written to its .pwr file.",
+        ["node"])
+SUBPROCESS_STARTS = REGISTRY.counter("mni_subprocess_starts_total",
+        "Subprocesses started by ManagedSubproc.", ["node", "command"])
+SUBPROCESS_EXITS = REGISTRY.counter("mni_subprocess_exits_total",
+        "Subprocesses of ManagedSubproc that exited, by exit code.",
+        ["node", "command", "code"])
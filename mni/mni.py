@@ -8,25 +8,39 @@ import subprocess
 import threading
 import StringIO
 import time
+import partition
+import resources
+import tracing
+import metrics
 import managedsubproc as msp
+from string import Template
 
 
 class MNI:
 
+    # Command that logs the serial output of a node. $serial is replaced by
+    # the serial device and $id by the id of the node.
+    DEFAULT_LISTEN_CMD = \
+            "/usr/bin/java net.tinyos.tools.Listen -comm serial@$serial:tmote"
 
-    def __init__(self, configFile="config.ini", addIgnore=False):
+
+    def __init__(self, configFile="config.ini", addIgnore=False,
+            skipNodes=None):
         """Initialize a managed node infrastructure.
 
         Initialization reads a configuration file to set testbed wide
         attributes such as number of nodes, the type of nodes in the
         testbed, and the make command specific to the node type.  The
         configuration also describes per-node details important for the
-        testbed.
+        testbed. Nodes whose section, like "Node3", is in skipNodes are
+        left out, e.g. the bad nodes of a status.sweep.
         """
 
         self.nodes = []
         self.nodeType = None
-        self.serialProcesses = []
+        # node id -> serial process and output sink of its capture
+        self.serialProcesses = {}
+        self.serialSinks = {}
 
         # Parse configuration.
         self.configFileName = configFile
@@ -47,6 +61,10 @@ class MNI:
         self.numNodes = self.config.getint("Nodes", "numNodes")
         self.type = self.config.get("Nodes", "type")
         self.makeCmd = self.config.get("Nodes", "makeCmd")
+        if self.config.has_option("Nodes", "listenCmd"):
+            self.listenCmd = self.config.get("Nodes", "listenCmd")
+        else:
+            self.listenCmd = self.DEFAULT_LISTEN_CMD
 
         # Load set of node specific required options.
         try:
@@ -65,8 +83,13 @@ class MNI:
             if not self.config.has_section(nodeString):
                 raise ConfigParser.NoSectionError, "["+nodeString+"]"
 
+            if skipNodes is not None and nodeString in skipNodes:
+                print "Node:", nodeString, "failed its status check. Ignoring"
+                continue
+
             configured = False
             n = nodeType()
+            start = time.time()
             try:
                 # We allow nodes with flexible configurations (e.g. Quanto's)
                 # to parse their config section themselves as they do not have
@@ -94,24 +117,82 @@ class MNI:
                         # Node does not exist, print an error
                         print "Node:", nodeString," is not connected. Ignoring"
 
+            if hasattr(n, "id"):
+                track = tracing.node_track(n)
+            else:
+                track = tracing.TESTBED
+            tracing.record("configure %s"%(nodeString,), "configure", track,
+                    start, time.time(), {"configured": configured})
+
             if configured:
+                if self.config.has_option(nodeString, "resources"):
+                    n.resources = [r.strip() for r in self.config.get(
+                        nodeString, "resources").split(",") if r.strip()]
                 self.nodes.append(n)
 
-    def reset_all(self):
+        # Named subsets of the nodes, see partition.Partition.
+        self.partitions = {}
+        for section in self.config.sections():
+            if section.startswith("Partition "):
+                p = partition.Partition.from_config(self.config, section)
+                self.partitions[p.name] = p
+        self.leases = partition.NodeLeases()
+
+        # Limits on the nodes that install or reset at once per shared
+        # resource, see resources.ResourceLimits.
+        self.resources = resources.ResourceLimits.from_config(self.config)
+
+    def reset_all(self, nodes=None):
+        """Reset nodes, by default all nodes. Returns the failed nodes, see
+        call_all."""
+        return self.call_all("reset", nodes)
+
+    def call_all(self, method, nodes=None):
+        """Call method on nodes, by default all nodes, in parallel, as far
+        as the limits of their shared resources allow. Returns a dictionary
+        that maps the ids of the nodes whose call raised an exception, e.g.
+        a rci.DeviceUnavailableError for a dead Digi box, to the error
+        message."""
+        if nodes is None:
+            nodes = self.nodes
+        span = tracing.span("%s_all"%(method,), "control")
+        failures = {}
+        def call(n):
+            self.resources.acquire(n)
+            try:
+                try:
+                    getattr(n, method)()
+                except Exception, e:
+                    failures[n.id] = "%s: %s"%(e.__class__.__name__, e)
+            finally:
+                self.resources.release(n)
         processes = []
-        for n in self.nodes:
-            p = threading.Thread(target=n.reset)
+        for n in nodes:
+            p = threading.Thread(target=call, args=(n,))
             p.start()
             processes.append(p)
-
-        while len(processes) > 0:
-            runningProcesses = []
-            for p in processes:
-                if p.isAlive():
-                    runningProcesses.append(p)
-
-            processes = runningProcesses
-            time.sleep(0.1)
+        for p in processes:
+            p.join()
+        span.args["failures"] = len(failures)
+        span.end()
+        return failures
+
+    def lease_partition(self, name, timeout=None):
+        """Lease the nodes of the partition called name for exclusive use.
+        Returns a partition.PartitionLease, whose mni attribute only
+        operates on the nodes of the partition. Waits up to timeout seconds
+        for other leases on these nodes to be released."""
+
+        if name not in self.partitions:
+            raise KeyError, "Partition %s does not exist!"%(name,)
+        p = self.partitions[name]
+        nodes = [n for n in self.nodes if str(n.id) in p.nodeIds]
+        self.leases.acquire(nodes, name, timeout)
+        try:
+            return partition.PartitionLease(self, p, nodes)
+        except:
+            self.leases.release(nodes)
+            raise
 
     def _verify_required_options(self, section, options):
         """Verify that all options are included in section of self.config."""
@@ -124,10 +205,23 @@ class MNI:
         return self.nodes
 
 
-    def compile(self):
+    def compile(self, directory=None):
+        """Run the make command in the application directory, by default
+        the working directory."""
+        if directory is None:
+            directory = os.getcwd()
+        # partitions with their own make command share the application
+        # directory, see partition.BuildDirectory
+        return partition.build_directory(directory).compile(self.makeCmd,
+                lambda: self._compile(directory))
+
+    def _compile(self, directory=None):
+        span = tracing.span("compile", "compile", command=self.makeCmd)
         proc = subprocess.Popen(self.makeCmd, shell=True, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE)
+                stderr=subprocess.PIPE, cwd=directory)
         proc.wait()
+        span.args["exitCode"] = proc.returncode
+        span.end()
 
         if proc.returncode != None:
             if proc.returncode == 0:
@@ -147,10 +241,24 @@ class MNI:
             return False
 
 
-    def install_all(self):
+    def install_all(self, nodes=None, directory=None):
+        """Install the application in directory, by default the working
+        directory, on nodes, by default all nodes."""
+        span = tracing.span("install_all", "install")
+        try:
+            return self._install_all(nodes, directory)
+        finally:
+            span.end()
+
+    def _install_all(self, nodes=None, directory=None):
+        if nodes is None:
+            nodes = self.nodes
+
+        failures = {}
         processes = []
-        for n in self.nodes:
-            p = threading.Thread(target=n.install)
+        for n in nodes:
+            p = threading.Thread(target=self._install_node,
+                    args=(n, failures, directory))
             p.start()
             processes.append(p)
 
@@ -166,7 +274,9 @@ class MNI:
             if len(runningProcesses) is 0:
                 break
 
-            if len(runningProcesses) < 0.1*totalProcesses:
+            # nodes waiting for their shared resources have not started
+            if len(runningProcesses) < 0.1*totalProcesses and \
+                    self.resources.waiting == 0:
                 # we have less than 10% of processes left.
                 # give them 10 seconds to finish, or else kill them.
                 print "10% left. 10 second timout started"
@@ -192,7 +302,7 @@ class MNI:
         # processes done. Collect exit codes
         installSuccess = True
         badInstalls = []
-        for n in self.nodes:
+        for n in nodes:
             if not n.is_install_success():
                 installSuccess = False
                 badInstalls.append(n)
@@ -202,70 +312,180 @@ class MNI:
             print "Some installations failed. Trying to install again"
             moreBadInstalls = []
             for n in badInstalls:
+                # nodes behind a dead Digi box fail at once, see rci.RCI
                 print "Re-installing on", n.id
-                n.install()
+                self._install_node(n, failures, directory)
                 if not n.is_install_success():
                     moreBadInstalls.append(n)
 
             if len(moreBadInstalls) > 0:
                 print "Failed to install on:"
                 for n in moreBadInstalls:
-                    print "Node ID: ", n.id
-                raise InstallError, "Installation Failed on at least 1 node!"
+                    print "Node ID: ", n.id, failures.get(n.id, "")
+                raise InstallError, "Installation failed on nodes %s"%(
+                        ", ".join([str(n.id) for n in moreBadInstalls]),)
             installSuccess = True
 
         return installSuccess
 
     def connect_serial_to_file_all(self, baseFileName, timeout=None,
-            blocking=True):
+            blocking=True, sinks=None, nodes=None):
         """This function will connect a serial forwarder to every node and log
-        the output to a file of the form 'baseFileName.IPADDRESS.log'. An
+        the output to a file named by log_file_name, by default of the form
+        'baseFileName.ID.log'. An
         optional parameter timeout will stop the logging after a given time.
         Else, it will run forever, or until all subprocesses are dead (which
         shouldn't happen, except if the serial devices disappear, or an other
         error happens). If blocking is set to False, this function will return
         immediately and leave the connections to the serial ports running. A
         subsequent call to <code>disconnect_serial_to_file_all</code> will
-        stop the processes that are still alive."""
-
-        if len(self.serialProcesses) > 0:
-            # there are still serial processes running. Stop them
-            for n in self.serialProcesses:
-                n.stop()
-        self.serialProcesses = []
-        for n in self.nodes:
-            p = msp.ManagedSubproc(
-                    "/usr/bin/java net.tinyos.tools.Listen -comm serial@%s:tmote"%(n.serial),
-                    stdout_disk = baseFileName + ".%d.log"%(n.id,),
-                    stderr_disk = baseFileName + ".%d.stderr.log"%(n.id,),
-                    stdout_fns = [n.message_counter, ])
+        stop the processes that are still alive. sinks may map node ids to
+        output functions that get every line of the node as well, like a
+        decoding.DecodingSink. Those with a close method are closed once
+        the logging stopped. nodes restricts the logging to a subset of the
+        nodes; an earlier capture of these nodes is stopped, those of other
+        nodes keep running."""
+
+        span = tracing.span("connect_serial", "capture")
+        if nodes is None:
+            nodes = self.nodes
+        ids = [n.id for n in nodes]
+        self._stop_serial(ids, restart=True)
+        if sinks is None:
+            sinks = {}
+        processes = []
+        for n in nodes:
+            sink = sinks.get(n.id)
+            if sink is not None:
+                self.serialSinks[n.id] = sink
+            p = self.serial_to_file_process(n, baseFileName, sink)
             p.start()
-            self.serialProcesses.append(p)
+            self.serialProcesses[n.id] = p
+            processes.append(p)
+        span.end()
 
         if not blocking:
             # we are done.
             return
 
         startTime = time.time()
-        while len(self.serialProcesses) > 0:
+        while len(processes) > 0:
             runningProcesses = []
-            for p in self.serialProcesses:
+            for p in processes:
                 if not p.is_dead():
                     runningProcesses.append(p)
-            self.serialProcesses = runningProcesses
+            processes = runningProcesses
             if (timeout != None) and (time.time() - startTime) > timeout:
                 # timeout reached. Stop all the processes!
-                for p in self.serialProcesses:
-                    p.stop()
                 break
 
             time.sleep(0.1)
 
-    def disconnect_serial_to_file_all(self):
-        """Method to stop all serial processes that are still running."""
-        for n in self.serialProcesses:
-            n.stop()
-        self.serialProcesses = []
+        # collect the output threads, so the sinks got every line
+        self._stop_serial(ids)
+
+    def _stop_serial(self, ids=None, restart=False):
+        # stop the captures of the nodes with ids, by default all, and close
+        # their sinks
+        if ids is None:
+            ids = set(self.serialProcesses.keys() + self.serialSinks.keys())
+        for id in ids:
+            p = self.serialProcesses.pop(id, None)
+            if p is not None:
+                if restart and not p.is_dead():
+                    metrics.SERIAL_RESTARTS.labels(p.trace_track).inc()
+                p.stop()
+            sink = self.serialSinks.pop(id, None)
+            if sink is not None and hasattr(sink, "close"):
+                sink.close()
+
+    def _install_node(self, n, failures=None, directory=None):
+        # failures maps the ids of nodes whose install raised an exception
+        # to the exception
+        track = tracing.node_track(n)
+        if directory is None:
+            build = partition.build_directory(os.getcwd())
+        else:
+            build = partition.build_directory(directory)
+        start = time.time()
+        installing = False
+        acquired = False
+        try:
+            # a compile of another partition can take a while, nobody needs
+            # our resources meanwhile
+            build.begin_install(self.makeCmd,
+                    lambda: self._compile(directory))
+            installing = True
+            self.resources.acquire(n)
+            acquired = True
+            start = time.time()
+            if directory is None:
+                # callers may replace install by a function without
+                # arguments, e.g. the benchmarks
+                n.install()
+            else:
+                n.install(cwd=directory)
+            if failures is not None:
+                failures.pop(n.id, None)
+        except Exception, e:
+            n.installSuccess = False
+            sys.stderr.write("ERROR: Install on node %s failed: %s: %s\n"%(
+                n.id, e.__class__.__name__, e))
+            if failures is None:
+                raise
+            failures[n.id] = e
+        finally:
+            if acquired:
+                self.resources.release(n)
+            if installing:
+                build.end_install()
+            metrics.INSTALL_SECONDS.labels(track).observe(time.time() - start)
+            if not n.is_install_success():
+                metrics.INSTALL_FAILURES.labels(track).inc()
+
+    def log_file_name(self, n, baseFileName):
+        """Name of the file the serial output of node n is logged to."""
+        return baseFileName + ".%d.log"%(n.id,)
+
+    def serial_to_file_process(self, n, baseFileName, sink=None):
+        """Return a ManagedSubproc, not yet started, that logs the serial
+        output of node n to log_file_name and counts its messages. sink is
+        an additional output function for the lines, if given."""
+        logFileName = self.log_file_name(n, baseFileName)
+        listenCmd = Template(self.listenCmd).substitute(serial=n.serial,
+                id=n.id)
+        track = tracing.node_track(n)
+        start = time.time()
+        firstMessage = []
+        def warm_up(line):
+            # time until the first message of the node arrived
+            if len(firstMessage) == 0:
+                firstMessage.append(line)
+                tracing.record("capture warm-up", "capture", track, start,
+                        time.time())
+        messages = metrics.SERIAL_MESSAGES.labels(track)
+        bytes = metrics.SERIAL_BYTES.labels(track)
+        lastMessage = metrics.SERIAL_LAST_MESSAGE.labels(track)
+        def count(line):
+            messages.inc()
+            bytes.inc(len(line))
+            lastMessage.set(time.time())
+        stdoutFns = [n.message_counter, warm_up, count]
+        if sink is not None:
+            stdoutFns.append(sink)
+        return msp.ManagedSubproc(listenCmd,
+                stdout_disk = logFileName,
+                stderr_disk = logFileName[:-len(".log")] + ".stderr.log",
+                stdout_fns = stdoutFns,
+                trace_track = track)
+
+    def disconnect_serial_to_file_all(self, nodes=None):
+        """Method to stop all serial processes that are still running, or
+        those of nodes."""
+        if nodes is None:
+            self._stop_serial()
+        else:
+            self._stop_serial([n.id for n in nodes])
 
 
 
@@ -4,6 +4,10 @@ import os
 import sys
 import rci
 import time
+import calibration
+import decoding
+import simulate
+import tracing
 import socket
 import telnetlib
 import subprocess
@@ -12,6 +16,8 @@ class Node:
 
     def __init__(self):
         self.message_count = 0
+        # names of the shared resources of the node, see resources.py
+        self.resources = []
 
     def configure(self, configuration):
 
@@ -25,7 +31,7 @@ class Node:
         except ValueError:
             raise ValueError, "ID must be an integer"
 
-    def install(self):
+    def install(self, cwd=None):
         pass
 
     def is_install_success(self):
@@ -64,9 +70,12 @@ class TelosMote(Node):
         self.serialid = serialid
         installCmd = configuration["installCmd"]
 
+        span = tracing.span("motelist", "configure", tracing.node_track(self),
+                serialid=serialid)
         proc = subprocess.Popen("motelist | grep %s"%(serialid,), shell=True,
                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         proc.wait()
+        span.end()
 
         s = proc.stdout.readlines()
         if len(s) != 1:
@@ -79,12 +88,16 @@ class TelosMote(Node):
         template = Template(installCmd)
         self.installCmd = template.substitute(serial = self.serial, id=self.id)
 
-    def install(self):
+    def install(self, cwd=None):
 
         self.installSuccess = False
+        span = tracing.span("install", "install", tracing.node_track(self),
+                command=self.installCmd)
         proc = subprocess.Popen(self.installCmd, shell=True, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE)
+                stderr=subprocess.PIPE, cwd=cwd)
         proc.wait()
+        span.args["exitCode"] = proc.returncode
+        span.end()
 
         if proc.returncode != None:
             if proc.returncode == 0:
@@ -103,9 +116,12 @@ class TelosMote(Node):
 
     def reset(self):
         """ Reset the specified telos mote using tos-bsl. """
+        span = tracing.span("reset", "control", tracing.node_track(self))
         proc = subprocess.Popen("tos-bsl --telosb -c %s -r"%(self.serial), shell=True,
                 stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         proc.wait()
+        span.args["exitCode"] = proc.returncode
+        span.end()
 
     def is_install_success(self):
         return self.installSuccess
@@ -122,6 +138,12 @@ class QuantoTestbedMote(Node):
 
     DEFAULT_INSTALL_COMMAND = "make epic reinstall,$id digi bsl,$serial"
     DEFAULT_TIMEOFFSET = 0
+    # Port of the telnet server of the Digi Connect boxes, which is probed to
+    # check that a node is reachable.
+    TELNET_PORT = 23
+    # read the GPIO pins of a Digi Connect box before the first request,
+    # instead of sending their mode once, see rci.RCI.set_gpio
+    RCI_READ_BACK = False
     NODES = {
             "rd":"00:40:9d:3d:6c:31",
             "re":"00:40:9d:3d:69:ed",
@@ -139,9 +161,13 @@ class QuantoTestbedMote(Node):
         Node.__init__(self)
         self.installSuccess = False
         self.frequencies = {}
+        self.calibrationTable = calibration.CalibrationTable()
         self.statePower = {}
+        self.statePowerCI = {}
         self.alwaysOffStates = []
         self.alwaysOnStates = []
+        # power states in the Listen packets, see decoding.ListenDecoder
+        self.powerResources = decoding.DEFAULT_RESOURCES
 
     # Propogates KeyError on failure
     def get_node_info_by_name(self, name):
@@ -162,14 +188,23 @@ class QuantoTestbedMote(Node):
     def _verify_config(self, host, serial, installCmd):
         # check if we can telnet to the IP
         self.host = host
+        # the analysis code and the scripts refer to the host as ip
+        self.ip = host
 
+        # host may carry the port of the RCI web server as host:port
+        hostName = host.split(":")[0]
+        span = tracing.span("telnet probe", "configure",
+                tracing.node_track(self), host=hostName)
         try:
-            t = telnetlib.Telnet()
-            t.open(host)
-            t.read_until("login: ", timeout=1)
-            t.close()
-        except socket.error:
-            raise ValueError, "ERROR: Could not connect to node at %s\n"%(self.host,)
+            try:
+                t = telnetlib.Telnet()
+                t.open(hostName, self.TELNET_PORT)
+                t.read_until("login: ", timeout=1)
+                t.close()
+            except socket.error:
+                raise ValueError, "ERROR: Could not connect to node at %s\n"%(self.host,)
+        finally:
+            span.end()
 
         self.serial = serial
         if not os.path.exists(self.serial):
@@ -181,7 +216,8 @@ class QuantoTestbedMote(Node):
         self.installCmd = template.substitute(serial = self.serial, id=self.id)
 
         # add the RCI interface
-        self.rci = rci.RCI(self.host)
+        self.rci = rci.RCI(self.host, track=tracing.node_track(self),
+                readBack=self.RCI_READ_BACK)
 
     def configure_ex(self, key, config):
         if config.has_option(key, "name"):
@@ -228,14 +264,18 @@ class QuantoTestbedMote(Node):
 
         self._verify_config(host, serial, installCmd)
 
-    def install(self):
+    def install(self, cwd=None):
 
         # enable RTS for serial communication
         self.rci.set_gpio_mode(rci.RTS, rci.SERIAL)
 
+        span = tracing.span("install", "install", tracing.node_track(self),
+                command=self.installCmd)
         proc = subprocess.Popen(self.installCmd, shell=True, stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE)
+                stderr=subprocess.PIPE, cwd=cwd)
         proc.wait()
+        span.args["exitCode"] = proc.returncode
+        span.end()
 
         if proc.returncode != None:
             if proc.returncode == 0:
@@ -300,6 +340,7 @@ class QuantoTestbedMote(Node):
         """
 
         self.frequencies = frequencies
+        self.calibrationTable = calibration.CalibrationTable(frequencies)
 
     def get_energy(self, icount, time):
         """
@@ -310,40 +351,7 @@ class QuantoTestbedMote(Node):
         The returned value is in milli Joul.
         """
 
-        if len(self.frequencies) == 0:
-            return -1
-
-        if time <= 0:
-            return 0.0
-        frequency = icount / float(time)
-
-        # search for the closest frequency in our calibration table
-        keys = self.frequencies.keys()
-        # sort by increasing resistor values (decreasing frequencies)
-        keys.sort()
-        lastRes = -1
-        for res in keys:
-            if frequency <= self.frequencies[res]['freq']:
-                lastRes = res
-                continue
-            else:
-                break
-        if res == keys[-1]:
-            # the given frequency is below our highest frequency measurement.
-            # Thus, we have to go with its value.
-            return icount * self.frequencies[res]['E']
-        if res == keys[0]:
-            # the given frequency is above our lowest frequency measurement.
-            # Thus, we have to go with its value.
-            return icount * self.frequencies[res]['E']
-
-        # interpolate between the two calibration frequencies
-        df = self.frequencies[lastRes]['freq'] - self.frequencies[res]['freq']
-        dE = self.frequencies[lastRes]['E'] - self.frequencies[res]['E']
-
-        return icount * (
-                (frequency - self.frequencies[res]['freq']) / df * dE
-                + self.frequencies[res]['E'])
+        return self.calibrationTable.get_energy(icount, time)
 
     def get_power(self, icount, time):
         """
@@ -363,3 +371,78 @@ class QuantoTestbedMote(Node):
         return Node.get_required_attributes() + ["ip", "serial", "installCmd",
                 "timeoffset"]
     get_required_attributes = staticmethod(get_required_attributes)
+
+
+class SimulatedQuantoMote(QuantoTestbedMote):
+    """Quanto node without hardware, for running the analysis offline.
+
+    Besides id, the configuration may contain ip (by default simID), seed
+    (by default the id), numStates and noise, which set up trace, a
+    simulate.QuantoTrace with the ground truth of the node. Installs always
+    succeed, and the GPIO operations are only recorded in gpioLog as
+    (time, operation) tuples. simulate.write_measurement writes the .pwr
+    files the analysis methods of QuantoMNI expect. The power states of the
+    trace are the powerResources of the node.
+    """
+
+    OPTIONS = ["id", "ip", "timeoffset", "seed", "numStates", "noise"]
+
+    def __init__(self):
+        QuantoTestbedMote.__init__(self)
+        self.gpioLog = []
+        self.trace = None
+
+    def configure_ex(self, key, config):
+        configuration = {}
+        for option in self.OPTIONS:
+            if config.has_option(key, option):
+                configuration[option] = config.get(key, option)
+        self.configure(configuration)
+
+    def configure(self, configuration):
+        Node.configure(self, configuration)
+
+        self.ip = configuration.get("ip", "sim%d"%(self.id,))
+        self.host = self.ip
+        self.serial = None
+        self.installCmd = None
+        self.rci = None
+        self.timeoffset = int(configuration.get("timeoffset",
+            self.DEFAULT_TIMEOFFSET))
+        self.trace = simulate.QuantoTrace(
+                seed=int(configuration.get("seed", self.id)),
+                numStates=int(configuration.get("numStates", 8)),
+                noise=float(configuration.get("noise", 0.02)))
+        self.powerResources = self.trace.resources()
+
+    def _gpio(self, operation):
+        self.gpioLog.append((time.time(), operation))
+
+    def install(self, cwd=None):
+        self._gpio("install")
+        self.installSuccess = True
+
+    def push_usr(self):
+        self._gpio("push_usr")
+
+    def release_usr(self):
+        self._gpio("release_usr")
+
+    def reset(self):
+        self._gpio("reset")
+
+    def stop(self):
+        self._gpio("stop")
+
+    def start(self):
+        self._gpio("start")
+
+    def programming_mode(self):
+        self._gpio("programming_mode")
+
+    def serial_mode(self):
+        self._gpio("serial_mode")
+
+    def get_required_attributes():
+        return Node.get_required_attributes()
+    get_required_attributes = staticmethod(get_required_attributes)
@@ -0,0 +1,272 @@
+# vim: ts=4 et sw=4 sts=4
+
+import os
+import sys
+import copy
+import time
+import threading
+from string import Template
+
+
+class Partition:
+    """Named subset of the nodes of a testbed.
+
+    Partitions are configured in sections of the form [Partition NAME] with
+    the option nodes, a comma separated list of node ids, and optionally
+    makeCmd and installCmd, which replace the testbed wide make command
+    and the install commands of the nodes while the partition is leased.
+    """
+
+    def __init__(self, name, nodeIds, makeCmd=None, installCmd=None):
+        self.name = name
+        self.nodeIds = [str(id) for id in nodeIds]
+        self.makeCmd = makeCmd
+        self.installCmd = installCmd
+
+    def from_config(config, section):
+        name = section[len("Partition "):].strip()
+        nodeIds = [id.strip() for id in config.get(section, "nodes").split(",")
+                if id.strip() != ""]
+        makeCmd = None
+        installCmd = None
+        if config.has_option(section, "makeCmd"):
+            makeCmd = config.get(section, "makeCmd")
+        if config.has_option(section, "installCmd"):
+            installCmd = config.get(section, "installCmd")
+        return Partition(name, nodeIds, makeCmd, installCmd)
+    from_config = staticmethod(from_config)
+
+
+class NodeLeases:
+    """Exclusive locks on nodes.
+
+    A lease takes all requested nodes at once or none of them, so two
+    experiments waiting for overlapping sets of nodes can not deadlock.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.holders = {}
+
+    def acquire(self, nodes, holder, timeout=None):
+        """Lease nodes for holder, waiting until none of them is leased
+        anymore. Raises LeaseError if that takes longer than timeout
+        seconds."""
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+        self.condition.acquire()
+        try:
+            while True:
+                busy = [n for n in nodes if n in self.holders]
+                if len(busy) == 0:
+                    break
+                if timeout is None:
+                    self.condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise LeaseError, "Nodes %s are leased by %s"%(
+                                ", ".join([str(n.id) for n in busy]),
+                                ", ".join(set([self.holders[n]
+                                    for n in busy])))
+                    self.condition.wait(remaining)
+            for n in nodes:
+                self.holders[n] = holder
+        finally:
+            self.condition.release()
+
+    def release(self, nodes):
+        self.condition.acquire()
+        try:
+            for n in nodes:
+                del self.holders[n]
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+
+class PartitionLease:
+    """Exclusive use of the nodes of a partition.
+
+    mni is a copy of the MNI object that only contains the nodes of the
+    partition and uses its make command, so all *_all methods only touch
+    the leased nodes. While the lease is held, the nodes use the install
+    command of the partition. Use release, or the lease as context manager,
+    to give the nodes back.
+    """
+
+    def __init__(self, mni, partition, nodes):
+        self.partition = partition
+        self.nodes = nodes
+        self.leases = mni.leases
+
+        self.mni = copy.copy(mni)
+        self.mni.nodes = nodes
+        # the captures of the lease are its own
+        self.mni.serialProcesses = {}
+        self.mni.serialSinks = {}
+        if partition.makeCmd is not None:
+            self.mni.makeCmd = partition.makeCmd
+
+        self.installCmds = {}
+        if partition.installCmd is not None:
+            template = Template(partition.installCmd)
+            for n in nodes:
+                self.installCmds[n] = n.installCmd
+                n.installCmd = template.substitute(serial=n.serial, id=n.id)
+
+    def release(self):
+        for n in self.installCmds:
+            n.installCmd = self.installCmds[n]
+        self.installCmds = {}
+        self.leases.release(self.nodes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+        return False
+
+
+class BuildDirectory:
+    """Build output of an application directory, shared by the partitions
+    that compile in it.
+
+    Partitions with their own make command overwrite each other's build
+    output. Compiles therefore wait for each other and for running
+    installs, and an install whose build output was overwritten by another
+    make command compiles it again before it starts.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # make command the build output is from, None if unknown
+        self.makeCmd = None
+        self.compiling = False
+        self.installs = 0
+
+    def _build(self, makeCmd, build):
+        # called with the condition held and no compile or install running
+        self.compiling = True
+        self.condition.release()
+        built = None
+        try:
+            result = build()
+            built = makeCmd
+            return result
+        finally:
+            self.condition.acquire()
+            self.compiling = False
+            self.makeCmd = built
+            self.condition.notifyAll()
+
+    def compile(self, makeCmd, build):
+        """Run build, the compile with makeCmd, once no other compile or
+        install uses the directory. Returns what build returns."""
+
+        self.condition.acquire()
+        try:
+            while self.compiling or self.installs > 0:
+                self.condition.wait()
+            return self._build(makeCmd, build)
+        finally:
+            self.condition.release()
+
+    def begin_install(self, makeCmd, build):
+        """Wait until the build output of makeCmd can be installed. If
+        another make command compiled since, build compiles it again. Call
+        end_install once the install finished."""
+
+        self.condition.acquire()
+        try:
+            while True:
+                if self.compiling:
+                    self.condition.wait()
+                elif self.makeCmd is None or self.makeCmd == makeCmd:
+                    self.installs += 1
+                    return
+                elif self.installs > 0:
+                    self.condition.wait()
+                else:
+                    self._build(makeCmd, build)
+        finally:
+            self.condition.release()
+
+    def end_install(self):
+        self.condition.acquire()
+        try:
+            self.installs -= 1
+            self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+
+buildDirectories = {}
+buildDirectoriesLock = threading.Lock()
+
+def build_directory(path):
+    """The BuildDirectory of the application directory path."""
+    path = os.path.realpath(path)
+    buildDirectoriesLock.acquire()
+    try:
+        if path not in buildDirectories:
+            buildDirectories[path] = BuildDirectory()
+        return buildDirectories[path]
+    finally:
+        buildDirectoriesLock.release()
+
+
+class ExperimentScheduler:
+    """Runs experiments concurrently on partitions of a testbed.
+
+    Every experiment is a function that gets the MNI object of its
+    partition lease. Experiments on disjoint partitions run at the same
+    time, experiments on overlapping partitions wait for each other.
+    """
+
+    def __init__(self, mni):
+        self.mni = mni
+        self.experiments = []
+
+    def add(self, partitionName, experiment):
+        self.experiments.append((partitionName, experiment))
+
+    def _run(self, index, partitionName, experiment, results):
+        try:
+            lease = self.mni.lease_partition(partitionName)
+            try:
+                results[index] = (experiment(lease.mni), None)
+            finally:
+                lease.release()
+        except Exception, e:
+            sys.stderr.write("ERROR: experiment on partition %s failed: %s\n"%(
+                partitionName, e))
+            results[index] = (None, e)
+
+    def run(self):
+        """Run all added experiments and wait for them. Returns a list with a
+        (result, exception) tuple per experiment, in the order they were
+        added."""
+
+        results = [None] * len(self.experiments)
+        threads = []
+        for (i, (partitionName, experiment)) in enumerate(self.experiments):
+            p = threading.Thread(target=self._run,
+                    args=(i, partitionName, experiment, results))
+            p.start()
+            threads.append(p)
+
+        for p in threads:
+            p.join()
+
+        self.experiments = []
+        return results
+
+
+class LeaseError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return self.value
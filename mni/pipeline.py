@@ -0,0 +1,94 @@
+# vim: ts=4 et sw=4 sts=4
+
+import sys
+import time
+import threading
+import tracing
+
+
+class Stage:
+    """One step of a Pipeline.
+
+    function is called with a node and does the work of this stage for that
+    node. At most limit nodes are in this stage at the same time, or any
+    number if limit is None.
+    """
+
+    def __init__(self, name, function, limit=None):
+        self.name = name
+        self.function = function
+        self.limit = limit
+        if limit is None:
+            self.semaphore = None
+        else:
+            self.semaphore = threading.BoundedSemaphore(limit)
+
+    def run(self, node):
+        if self.semaphore is not None:
+            self.semaphore.acquire()
+        try:
+            self.function(node)
+        finally:
+            if self.semaphore is not None:
+                self.semaphore.release()
+
+
+class Pipeline:
+    """Runs a sequence of stages on a set of nodes, where every node moves
+    through the stages on its own.
+
+    The *_all methods of MNI run one step on all nodes and wait for the
+    slowest node before the next step starts. In a pipeline, a node that
+    finished one stage directly goes on to the next one, limited only by the
+    concurrency limit of that stage. The total time thus approaches the time
+    of the slowest node instead of the sum of the slowest times per step.
+    """
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.timings = []
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def _run_node(self, node):
+        for stage in self.stages:
+            start = time.time()
+            try:
+                stage.run(node)
+            except Exception, e:
+                self.lock.acquire()
+                self.errors[node] = (stage.name, e)
+                self.lock.release()
+                sys.stderr.write("ERROR: stage %s failed on node %s: %s\n"%(
+                    stage.name, node.id, e))
+                return
+            finally:
+                end = time.time()
+                self.lock.acquire()
+                self.timings.append((node, stage.name, start, end))
+                self.lock.release()
+                tracing.record(stage.name, "pipeline",
+                        tracing.node_track(node), start, end)
+
+    def run(self, nodes):
+        """Run all stages on all nodes and wait until every node finished
+        or failed.
+
+        Returns a dictionary that maps every failed node to a tuple of the
+        name of the stage it failed in and the exception. timings holds a
+        (node, stage name, start time, end time) tuple for every stage
+        that was run.
+        """
+
+        self.timings = []
+        self.errors = {}
+        threads = []
+        for n in nodes:
+            p = threading.Thread(target=self._run_node, args=(n,))
+            p.start()
+            threads.append(p)
+
+        for p in threads:
+            p.join()
+
+        return self.errors
@@ -1,16 +1,15 @@
 from mni import *
-import numpy
-
-try:
-    import cvxmod
-    from cvxmod.atoms import norm2
-    cvxAvailable = True
-except:
-    cvxAvailable = False
+import calibration
+# statepower pulls in numpy, so it is only imported by the methods that
+# analyze measurements, to keep the control commands fast to start.
+import pipeline
+import schedule
+import tracing
+import decoding
 
 class QuantoMNI(MNI):
 
-    def __init__(self, configFile="config.ini"):
+    def __init__(self, configFile="config.ini", skipNodes=None):
         """Initialize a managed quanto node infrastructure.
 
         We will first check for quanto specific paremeters, before we call MNI
@@ -24,154 +23,165 @@ Please run quanto_setup.sh before creating a QuantoMNI object.
 """)
             sys.exit(1)
 
-        MNI.__init__(self, configFile)
-
-    def reset_all(self):
-        processes = []
-        for n in self.nodes:
-            p = threading.Thread(target=n.reset)
-            p.start()
-            processes.append(p)
-
-        while len(processes) > 0:
-            runningProcesses = []
-            for p in processes:
-                if p.isAlive():
-                    runningProcesses.append(p)
-
-            processes = runningProcesses
-            time.sleep(0.1)
-
-    def stop_all(self):
-        processes = []
-        for n in self.nodes:
-            p = threading.Thread(target=n.stop)
-            p.start()
-            processes.append(p)
-
-        while len(processes) > 0:
-            runningProcesses = []
-            for p in processes:
-                if p.isAlive():
-                    runningProcesses.append(p)
-
-            processes = runningProcesses
-            time.sleep(0.1)
-
+        MNI.__init__(self, configFile, skipNodes=skipNodes)
 
-    def press_usr_all(self):
-        processes = []
-        for n in self.nodes:
-            p = threading.Thread(target=n.push_usr)
-            p.start()
-            processes.append(p)
+    def log_file_name(self, n, baseFileName):
+        # the Quanto tools name the files of a node by its IP
+        return "%s.%s.log"%(baseFileName, n.ip)
 
-        while len(processes) > 0:
-            runningProcesses = []
-            for p in processes:
-                if p.isAlive():
-                    runningProcesses.append(p)
-
-            processes = runningProcesses
-            time.sleep(0.1)
-        for n in self.nodes:
-            p = threading.Thread(target=n.release_usr)
-            p.start()
-            processes.append(p)
+    def stop_all(self, nodes=None):
+        """Stop nodes, by default all nodes. Returns the failed nodes, see
+        call_all."""
+        return self.call_all("stop", nodes)
 
-        while len(processes) > 0:
-            runningProcesses = []
-            for p in processes:
-                if p.isAlive():
-                    runningProcesses.append(p)
+    def start_all(self, nodes=None):
+        """Start stopped nodes, by default all nodes. Returns the failed
+        nodes, see call_all."""
+        return self.call_all("start", nodes)
 
-            processes = runningProcesses
-            time.sleep(0.1)
+    def press_usr_all(self, duration=schedule.PRESS_DURATION):
+        """Press the user button of all nodes at the same time and release
+        it duration seconds later. Returns the results of the schedule."""
+        s = schedule.Schedule()
+        s.press(self.nodes, 0.0, duration)
+        return s.run()
 
     def calibrate_all(self, doInstallCompile=True, readFromFile=False,
-            configFile='calibration.ini'):
-        currentDir = os.getcwd()
-        os.chdir(os.path.join(os.environ['TOSROOT'],"apps/quantoApps/CalibrateQuanto"))
-        # add the current path so that the next import of calibratequanto
-        # works
-        sys.path.insert(0, os.getcwd())
-        import calibratequanto
-
-        if readFromFile:
-            # read the calibration data from file
-            config = ConfigParser.RawConfigParser()
-            config.read(configFile)
-
-            for n in self.nodes:
-                if not config.has_option("Node%s"%(n.ip), 'calibration'):
-                    raise ConfigParser.NoOptionError("Node%s"%(n.ip),
-                            'calibration')
-                calibration = config.get("Node%s"%(n.ip,), 'calibration')
-                # FIXME: DANGEROUS!!! Prone to code injection!
-                # FIXME: We should write our own parser for dictionaries.
-                # ensure that eval can not use any builtin functions
-                globs = {'__buildins__':{}}
-                n.calibrate(eval(calibration, globs, globs))
-
-        else:
-            # compile and install calibration application, connect to the
-            # nodes to get the calibration
-
-            if doInstallCompile:
-                try:
-                    self.compile()
-                except CompileError, e:
-                    raise CompileError, e
-                try:
-                    self.install_all()
-                except InstallError, e:
-                    raise InstallError, e
-
-            # run calibration
-            processes = []
-            calibrations = []
-            for n in self.nodes:
-                cq = calibratequanto.CalibrateQuanto(
-                        serial="serial@%s:epic"%n.serial,
-                        repeat=False,
-                        debug=False)
-                p = threading.Thread(target=cq.listen)
-                p.start()
-                processes.append(p)
-                calibrations.append((n, cq))
-
-            while len(processes) > 0:
-                runningProcesses = []
-                for p in processes:
-                    if p.isAlive():
-                        runningProcesses.append(p)
-
-                processes = runningProcesses
-                time.sleep(0.1)
-
-            # we got the data from the actual motes. Safe it in a
-            # configuration file so that we can reread it later
-            config = ConfigParser.RawConfigParser()
+            calibrationDir='calibration', configFile='calibration.ini',
+            nodes=None, timeout=None):
+        """Calibrate all nodes, either by running the CalibrateQuanto
+        application on them or, if readFromFile is set, by loading their
+        latest calibration from the calibration store in calibrationDir.
+
+        Every new calibration is appended to the node's history in the
+        store. configFile may name a calibration.ini file written by older
+        versions of this method. If it exists, the calibrations of the
+        nodes the store has none for are imported from it first.
+
+        nodes restricts the calibration to a subset of the nodes, so other
+        nodes can be used at the same time. Every node has timeout seconds
+        to report its calibration. Nodes that fail or time out keep their
+        old calibration and are reported in a CalibrationError once all
+        other nodes are done.
+        """
 
-            for (n, cq) in calibrations:
-                n.calibrate(cq.frequencies)
-                # write this node's configuration
-                config.add_section("Node%s"%(n.ip,))
-                config.set("Node%s"%(n.ip,), "calibration",
-                        str(cq.frequencies))
-                config.set("Node%s"%(n.ip,), "calibrationDate",
-                        time.ctime())
+        if nodes is None:
+            nodes = self.nodes
 
-            # write the configuration file
-            config.write(open(configFile, 'wb'))
+        store = calibration.CalibrationStore(calibrationDir)
+        if configFile is not None and os.path.exists(configFile):
+            missing = [n.ip for n in nodes if not store.has_calibration(n.ip)]
+            if len(missing) > 0:
+                store.import_ini(configFile, missing)
 
-        # go back to the old directory
-        os.chdir(currentDir)
+        if readFromFile:
+            # read the calibration data from the store
+            for n in nodes:
+                frequencies = store.latest(n.ip)
+                if frequencies is None:
+                    raise CalibrationError, "No calibration stored for node \
+with IP %s in %s!"%(n.ip, calibrationDir)
+                n.calibrate(frequencies)
+            return
+
+        # compile and install calibration application, connect to the
+        # nodes to get the calibration
+        if doInstallCompile:
+            directory = calibration.calibratequanto_directory()
+            self.compile(directory)
+            self.install_all(nodes, directory)
+
+        listeners = []
+        for n in nodes:
+            listener = calibration.CalibrationListener(n, store)
+            listener.start()
+            listeners.append(listener)
+
+        startTime = time.time()
+        failed = []
+        for listener in listeners:
+            if timeout is None:
+                listener.join()
+            else:
+                listener.join(max(0, startTime + timeout - time.time()))
+            if listener.isAlive():
+                # a late calibration must not be stored after all
+                listener.cancel()
+                failed.append("%s (timeout)"%(listener.node.ip,))
+            elif listener.error is not None:
+                failed.append("%s (%s)"%(listener.node.ip, listener.error))
+
+        if len(failed) > 0:
+            raise CalibrationError, "Calibration failed on: %s"%(
+                    ", ".join(failed),)
+
+    def pwr_file_name(self, n, baseFileName):
+        """The parsed intervals of node n for the analysis: the columns
+        directory of its .pwr file if it is up to date, else the .pwr file,
+        see columnar."""
+        pwrFileName = "%s.pwr"%(self.log_file_name(n, baseFileName),)
+        directory = pwrFileName + ".cols"
+        if os.path.isdir(directory):
+            import columnar
+            if columnar.is_current(directory, pwrFileName):
+                return directory
+        return pwrFileName
+
+    def write_columns(self, n, baseFileName):
+        """Write the .pwr file of node n as columns, so the analysis can
+        memory-map it instead of parsing it again, see columnar."""
+        import columnar
+        span = tracing.span("convert_pwr_file", "parse",
+                tracing.node_track(n))
+        columnar.convert_pwr_file("%s.pwr"%(self.log_file_name(n,
+            baseFileName),), timeoffset=n.timeoffset)
+        span.end()
+
+    def decoding_sink(self, n, baseFileName):
+        """Return a decoding.DecodingSink for the serial output of node n. It
+        writes the .pwr file and the columns parse_quanto_log would, feeds
+        the stateEstimator of the node, if it has one, and keeps the
+        intervals in decodedIntervals of the node. Nothing is written if
+        the messages can not be decoded, see is_decoded."""
+        pwrFileName = "%s.pwr"%(self.log_file_name(n, baseFileName),)
+        sink = decoding.DecodingSink(
+                estimator=getattr(n, "stateEstimator", None),
+                pwrFileName=pwrFileName,
+                columnsDirectory=pwrFileName + ".cols",
+                timeoffset=n.timeoffset,
+                track=tracing.node_track(n),
+                listenDecoder=decoding.ListenDecoder(n.powerResources))
+        n.decodedIntervals = sink.columns
+        return sink
+
+    def is_decoded(self, n):
+        """Whether the last capture of node n decoded any intervals. If
+        not, e.g. because the listen command printed neither Quanto log
+        packets nor .pwr lines, its log has to be parsed with
+        parse_quanto_log."""
+        columns = getattr(n, "decodedIntervals", None)
+        return columns is not None and len(columns) > 0
+
+    def connect_serial_to_file_all(self, baseFileName, timeout=None,
+            blocking=True, decode=False, nodes=None):
+        """See MNI.connect_serial_to_file_all. With decode, the Quanto
+        messages are decoded while they arrive, see decoding_sink, and only
+        the logs of the nodes that are not is_decoded afterwards need to be
+        parsed."""
+        if nodes is None:
+            nodes = self.nodes
+        sinks = None
+        if decode:
+            sinks = {}
+            for n in nodes:
+                sinks[n.id] = self.decoding_sink(n, baseFileName)
+        MNI.connect_serial_to_file_all(self, baseFileName, timeout, blocking,
+                sinks, nodes)
 
     def parse_quanto_log_all(self, baseFileName):
         """Decompress, then parse the quanto message logfile using the "read_log.py"
         application. This will generate a .parsed and a .pwr file for each
-        node."""
+        node, and the columns of the .pwr file, see write_columns."""
 
         allProcesses = []
 
@@ -196,12 +206,10 @@ Please run quanto_setup.sh before creating a QuantoMNI object.
                 print "".join(p.stderr_fid.getvalue())
 
 
+        span = tracing.span("parse_quanto_log_all", "parse")
         allProcesses = []
         for n in self.nodes:
-            p = msp.ManagedSubproc(
-                    "read_log.py %s.%s.log %d"%(baseFileName, n.ip, n.timeoffset),
-                    stderr_fid=StringIO.StringIO(),
-                    stdout_fid=StringIO.StringIO())
+            p = self._read_log_process(n, baseFileName)
             p.start()
             allProcesses.append(p)
 
@@ -214,24 +222,22 @@ Please run quanto_setup.sh before creating a QuantoMNI object.
             processes = runningProcesses
             time.sleep(0.1)
 
+        span.end()
+
         for p in allProcesses:
-                if p.returncode() != 0:
-                    raise ParseError, "\
-ERROR while executing '%s'\
-Output from read_log.py:\
-%s\n%s"%(" ".join(p.command_line), "".join(p.stdout_fid.getvalue()), "".join(p.stderr_fid.getvalue()))
+            self._check_log_tool(p, "read_log.py")
+        for n in self.nodes:
+            self.write_columns(n, baseFileName)
 
     def process_quanto_log_all(self, baseFileName):
         """Processes the parsed quanto message file using the "process.pl"
         application. This will generate a .parsed.eps, .parsed.gp, and
         .parsed.times file for each node."""
 
+        span = tracing.span("process_quanto_log_all", "parse")
         allProcesses = []
         for n in self.nodes:
-            p = msp.ManagedSubproc(
-                    "process.pl -f %s.%s.log.parsed"%(baseFileName, n.ip),
-                    stderr_fid=StringIO.StringIO(),
-                    stdout_fid=StringIO.StringIO())
+            p = self._process_log_process(n, baseFileName)
             p.start()
             allProcesses.append(p)
 
@@ -244,15 +250,43 @@ Output from read_log.py:\
             processes = runningProcesses
             time.sleep(0.1)
 
+        span.end()
+
         for p in allProcesses:
-                if p.returncode() != 0:
-                    raise ParseError, "\
+            self._check_log_tool(p, "process.pl")
+
+    def _read_log_process(self, n, baseFileName):
+        return msp.ManagedSubproc(
+                "read_log.py %s %d"%(self.log_file_name(n, baseFileName),
+                    n.timeoffset),
+                stderr_fid=StringIO.StringIO(),
+                stdout_fid=StringIO.StringIO(),
+                trace_track=tracing.node_track(n))
+
+    def _process_log_process(self, n, baseFileName):
+        return msp.ManagedSubproc(
+                "process.pl -f %s.parsed"%(self.log_file_name(n, baseFileName),),
+                stderr_fid=StringIO.StringIO(),
+                stdout_fid=StringIO.StringIO(),
+                trace_track=tracing.node_track(n))
+
+    def _check_log_tool(self, p, toolName):
+        if p.returncode() != 0:
+            raise ParseError, "\
 ERROR while executing '%s'\
-Output from process.pl:\
-%s\n%s"%(" ".join(p.command_line), "".join(p.stdout_fid.getvalue()), "".join(p.stderr_fid.getvalue()))
+Output from %s:\
+%s\n%s"%(" ".join(p.command_line), toolName, "".join(p.stdout_fid.getvalue()), "".join(p.stderr_fid.getvalue()))
 
+    def _run_log_tool(self, p, toolName):
+        p.start()
+        while not p.is_dead():
+            time.sleep(0.1)
+        # collect the output threads
+        p.stop()
+        self._check_log_tool(p, toolName)
 
-    def get_energy_per_quanto_state_all(self, baseFileName, convexOpt=False):
+    def get_energy_per_quanto_state_all(self, baseFileName, convexOpt=False,
+            processes=None, sparse=False, bootstrap=0, confidence=0.95):
         """This function evaluates the .pwr file and calculates the individual
         power consumption per state for every node. It then sets the variable
         statePower on every node to a dictionary, where the keys are the
@@ -262,164 +296,237 @@ Output from process.pl:\
         This function expects a very specific .pwr file, where one line starts
         with "#states:". This line encodes all the states that are considered
         by quanto.
+
+        With convexOpt, the state powers are constrained to be non-negative
+        and the previous statePower of each node is used as starting point.
+
+        With sparse, the state matrix is kept in compressed sparse row
+        format, which pays off for applications with many states.
+
+        If bootstrap is larger than 0, that many bootstrap replicates are
+        used to set statePowerCI on every node to a dictionary with a
+        (low, high) confidence interval for every state in statePower.
+
+        The nodes are analyzed in parallel by a pool of processes worker
+        processes, which defaults to one per CPU.
         """
 
+        jobs = []
         for n in self.nodes:
-            f = open("%s.%s.log.pwr"%(baseFileName, n.ip), "r")
-            X = []
-            Y = []
-            W = []
-            totalTime = 0
-            totalEnergy = 0
-            states = []
-            maxEntries = 0
-            for line in f:
-                l = line.strip().split()
-                if len(l) > 0 and l[0] == "#states:":
-                        # this line encodes the names of all the states.
-                        states = l[1:]
-                        continue
-                if len(states) == 0 or len(l) != len(states)+3:
-                    # +2 comes from the icount and time field
-                    continue
-                #time is in uS, convert it to seconds
-                time = float(l[-3])/1e6
-                icount = int(l[-2])
-                occurences = int(l[-1])
-                # cut away the time and icount values
-                l = l[0:-3]
-                activeStates = []
-                for s in l:
-                    if s == '-':
-                        s = '0'
-                        #continue
-                    activeStates.append(int(s))
-
-                # add the constant power state
-                activeStates.append(1)
-
-                if len(activeStates) > maxEntries:
-                    maxEntries = len(activeStates)
-
-                if time <= 0 or icount <= 0:
-                    # FIXME: this is a wrong line at the end of the quanto files. I
-                    # don't know why this happens!!!
-                    continue
-
-                E = n.get_power(icount, time)
-                if E == -1:
-                    raise CalibrationError, "Node with IP %s is not calibrated! \
-Did you forget to load the calibration file?"%(n.ip,)
-                if E < 0:
-                    raise CalibrationError, "Node with IP %s returned a \
-negative Energy value %f for icount %d, time %f!"%(n.ip, E, icount, time)
-                    continue
-                X.append(activeStates)
-                Y.append(E)
-                W.append(numpy.sqrt(E*time))
-                totalTime += time
-                totalEnergy += E*time
-
-
-
-            # filter out the incomplete datasets
-            Xnew = []
-            Ynew = []
-            Wnew = []
-            for i in range(len(Y)):
-                if len(X[i]) == maxEntries:
-                    Xnew.append(X[i])
-                    Ynew.append(Y[i])
-                    Wnew.append(W[i])
-            X = numpy.matrix(Xnew)
-            Y = numpy.matrix(Ynew)
-            W = numpy.matrix(numpy.diag(Wnew))
-
-            # filter states with all 0's
-            states.append('const')
-            deletedLines = 0
-            deletedStates = []
-            alwaysOnStates = []
-            # iterate through all the states, except the 'const' state
-            for i in range(len(states)-1):
-                correctedI = i - deletedLines
-                if numpy.sum(X.T[correctedI]) == 0:
-                    deletedStates.append(states[correctedI])
-                    X = numpy.delete(X, numpy.s_[correctedI:correctedI+1], axis=1)
-                    states = numpy.delete(states, correctedI)
-                    deletedLines += 1
-                elif numpy.sum(X.T[correctedI]) == len(X):
-                    # this state is always active. W have to remove them and
-                    # put them into the "const" category!
-                    alwaysOnStates.append(states[correctedI])
-                    X = numpy.delete(X, numpy.s_[correctedI:correctedI+1], axis=1)
-                    states = numpy.delete(states, correctedI)
-                    deletedLines += 1
-
-            # search for linear dependent lines
-            #for i in range(len(X)):
-            #    #print X[i]
-            #    for j in range(i+1, len(X)):
-            #        #if numpy.sum(X[i]) == numpy.sum(X[j]):
-            #        #    print X[i], X[j]
-            #        equal = True
-            #        for m in range(X[i].shape[1]):
-            #            if X[i,m] != X[j,m]:
-            #                equal = False
-            #                break
-
-            #        if equal:
-            #            print X[i], X[j]
-
-            # maxEntries includes the const state, which is not in the states
-            # variable yet
-            #states = states[:maxEntries - 1]
-
-            #xtwx = X.T*X
-            #for i in range(len(xtwx)):
-            #    print xtwx[i]
-            #print states
-
-            #(x, resids, rank, s) = numpy.linalg.lstsq(W*X, W*Y.T)
-            #(x, resids, rank, s) = numpy.linalg.lstsq(X, Y.T)
-
-            if cvxAvailable and convexOpt:
-
-                A = cvxmod.matrix(W*X)
-                b = cvxmod.matrix(W*Y.T)
-                x = cvxmod.optvar('x', cvxmod.size(A)[1])
-
-                print A
-                print b
-
-                p = cvxmod.problem(cvxmod.minimize(norm2(A*x - b)), [x >= 0])
-                #p.constr.append(x |In| probsimp(5))
-                p.solve()
-
-                print "Optimal problem value is %.4f." % p.value
-                cvxmod.printval(x)
-                x = x.value
+            jobs.append({
+                'fileName': self.pwr_file_name(n, baseFileName),
+                'table': n.calibrationTable,
+                'ip': n.ip,
+                'convexOpt': convexOpt,
+                'x0': n.statePower or None,
+                'sparse': sparse,
+                'bootstrap': bootstrap,
+                'confidence': confidence,
+            })
+
+        import statepower
+        span = tracing.span("get_energy_per_quanto_state_all", "analyze",
+                nodes=len(jobs), bootstrap=bootstrap)
+        results = statepower.analyze_pwr_files(jobs, processes)
+        span.end()
+
+        for (n, result) in zip(self.nodes, results):
+            if result['error'] is not None:
+                sys.stderr.write(result['error'])
+                sys.stderr.write("\n")
+                sys.stderr.flush()
+            else:
+                n.averagePower = result['averagePower']
+            n.statePower = result['statePower']
+            n.alwaysOffStates = result['alwaysOffStates']
+            n.alwaysOnStates = result['alwaysOnStates']
+            n.statePowerCI = result['statePowerCI']
+
+    def get_energy_per_quanto_state_pooled(self, baseFileName,
+            shrinkage=0.1, processes=None, sparse=False):
+        """Like get_energy_per_quanto_state_all, but estimates the state
+        powers of all nodes together (see statepower.analyze_pooled). This
+        assumes that the nodes run the same application on the same
+        hardware, and converges with much shorter runs per node.
+
+        The .pwr files are loaded in parallel by a pool of processes worker
+        processes, which defaults to one per CPU.
+        """
 
+        jobs = []
+        for n in self.nodes:
+            jobs.append({
+                'fileName': self.pwr_file_name(n, baseFileName),
+                'table': n.calibrationTable,
+                'ip': n.ip,
+                'sparse': sparse,
+            })
+
+        import statepower
+        span = tracing.span("load_pwr_files", "analyze", nodes=len(jobs))
+        intervalsList = statepower.load_pwr_files(jobs, processes)
+        span.end()
+        span = tracing.span("analyze_pooled", "analyze")
+        results = statepower.analyze_pooled(intervalsList,
+                [n.ip for n in self.nodes], shrinkage)
+        span.end()
+
+        for (n, result) in zip(self.nodes, results):
+            if result['error'] is not None:
+                sys.stderr.write(result['error'])
+                sys.stderr.write("\n")
+                sys.stderr.flush()
             else:
+                n.averagePower = result['averagePower']
+            n.statePower = result['statePower']
+            n.alwaysOffStates = result['alwaysOffStates']
+            n.alwaysOnStates = result['alwaysOnStates']
+            n.statePowerCI = result['statePowerCI']
+
+    def start_state_estimation_all(self):
+        """Attach a fresh statepower.OnlineStateEstimator to every node as
+        stateEstimator. A capture with decode, see decoding_sink, feeds it
+        the intervals of the node as they arrive, and update_state_power_all
+        makes the current estimates available while the experiment runs."""
+
+        import statepower
+        for n in self.nodes:
+            n.stateEstimator = statepower.OnlineStateEstimator(
+                    n.calibrationTable, ip=n.ip)
+        return [n.stateEstimator for n in self.nodes]
+
+    def update_state_power_all(self):
+        """Set statePower, alwaysOnStates, alwaysOffStates and averagePower
+        of every node to the current solution of its online estimator."""
 
-                try:
-                    x = numpy.linalg.inv(X.T*W*X)*X.T*W*Y.T
-                except numpy.linalg.LinAlgError, e:
-                    sys.stderr.write("State Matrix X for node with IP %s is singular. We did not \
-    collect enough energy and state information. Please run the application for \
-    longer!\n"%(n.ip,))
-                    sys.stderr.write(repr(e))
-                    sys.stderr.write("\n")
-                    sys.stderr.flush()
-                    n.statePower = {}
-                    n.alwaysOffStates = []
-                    n.alwaysOnStates = []
-                    continue
-            n.statePower = {}
-            for i in range(len(states)):
-                # the entries in x are matrices. convert them back into a
-                # number
-                n.statePower[states[i]] = float(x[i])
-            n.alwaysOffStates = deletedStates
-            n.alwaysOnStates = alwaysOnStates
-            n.averagePower = totalEnergy / totalTime
+        for n in self.nodes:
+            result = n.stateEstimator.solution()
+            if result['error'] is not None:
+                continue
+            n.statePower = result['statePower']
+            n.alwaysOffStates = result['alwaysOffStates']
+            n.alwaysOnStates = result['alwaysOnStates']
+            n.averagePower = result['averagePower']
+
+    def install(self, n):
+        """Install on a single node, trying a second time on failure."""
+        for attempt in range(2):
+            self._install_node(n)
+            if n.is_install_success():
+                return
+        raise InstallError, "Installation failed on node %s!"%(n.id,)
+
+    def capture(self, n, baseFileName, numMessages, reset=False,
+            pressUsr=False, timeout=None, decode=False):
+        """Log the serial output of node n until it sent numMessages
+        messages or timeout seconds passed. The node is reset and its user
+        button pressed after the serial forwarder is connected, if
+        requested. With decode, the messages are decoded while they arrive,
+        see decoding_sink."""
+
+        sink = None
+        if decode:
+            sink = self.decoding_sink(n, baseFileName)
+        p = self.serial_to_file_process(n, baseFileName, sink)
+        n.reset_message_counter()
+        p.start()
+        try:
+            if reset:
+                n.reset()
+            if pressUsr:
+                n.push_usr()
+                n.release_usr()
+            startTime = time.time()
+            while n.get_message_counter() < numMessages and not p.is_dead():
+                if timeout is not None and time.time() - startTime > timeout:
+                    break
+                time.sleep(0.1)
+        finally:
+            p.stop()
+            if sink is not None:
+                sink.close()
+
+    def parse_quanto_log(self, n, baseFileName):
+        """parse_quanto_log_all for a single node."""
+        self._run_log_tool(self._read_log_process(n, baseFileName),
+                "read_log.py")
+        self.write_columns(n, baseFileName)
+
+    def process_quanto_log(self, n, baseFileName):
+        """process_quanto_log_all for a single node."""
+        self._run_log_tool(self._process_log_process(n, baseFileName),
+                "process.pl")
+
+    def get_energy_per_quanto_state(self, n, baseFileName, convexOpt=False,
+            sparse=False, bootstrap=0, confidence=0.95, decoded=False):
+        """get_energy_per_quanto_state_all for a single node, analyzed in
+        the calling process. With decoded, the intervals decoded during the
+        last capture of the node are used instead of its .pwr file. Raises
+        ParseError if that capture decoded no intervals."""
+
+        if decoded and not self.is_decoded(n):
+            raise ParseError, "No intervals of node %s were decoded during \
+the capture; parse its log with read_log.py instead."%(n.id,)
+        import statepower
+        span = tracing.span("analyze_pwr_file", "analyze",
+                tracing.node_track(n), decoded=decoded)
+        if decoded:
+            result = statepower.analyze_intervals(
+                    n.decodedIntervals.intervals(n.calibrationTable, n.ip,
+                        sparse),
+                    n.ip, convexOpt, n.statePower or None, bootstrap,
+                    confidence)
+        else:
+            result = statepower.analyze_pwr_file(
+                    self.pwr_file_name(n, baseFileName),
+                    n.calibrationTable, n.ip, convexOpt,
+                    n.statePower or None, sparse, bootstrap, confidence)
+        span.end()
+        if result['error'] is not None:
+            sys.stderr.write(result['error'])
+            sys.stderr.write("\n")
+            sys.stderr.flush()
+        else:
+            n.averagePower = result['averagePower']
+        n.statePower = result['statePower']
+        n.alwaysOffStates = result['alwaysOffStates']
+        n.alwaysOnStates = result['alwaysOnStates']
+        n.statePowerCI = result['statePowerCI']
+
+    def experiment_pipeline(self, baseFileName, numMessages, install=False,
+            reset=False, pressUsr=False, convexOpt=False, limits={},
+            captureTimeout=None, decode=False):
+        """Return a pipeline.Pipeline that takes every node through an
+        energy measurement on its own: optionally install, then capture,
+        parse, process and regress. limits maps stage names to the maximum
+        number of nodes in that stage at once. Compile before running the
+        pipeline if it installs. With decode, the capture decodes the
+        messages and parse and process only run for the nodes that are not
+        is_decoded."""
+
+        def parse(n):
+            if not (decode and self.is_decoded(n)):
+                self.parse_quanto_log(n, baseFileName)
+
+        def process(n):
+            if not (decode and self.is_decoded(n)):
+                self.process_quanto_log(n, baseFileName)
+
+        def regress(n):
+            self.get_energy_per_quanto_state(n, baseFileName, convexOpt,
+                    decoded=decode and self.is_decoded(n))
+
+        stages = []
+        if install:
+            stages.append(pipeline.Stage("install", self.install,
+                limits.get("install")))
+        stages.append(pipeline.Stage("capture",
+            lambda n: self.capture(n, baseFileName, numMessages, reset,
+                pressUsr, captureTimeout, decode),
+            limits.get("capture")))
+        stages.append(pipeline.Stage("parse", parse, limits.get("parse")))
+        stages.append(pipeline.Stage("process", process,
+            limits.get("process")))
+        stages.append(pipeline.Stage("regress", regress,
+            limits.get("regress")))
+        return pipeline.Pipeline(stages)
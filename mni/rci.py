@@ -1,4 +1,13 @@
 import urllib2
+import httplib
+import socket
+import base64
+import random
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+import tracing
+import metrics
 
 SERIAL = 'serial'
 OUT = 'out'
@@ -10,10 +19,115 @@ DSR = 3
 RTS = 4
 DTR = 5
 
+ASSERTED = 'asserted'
+UNASSERTED = 'unasserted'
+
+
+class DeviceHealth:
+    """Circuit breaker of a device.
+
+    After threshold requests in a row failed, the device counts as dead and
+    requests fail at once with a DeviceUnavailableError instead of waiting
+    for their timeouts. cooldown seconds later one request is let through
+    to probe the device, and its outcome closes the breaker again or keeps
+    it open for another cooldown.
+    """
+
+    def __init__(self, threshold=3, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        # failures ever, the device may have restarted since any of them
+        self.errors = 0
+        self.openUntil = None
+        self.probing = False
+        self.lastError = None
+        self.lock = threading.Lock()
+
+    def available(self):
+        """Whether a request would be let through, without probing."""
+        return self.openUntil is None or (time.time() >= self.openUntil
+                and not self.probing)
+
+    def allow(self):
+        self.lock.acquire()
+        try:
+            if self.openUntil is None:
+                return True
+            if time.time() < self.openUntil or self.probing:
+                return False
+            self.probing = True
+            return True
+        finally:
+            self.lock.release()
+
+    def success(self):
+        self.lock.acquire()
+        self.failures = 0
+        self.openUntil = None
+        self.probing = False
+        self.lock.release()
+
+    def failure(self, error):
+        self.lock.acquire()
+        self.failures += 1
+        self.errors += 1
+        self.lastError = error
+        if self.probing or self.failures >= self.threshold:
+            self.openUntil = time.time() + self.cooldown
+        self.probing = False
+        self.lock.release()
+
+
+# health of the devices by host, shared by all RCI objects of a device
+_health = {}
+_healthLock = threading.Lock()
+
+def device_health(host):
+    _healthLock.acquire()
+    try:
+        if host not in _health:
+            _health[host] = DeviceHealth(RCI.FAILURE_THRESHOLD, RCI.COOLDOWN)
+        return _health[host]
+    finally:
+        _healthLock.release()
+
+def _availability():
+    _healthLock.acquire()
+    values = {}
+    for host in _health:
+        values[(host,)] = _health[host].available() and 1 or 0
+    _healthLock.release()
+    return values
+
+metrics.RCI_AVAILABLE.set_function(_availability)
+
+
 class RCI:
 
-    def __init__(self, ip, user='root', password='dbps'):
+    # seconds an attempt of a request may take
+    TIMEOUT = 5.0
+    # attempts after the first one, after a random delay around
+    # RETRY_DELAY that doubles with every attempt
+    RETRIES = 2
+    RETRY_DELAY = 0.2
+    # failed requests in a row after which a device counts as dead, and the
+    # seconds until it is tried again, see DeviceHealth
+    FAILURE_THRESHOLD = 3
+    COOLDOWN = 30.0
+    # seconds the known mode of a pin is trusted, another client may change
+    # it in the meantime
+    PIN_CACHE_TIME = 300.0
+
+    def __init__(self, ip, user='root', password='dbps', track=None,
+            readBack=False):
+        """readBack makes the first GPIO request of a pin read the modes
+        and states of all pins from the device, see set_gpio."""
         self.ip = ip
+        # trace track the requests are recorded on, see tracing.node_track
+        if track is None:
+            track = ip
+        self.track = track
         self.user = user
         self.password = password
         auth_handler = urllib2.HTTPBasicAuthHandler()
@@ -22,6 +136,123 @@ class RCI:
                 user=self.user,
                 passwd=self.password)
         self.opener = urllib2.build_opener(auth_handler)
+        # Send the credentials with every request instead of waiting for the
+        # challenge of the device, which saves a round trip per request.
+        self.authorization = "Basic %s"%(base64.b64encode("%s:%s"%(
+            self.user, self.password)),)
+        self.opener.addheaders.append(("Authorization", self.authorization))
+        self.warmConnections = []
+        self.lock = threading.Lock()
+        # last known mode and state of the pins, by pin number
+        self.readBack = readBack
+        self.pinModes = {}
+        self.pinStates = {}
+        # when the pins were last set or read, by pin number
+        self.pinTimes = {}
+        self.pinsRead = False
+        self.health = device_health(self.ip)
+        self.healthErrors = self.health.errors
+
+    def warm(self, connections=1):
+        """Connect to the device for the next connections requests ahead of
+        time, so they do not wait for the TCP handshake. Requests use the
+        warm connections in order and fall back to a new one if the device
+        closed them in the meantime. Connections that are still warm count
+        towards connections. Nothing is done for dead devices."""
+        if not self.health.available():
+            return
+        for i in range(connections - len(self.warmConnections)):
+            c = httplib.HTTPConnection(self.ip, timeout=self.TIMEOUT)
+            c.connect()
+            self.lock.acquire()
+            self.warmConnections.append(c)
+            self.lock.release()
+
+    def _warm_connection(self):
+        self.lock.acquire()
+        try:
+            if len(self.warmConnections) > 0:
+                return self.warmConnections.pop(0)
+            return None
+        finally:
+            self.lock.release()
+
+    def _send(self, connection, rcirequest):
+        try:
+            connection.request("POST", "/UE/rci", rcirequest, {
+                "Authorization": self.authorization,
+                "Content-Type": "application/x-www-form-urlencoded"})
+            response = connection.getresponse()
+            if response.status != 200:
+                raise urllib2.HTTPError('http://%s/UE/rci'%(self.ip),
+                        response.status, response.reason, response.msg,
+                        None)
+            return response.read().splitlines(True)
+        finally:
+            connection.close()
+
+    def _attempt(self, rcirequest):
+        connection = self._warm_connection()
+        if connection is not None:
+            try:
+                return self._send(connection, rcirequest)
+            except (socket.error, httplib.HTTPException):
+                # the device closed the connection, the GPIO requests can
+                # safely be sent again
+                pass
+        f = self.opener.open('http://%s/UE/rci'%(self.ip), data=rcirequest,
+                timeout=self.TIMEOUT)
+        return f.readlines()
+
+    def _request(self, name, rcirequest):
+        """Send rcirequest to the device and return the lines of the reply.
+        name describes the request in the trace.
+
+        Attempts that time out, fail to connect or get a server error are
+        retried RETRIES times. Raises DeviceUnavailableError without sending
+        anything if the device failed too often recently, see
+        DeviceHealth."""
+        span = tracing.span(name, "rci", self.track, ip=self.ip)
+        start = time.time()
+        try:
+            try:
+                if not self.health.allow():
+                    raise DeviceUnavailableError, \
+                            "%s is unavailable after %d failed requests: %s"%(
+                            self.ip, self.health.failures,
+                            self.health.lastError)
+                for attempt in range(self.RETRIES + 1):
+                    span.args["attempts"] = attempt + 1
+                    try:
+                        reply = self._attempt(rcirequest)
+                        self.health.success()
+                        return reply
+                    except urllib2.HTTPError, e:
+                        if e.code < 500:
+                            # the device is up, but refuses the request
+                            self.health.success()
+                            raise
+                        error = e
+                    except (IOError, httplib.HTTPException), e:
+                        error = e
+                    except Exception, e:
+                        # e.g. a reply that can not be parsed. Not worth a
+                        # retry, but a probe must not leave the breaker
+                        # half open.
+                        self.health.failure(e)
+                        raise
+                    if attempt < self.RETRIES:
+                        time.sleep(self.RETRY_DELAY * 2 ** attempt *
+                                random.uniform(0.5, 1.5))
+                self.health.failure(error)
+                raise error
+            except:
+                metrics.RCI_ERRORS.labels(self.track).inc()
+                raise
+        finally:
+            metrics.RCI_SECONDS.labels(self.track, name.split()[0]).observe(
+                    time.time() - start)
+            span.end()
 
     def get_settings(self):
         rcirequest = """
@@ -32,61 +263,147 @@ class RCI:
     </query_setting>
 </rci_request>
 """
-        f = self.opener.open('http://%s/UE/rci'%(self.ip), data=rcirequest)
-        return f.readlines()
+        return self._request("get_settings", rcirequest)
 
-    def set_gpio_mode(self, gpio, mode):
+    def read_gpio(self):
+        """Query the modes and states of the pins and remember them.
+        Returns the modes and the states, both by pin number."""
         rcirequest = """
 <rci_request version="1.1">
+    <query_setting>
+        <gpio_mode/>
+    </query_setting>
+    <query_state>
+        <gpio/>
+    </query_state>
+</rci_request>
+"""
+        reply = "".join(self._request("read_gpio", rcirequest))
+        modes = {}
+        states = {}
+        try:
+            root = ElementTree.fromstring(reply)
+        except SyntaxError:
+            return (modes, states)
+        for (path, values) in [(".//gpio_mode", modes),
+                (".//query_state/gpio", states)]:
+            for element in root.findall(path):
+                for pin in element:
+                    if pin.tag.startswith("pin") and pin.text:
+                        values[int(pin.tag[3:])] = pin.text.strip()
+
+        now = time.time()
+        self.lock.acquire()
+        self.pinModes.update(modes)
+        self.pinStates.update(states)
+        for gpio in modes:
+            self.pinTimes[gpio] = now
+        self.pinsRead = True
+        self.lock.release()
+        return (modes, states)
+
+    def forget(self, gpio=None):
+        """Forget the mode and state of pin gpio, or of all pins, e.g. after
+        the device was restarted."""
+        self.lock.acquire()
+        self.pinsRead = False
+        if gpio is None:
+            self.pinModes.clear()
+            self.pinStates.clear()
+            self.pinTimes.clear()
+        else:
+            self.pinModes.pop(gpio, None)
+            self.pinStates.pop(gpio, None)
+            self.pinTimes.pop(gpio, None)
+        self.lock.release()
+
+    def _forget_stale(self, gpio):
+        # A failed request of any RCI object of the device may mean that it
+        # restarted with other modes, and modes older than PIN_CACHE_TIME
+        # may have been changed by another client.
+        errors = self.health.errors
+        if errors != self.healthErrors:
+            self.healthErrors = errors
+            self.forget()
+        elif gpio in self.pinTimes and \
+                time.time() - self.pinTimes[gpio] > self.PIN_CACHE_TIME:
+            self.forget(gpio)
+
+    def set_gpio(self, gpio, mode, state=None):
+        """Set the mode of pin gpio and, unless state is None, its state.
+
+        The mode is only sent if it differs from the last known one, since
+        the device stores settings in its flash. Known modes are forgotten
+        after a failed request to the device and after PIN_CACHE_TIME
+        seconds. If readBack is set, the modes are read from the device
+        first if the pin is unknown and were not read since the last
+        forget. The state is always sent. Returns the lines of the reply, or
+        an empty list if nothing had to be sent."""
+
+        self._forget_stale(gpio)
+        if self.readBack and not self.pinsRead and gpio not in self.pinModes:
+            try:
+                self.read_gpio()
+            except IOError:
+                # send everything, the request reports the problem
+                pass
+
+        name = "set_gpio_mode pin%d %s"%(gpio, mode)
+        parts = []
+        if self.pinModes.get(gpio) != mode:
+            parts.append("""
     <set_setting>
         <gpio_mode>
             <pin%d>%s</pin%d>
         </gpio_mode>
-    </set_setting>
-</rci_request>
-"""%(gpio, mode, gpio)
-
-        f = self.opener.open('http://%s/UE/rci'%(self.ip), data=rcirequest)
-        return f.readlines()
-
-    def set_gpio_high(self, gpio):
-        rcirequest = """
-<rci_request version="1.1">
-     <set_setting>
-         <gpio_mode>
-             <pin%d>out</pin%d>
-         </gpio_mode>
-     </set_setting>
-     <set_state>
+    </set_setting>"""%(gpio, mode, gpio))
+        if state is not None:
+            name = "%s pin%d"%({ASSERTED: "set_gpio_high",
+                UNASSERTED: "set_gpio_low"}.get(state, "set_gpio"), gpio)
+            parts.append("""
+    <set_state>
         <gpio>
-            <pin%d>asserted</pin%d>
+            <pin%d>%s</pin%d>
         </gpio>
-    </set_state>
+    </set_state>"""%(gpio, state, gpio))
+        if len(parts) == 0:
+            return []
+
+        try:
+            reply = self._request(name, """
+<rci_request version="1.1">%s
 </rci_request>
-"""%(gpio, gpio, gpio, gpio)
+"""%("".join(parts),))
+        except:
+            self.forget(gpio)
+            raise
+        if "<error" in "".join(reply):
+            self.forget(gpio)
+            return reply
 
-        f = self.opener.open('http://%s/UE/rci'%(self.ip), data=rcirequest)
-        return f.readlines()
+        self.lock.acquire()
+        self.pinModes[gpio] = mode
+        if state is not None:
+            self.pinStates[gpio] = state
+        self.pinTimes[gpio] = time.time()
+        self.lock.release()
+        return reply
+
+    def set_gpio_mode(self, gpio, mode):
+        return self.set_gpio(gpio, mode)
+
+    def set_gpio_high(self, gpio):
+        return self.set_gpio(gpio, OUT, ASSERTED)
 
     def set_gpio_low(self, gpio):
-        rcirequest = """
-<rci_request version="1.1">
-     <set_setting>
-         <gpio_mode>
-             <pin%d>out</pin%d>
-         </gpio_mode>
-     </set_setting>
-     <set_state>
-        <gpio>
-            <pin%d>unasserted</pin%d>
-        </gpio>
-    </set_state>
-</rci_request>
-"""%(gpio, gpio, gpio, gpio)
+        return self.set_gpio(gpio, OUT, UNASSERTED)
 
-        f = self.opener.open('http://%s/UE/rci'%(self.ip), data=rcirequest)
-        return f.readlines()
 
+class DeviceUnavailableError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
 
 
 if __name__=="__main__":
@@ -98,5 +415,3 @@ if __name__=="__main__":
     rci = RCI('172.17.6.103')
 
     print rci.get_settings()
-
-
@@ -0,0 +1,107 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Limits on the nodes that use a shared resource at the same time.
+
+Nodes that share something, like the USB hub of TelosB motes or the subnet
+of a group of Digi Connect boxes, name it in the resources option of their
+section. The [Resources] section limits how many of them install or reset
+at the same time:
+
+    [Node1]
+    ...
+    resources: hub1, digi-a
+
+    [Resources]
+    hub1: 2
+    # limit of the resources that have none of their own
+    default: 4
+
+Without a limit, or without resources, nodes are not held back.
+"""
+
+import time
+import threading
+import tracing
+import metrics
+
+
+class ResourceLimits:
+    """Semaphores of the limited resources, by name."""
+
+    def __init__(self, limits=None, default=None):
+        if limits is None:
+            limits = {}
+        self.limits = dict(limits)
+        self.default = default
+        self.semaphores = {}
+        # number of acquire calls that wait for a resource
+        self.waiting = 0
+        self.lock = threading.Lock()
+
+    def from_config(config):
+        limits = {}
+        default = None
+        if config.has_section("Resources"):
+            for (name, value) in config.items("Resources"):
+                if name == "default":
+                    default = int(value)
+                else:
+                    limits[name] = int(value)
+        return ResourceLimits(limits, default)
+    from_config = staticmethod(from_config)
+
+    def limit(self, resource):
+        """Number of nodes that may use resource at once, or None."""
+        return self.limits.get(resource, self.default)
+
+    def _limited(self, n):
+        # sorted, so nodes sharing several resources can not deadlock
+        resources = [r for r in set(getattr(n, "resources", []))
+                if self.limit(r) is not None]
+        resources.sort()
+        return resources
+
+    def _semaphore(self, resource):
+        self.lock.acquire()
+        try:
+            if resource not in self.semaphores:
+                self.semaphores[resource] = threading.BoundedSemaphore(
+                        self.limit(resource))
+            return self.semaphores[resource]
+        finally:
+            self.lock.release()
+
+    def acquire(self, n):
+        """Wait until every resource of node n has room for one more node
+        and take it. Returns the seconds waited."""
+        resources = self._limited(n)
+        if len(resources) == 0:
+            return 0.0
+
+        start = time.time()
+        self.lock.acquire()
+        self.waiting += 1
+        self.lock.release()
+        try:
+            for r in resources:
+                self._semaphore(r).acquire()
+        finally:
+            self.lock.acquire()
+            self.waiting -= 1
+            self.lock.release()
+        waited = time.time() - start
+
+        track = tracing.node_track(n)
+        for r in resources:
+            metrics.RESOURCE_IN_USE.labels(r).inc()
+        metrics.RESOURCE_WAIT_SECONDS.labels(track).observe(waited)
+        if waited > 0.001:
+            tracing.record("wait for %s"%(", ".join(resources),), "resource",
+                    track, start, start + waited)
+        return waited
+
+    def release(self, n):
+        """Give back the resources node n took with acquire."""
+        for r in self._limited(n):
+            metrics.RESOURCE_IN_USE.labels(r).dec()
+            self._semaphore(r).release()
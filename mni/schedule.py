@@ -0,0 +1,183 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Timed GPIO operations on many nodes.
+
+A Schedule is a timeline of node operations, like start, stop or pressing
+the user button, at offsets from a common start time. run dispatches the
+operations of every node on a thread of its own: the thread opens the RCI
+connections of the next operation WARM_AHEAD seconds before it is due,
+waits for the target time and then calls the node method. The operations of
+different nodes therefore do not wait for each other, and the latency of
+the RCI requests does not add up along the schedule.
+
+run returns what happened to every action, including its skew, the time
+between the target and the time the operation was sent:
+
+    s = schedule.Schedule()
+    s.stagger(m.get_nodes(), "start", 2.0, seed=1)
+    s.press(m.get_nodes(), 3.0)
+    results = s.run()
+    print "%(actions)d actions, max skew %(maxSkew).1f ms"%(
+            schedule.summarize(results))
+"""
+
+import time
+import random
+import threading
+import tracing
+
+# node methods a schedule can call
+OPERATIONS = ["start", "stop", "reset", "push_usr", "release_usr",
+        "serial_mode", "programming_mode"]
+# RCI requests of the operations of a QuantoTestbedMote, the others send one
+REQUESTS = {"reset": 2}
+# seconds the user button is held by press
+PRESS_DURATION = 0.1
+# seconds before an operation its connections are opened
+WARM_AHEAD = 0.5
+# sleep may overshoot by a few milli seconds, so the last part of the wait
+# polls the clock
+SPIN = 0.002
+
+
+class Action:
+
+    def __init__(self, node, offset, operation):
+        self.node = node
+        self.offset = offset
+        self.operation = operation
+
+
+class Schedule:
+    """Operations on nodes at offsets in seconds from the start of run."""
+
+    def __init__(self, warmAhead=WARM_AHEAD):
+        self.actions = []
+        self.warmAhead = warmAhead
+
+    def add(self, node, offset, operation):
+        if operation not in OPERATIONS:
+            raise ScheduleError, "Unknown operation %s"%(operation,)
+        if offset < 0:
+            raise ScheduleError, "Negative offset %f for %s"%(offset,
+                    operation)
+        self.actions.append(Action(node, offset, operation))
+
+    def press(self, nodes, offset, duration=PRESS_DURATION):
+        """Press the user button of nodes at offset and release it duration
+        seconds later."""
+        for n in nodes:
+            self.add(n, offset, "push_usr")
+            self.add(n, offset + duration, "release_usr")
+
+    def stagger(self, nodes, operation, maxDelay, seed=None, offset=0.0):
+        """Schedule operation on nodes one after another, starting at
+        offset, with random delays of up to maxDelay seconds before each
+        node. The same seed gives the same schedule. Returns the offset
+        after the last node."""
+        rnd = random.Random(seed)
+        for n in nodes:
+            offset += rnd.random() * maxDelay
+            self.add(n, offset, operation)
+        return offset
+
+    def run(self, start=None):
+        """Run the actions at start plus their offsets, by default
+        warmAhead seconds from now, so the first connections are warm in
+        time. Blocks until all actions are done and returns a dictionary per
+        action, ordered by target time, with the keys node (the id),
+        operation, offset, target, sent, done (Unix times), skew (sent -
+        target in seconds) and error (None, or the exception of the
+        operation)."""
+
+        if start is None:
+            start = time.time() + self.warmAhead
+        span = tracing.span("schedule", "control", actions=len(self.actions))
+
+        actions = list(self.actions)
+        actions.sort(key=lambda a: a.offset)
+        nodes = []
+        byNode = {}
+        for a in actions:
+            if a.node not in byNode:
+                byNode[a.node] = []
+                nodes.append(a.node)
+            byNode[a.node].append(a)
+
+        results = []
+        threads = []
+        for n in nodes:
+            p = threading.Thread(target=self._run_node,
+                    args=(byNode[n], start, results))
+            p.start()
+            threads.append(p)
+        for p in threads:
+            p.join()
+        span.end()
+
+        results.sort(key=lambda r: (r["target"], r["node"]))
+        return results
+
+    def _run_node(self, actions, start, results):
+        for a in actions:
+            target = start + a.offset
+            rci = getattr(a.node, "rci", None)
+            if rci is not None:
+                _wait(target - self.warmAhead)
+                try:
+                    rci.warm(REQUESTS.get(a.operation, 1))
+                except Exception:
+                    # the operation opens its own connection
+                    pass
+
+            _wait(target)
+            sent = time.time()
+            error = None
+            try:
+                getattr(a.node, a.operation)()
+            except Exception, e:
+                error = "%s: %s"%(e.__class__.__name__, e)
+            done = time.time()
+
+            tracing.record(a.operation, "schedule", tracing.node_track(a.node),
+                    sent, done, {"skew_ms": (sent - target) * 1000.0,
+                        "error": error})
+            # list.append is atomic, the threads need no lock
+            results.append({
+                "node": a.node.id,
+                "operation": a.operation,
+                "offset": a.offset,
+                "target": target,
+                "sent": sent,
+                "done": done,
+                "skew": sent - target,
+                "error": error,
+            })
+
+
+def _wait(target):
+    remaining = target - time.time()
+    if remaining > SPIN:
+        time.sleep(remaining - SPIN)
+    while time.time() < target:
+        # release the interpreter to the threads of the other nodes
+        time.sleep(0)
+
+
+def summarize(results):
+    """Number of actions and errors, and mean and maximum skew in milli
+    seconds of the results of Schedule.run."""
+    skews = [r["skew"] * 1000.0 for r in results]
+    summary = {"actions": len(results), "meanSkew": 0.0, "maxSkew": 0.0,
+            "errors": len([r for r in results if r["error"] is not None])}
+    if len(skews) > 0:
+        summary["meanSkew"] = sum(skews) / len(skews)
+        summary["maxSkew"] = max(skews)
+    return summary
+
+
+class ScheduleError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
@@ -0,0 +1,247 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Synthetic Quanto measurements with known state powers.
+
+A QuantoTrace describes a simulated node: its states, the true power of
+every state, and a calibration of its iCount energy meter. It writes .pwr
+files in the format read_log.py produces, so the analysis in statepower can
+be run and timed without hardware, and its estimates can be compared with
+the ground truth. write_listen_file writes the same intervals as the hex
+packets the Listen tool prints, for decoding.ListenDecoder.
+"""
+
+import json
+import math
+import random
+import binascii
+import calibration
+import decoding
+
+# AM type and group of the simulated Quanto log messages
+AM_QUANTO_LOG = 0x93
+GROUP = 0x22
+
+# names for the first states, the remaining ones are called devN
+DEVICES = ["cpu", "radio", "flash", "led0", "led1", "led2", "sensor", "uart"]
+
+
+class QuantoTrace:
+    """Ground truth and interval generator of a simulated Quanto node.
+
+    numStates states change their activity one at a time, like the devices
+    of a mote, and every state i adds statePower[i] milli Watt to the
+    constant power of the node while it is active. The alwaysOff extra
+    states are never active, the alwaysOn ones always are. The measured
+    power of an interval deviates from the true one by a normally
+    distributed relative error with standard deviation noise.
+    """
+
+    def __init__(self, seed=0, numStates=8, alwaysOff=1, alwaysOn=1,
+            noise=0.02, meanInterval=2000, calibrationPoints=8):
+        self.seed = seed
+        self.noise = noise
+        # mean duration of an interval in microseconds
+        self.meanInterval = meanInterval
+        rnd = random.Random(seed)
+
+        self.varyingStates = []
+        for i in range(numStates):
+            if i < len(DEVICES):
+                self.varyingStates.append(DEVICES[i])
+            else:
+                self.varyingStates.append("dev%d"%(i,))
+        self.alwaysOffStates = ["off%d"%(i,) for i in range(alwaysOff)]
+        self.alwaysOnStates = ["on%d"%(i,) for i in range(alwaysOn)]
+        self.states = self.varyingStates + self.alwaysOffStates + \
+                self.alwaysOnStates
+
+        # powers from 0.5 to 30 mW, evenly spread on a log scale
+        self.statePower = {}
+        for s in self.states:
+            self.statePower[s] = math.exp(rnd.uniform(math.log(0.5),
+                math.log(30.0)))
+        self.constPower = rnd.uniform(0.1, 1.0)
+        # probability that a state is active
+        self.activity = {}
+        for s in self.varyingStates:
+            self.activity[s] = rnd.uniform(0.1, 0.6)
+
+        self.frequencies = simulated_calibration(rnd, calibrationPoints)
+        self.table = calibration.CalibrationTable(self.frequencies)
+
+    def expected_state_power(self):
+        """The statePower the analysis should find. Always active states
+        can not be told apart from the constant power, so they are part of
+        'const'."""
+        power = {}
+        for s in self.varyingStates:
+            power[s] = self.statePower[s]
+        power['const'] = self.constPower
+        for s in self.alwaysOnStates:
+            power['const'] += self.statePower[s]
+        return power
+
+    def ground_truth(self):
+        return {
+                'statePower': self.expected_state_power(),
+                'alwaysOffStates': self.alwaysOffStates,
+                'alwaysOnStates': self.alwaysOnStates,
+                'calibration': self.frequencies,
+        }
+
+    def icount(self, energy, time):
+        """Number of iCounts the calibrated meter reports for energy milli
+        Joule in time seconds."""
+
+        # The energy per iCount depends on the iCount frequency, so start
+        # with the value at the middle of the table and refine it.
+        perICount = self.table.energies[len(self.table.energies) / 2]
+        icount = energy / perICount
+        for i in range(3):
+            icount = energy / (self.table.get_energy(icount, time) / icount)
+        return max(1, int(round(icount)))
+
+    def intervals(self, seed=None):
+        """Generate (activeStates, time in microseconds, icount) tuples,
+        where activeStates has a 1 or a 0 for every state."""
+
+        if seed is None:
+            seed = self.seed
+        rnd = random.Random(seed)
+        active = {}
+        for s in self.varyingStates:
+            active[s] = rnd.random() < self.activity[s]
+        for s in self.alwaysOffStates:
+            active[s] = False
+        for s in self.alwaysOnStates:
+            active[s] = True
+
+        while True:
+            time = 30 + int(rnd.expovariate(1.0 / self.meanInterval))
+            power = self.constPower
+            for s in self.states:
+                if active[s]:
+                    power += self.statePower[s]
+            power *= max(0.01, rnd.gauss(1.0, self.noise))
+            icount = self.icount(power * time / 1e6, time / 1e6)
+            yield ([active[s] and 1 or 0 for s in self.states], time, icount)
+
+            # the next interval starts with a change of a state
+            s = rnd.choice(self.varyingStates)
+            active[s] = rnd.random() < self.activity[s]
+
+    def write_pwr_file(self, fileName, intervals=None, size=None, seed=None):
+        """Write a .pwr file with intervals intervals, or at least size
+        bytes of them. Returns the number of intervals written."""
+
+        if intervals is None and size is None:
+            raise ValueError, "Either intervals or size has to be given"
+
+        f = open(fileName, "w")
+        f.write("#states: %s\n"%(" ".join(self.states),))
+        written = 0
+        lines = []
+        for (active, time, icount) in self.intervals(seed):
+            bits = [a and "1" or "-" for a in active]
+            lines.append("%s %d %d 1\n"%(" ".join(bits), time, icount))
+            written += 1
+            if intervals is not None and written >= intervals:
+                break
+            if len(lines) == 1000:
+                f.write("".join(lines))
+                lines = []
+                if size is not None and f.tell() >= size:
+                    break
+        f.write("".join(lines))
+        f.close()
+        return written
+
+
+    def resources(self):
+        """The (resource id, name) pairs of the states in the Listen
+        packets of write_listen_file, see decoding.ListenDecoder."""
+        return list(enumerate(self.states))
+
+    def write_listen_file(self, fileName, intervals, seed=None,
+            entriesPerPacket=8):
+        """Write intervals intervals as the Listen tool prints the Quanto log
+        messages of a node, entriesPerPacket entries per packet. Every
+        interval starts with an entry, and the states that change with a
+        TYPE_POWER_STATE entry each."""
+
+        entry = decoding.ListenDecoder.ENTRY
+        powerState = decoding.ListenDecoder.TYPE_POWER_STATE
+        entries = []
+        states = [None] * len(self.states)
+        (t, c) = (0, 0)
+        written = 0
+        for (active, time, icount) in self.intervals(seed):
+            changed = False
+            for (i, a) in enumerate(active):
+                if a != states[i]:
+                    entries.append((powerState, i, t, c, a))
+                    changed = True
+            if not changed:
+                # an entry of no power state
+                entries.append((0, 255, t, c, 0))
+            states = active
+            t += time
+            c += icount
+            written += 1
+            if written >= intervals:
+                break
+        # the end of the last interval
+        entries.append((0, 255, t, c, 0))
+
+        f = open(fileName, "w")
+        for first in range(0, len(entries), entriesPerPacket):
+            payload = "".join([entry.pack(type, resource, t % 2**32,
+                c % 2**32, arg) for (type, resource, t, c, arg)
+                in entries[first:first + entriesPerPacket]])
+            header = "\x00\xff\xff\x00\x01%s%s%s"%(chr(len(payload)),
+                    chr(GROUP), chr(AM_QUANTO_LOG))
+            f.write(" ".join([binascii.hexlify(b).upper()
+                for b in header + payload]) + " \n")
+        f.close()
+        return written
+
+
+def simulated_calibration(rnd, points=8):
+    """Calibration in the format of QuantoTestbedMote.calibrate, with iCount
+    frequencies from 1 MHz down to 100 Hz. The energy per iCount of the
+    meter drifts slightly with the frequency, like the real ones."""
+
+    base = rnd.uniform(0.0009, 0.0011)
+    slope = rnd.uniform(-0.02, 0.02)
+    frequencies = {}
+    for i in range(points):
+        # the frequency falls with increasing resistor value
+        exponent = 6.0 - 4.0 * i / (points - 1)
+        resistor = int(round(10 ** (8.0 - exponent)))
+        frequencies[resistor] = {
+                'res': "%d"%(resistor,),
+                'freq': 10 ** exponent,
+                'E': base * (1 + slope * (exponent - 4)),
+        }
+    return frequencies
+
+
+def write_measurement(mni, baseFileName, intervals=None, size=None):
+    """Write a .pwr file for every simulated node of mni, as
+    parse_quanto_log_all would have for a real measurement, and calibrate
+    the nodes. The ground truth of every node is written next to its .pwr
+    file with the extension .truth.json. Returns the number of intervals
+    written per node id."""
+
+    written = {}
+    for n in mni.get_nodes():
+        if getattr(n, "trace", None) is None:
+            continue
+        n.calibrate(n.trace.frequencies)
+        fileName = mni.log_file_name(n, baseFileName)
+        written[n.id] = n.trace.write_pwr_file("%s.pwr"%(fileName,),
+                intervals, size)
+        f = open("%s.truth.json"%(fileName,), "w")
+        json.dump(n.trace.ground_truth(), f, indent=2)
+        f.close()
+    return written
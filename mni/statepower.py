@@ -0,0 +1,868 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Estimation of the power consumption per Quanto state.
+
+The functions in this module do not touch node objects or any other shared
+state. They only get the name of a .pwr file and the calibration table of a
+node, which makes it possible to run the analysis of several nodes in a pool
+of worker processes.
+"""
+
+import os
+import sys
+import numpy
+import threading
+import multiprocessing
+
+from mni import CalibrationError
+
+try:
+    import scipy.sparse
+    scipyAvailable = True
+except ImportError:
+    scipyAvailable = False
+
+
+class PwrIntervals:
+    """The intervals of a .pwr file, grouped by their state signature.
+
+    Quanto logs contain a huge number of intervals during which the same set
+    of states was active. For the weighted least squares problem, all
+    intervals with the same signature can be merged into a single row by
+    summing their weights and weighted powers, which gives exactly the same
+    normal equations. Rows are kept in the order in which their signature
+    first appeared.
+
+    X holds one row per signature with the value of every state and a
+    trailing 1 for the const state. For every row, weight and
+    weightedPower hold the sums of sqrt(E*t) and sqrt(E*t)*E over the
+    merged intervals, weightedPowerSquared the sum of sqrt(E*t)*E*E, and
+    time, energy and count the total time, energy and number of merged
+    intervals.
+    """
+
+    def __init__(self, states, X, weight, weightedPower,
+            weightedPowerSquared, time, energy, count):
+        self.states = states
+        self.X = X
+        self.weight = weight
+        self.weightedPower = weightedPower
+        self.weightedPowerSquared = weightedPowerSquared
+        self.time = time
+        self.energy = energy
+        self.count = count
+        self.totalTime = float(numpy.sum(time))
+        self.totalEnergy = float(numpy.sum(energy))
+
+    def __len__(self):
+        return len(self.X)
+
+
+class SparseStateMatrix:
+    """State matrix in compressed sparse row format.
+
+    Row i has the values data[indptr[i]:indptr[i+1]] in the columns
+    indices[indptr[i]:indptr[i+1]], all other entries are 0. Memory and the
+    cost of the normal equations grow with the number of active states per
+    row instead of the number of states. scipy.sparse does the arithmetic
+    if it is available.
+    """
+
+    def __init__(self, indptr, indices, data, numColumns):
+        self.indptr = numpy.asarray(indptr, dtype=numpy.int64)
+        self.indices = numpy.asarray(indices, dtype=numpy.int64)
+        self.data = numpy.asarray(data, dtype=float)
+        self.shape = (len(self.indptr) - 1, numColumns)
+
+    def from_rows(rows, numColumns):
+        """Build a matrix from a list of (indices, values) tuples."""
+        indptr = [0]
+        indices = []
+        data = []
+        for (i, v) in rows:
+            indices.extend(i)
+            data.extend(v)
+            indptr.append(len(indices))
+        return SparseStateMatrix(indptr, indices, data, numColumns)
+    from_rows = staticmethod(from_rows)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _row_of_entries(self):
+        return numpy.repeat(numpy.arange(self.shape[0]),
+                numpy.diff(self.indptr))
+
+    def column_counts(self):
+        """Number of non-zero entries per column."""
+        return numpy.bincount(self.indices[self.data != 0],
+                minlength=self.shape[1])
+
+    def select_columns(self, mask):
+        """Return a new matrix with the columns where mask is True."""
+        mask = numpy.asarray(mask, dtype=bool)
+        newIndex = numpy.cumsum(mask) - 1
+        keep = mask[self.indices]
+        rowCounts = numpy.bincount(self._row_of_entries()[keep],
+                minlength=self.shape[0])
+        indptr = numpy.concatenate(([0], numpy.cumsum(rowCounts)))
+        return SparseStateMatrix(indptr, newIndex[self.indices[keep]],
+                self.data[keep], int(mask.sum()))
+
+    def toarray(self):
+        X = numpy.zeros(self.shape)
+        X[self._row_of_entries(), self.indices] = self.data
+        return X
+
+    def normal_equations(self, weight, weightedValue):
+        """Return X'diag(weight)X and X'weightedValue as dense arrays."""
+
+        if scipyAvailable:
+            X = scipy.sparse.csr_matrix((self.data, self.indices,
+                self.indptr), shape=self.shape)
+            XtWX = (X.T * scipy.sparse.diags(weight, 0) * X).toarray()
+            return XtWX, X.T.dot(weightedValue)
+
+        k = self.shape[1]
+        rows = self._row_of_entries()
+        XtWY = numpy.bincount(self.indices,
+                weights=self.data * weightedValue[rows], minlength=k)
+
+        # every pair of entries in the same row contributes to X'WX
+        rowCounts = numpy.diff(self.indptr)
+        entryCounts = rowCounts[rows]
+        first = numpy.repeat(numpy.arange(len(self.indices)), entryCounts)
+        # index of the first entry of the row, plus the position in the row
+        starts = numpy.cumsum(entryCounts) - entryCounts
+        second = (numpy.repeat(self.indptr[rows], entryCounts)
+                + numpy.arange(len(first)) - numpy.repeat(starts, entryCounts))
+        XtWX = numpy.bincount(self.indices[first] * k + self.indices[second],
+                weights=self.data[first] * self.data[second]
+                * weight[rows[first]], minlength=k*k)
+        return XtWX.reshape((k, k)), XtWY
+
+
+def normal_equations(X, weight, weightedValue):
+    """Return X'diag(weight)X and X'weightedValue for a dense state matrix
+    or a SparseStateMatrix."""
+
+    if isinstance(X, SparseStateMatrix):
+        return X.normal_equations(weight, weightedValue)
+    return numpy.dot(X.T * weight, X), numpy.dot(X.T, weightedValue)
+
+
+def load_pwr_file(fileName, table, ip, sparse=False):
+    """Read a .pwr file and return its intervals as PwrIntervals.
+
+    The state columns of every line are used as grouping key as they are,
+    so that only the first line of every signature is converted to
+    numbers. With sparse, X is a SparseStateMatrix instead of a dense
+    array. fileName may also be a columns directory, which is
+    memory-mapped instead, see columnar.
+    """
+
+    if os.path.isdir(fileName):
+        import columnar
+        return columnar.load_intervals(fileName, table, ip, sparse)
+
+    if len(table) == 0:
+        raise CalibrationError, "Node with IP %s is not calibrated! \
+Did you forget to load the calibration file?"%(ip,)
+
+    states = []
+    # signature -> [weight, weightedPower, weightedPowerSquared, time,
+    #               energy, count]
+    groups = {}
+    signatures = []
+
+    f = open(fileName, "r")
+    for line in f:
+        if line.startswith("#states:"):
+            # this line encodes the names of all the states.
+            newStates = line.split()[1:]
+            if len(newStates) != len(states):
+                # intervals with a different number of states are
+                # incomplete datasets
+                groups = {}
+                signatures = []
+            states = newStates
+            continue
+        if len(states) == 0:
+            continue
+
+        l = line.rsplit(None, 3)
+        if len(l) != 4:
+            continue
+        signature = l[0]
+        try:
+            #time is in uS, convert it to seconds
+            time = float(l[1])/1e6
+            icount = int(l[2])
+            int(l[3])
+        except ValueError:
+            continue
+
+        if time <= 0 or icount <= 0:
+            # FIXME: this is a wrong line at the end of the quanto files. I
+            # don't know why this happens!!!
+            continue
+
+        group = groups.get(signature)
+        if group is None:
+            if len(signature.split()) != len(states):
+                continue
+            group = [0.0, 0.0, 0.0, 0.0, 0.0, 0]
+            groups[signature] = group
+            signatures.append(signature)
+        _add_to_group(group, table, ip, icount, time)
+    f.close()
+
+    return _pwr_intervals(states, [[s != '-' and int(s) or 0
+        for s in signature.split()] for signature in signatures],
+        [groups[s] for s in signatures], sparse)
+
+
+def load_columns(states, signatures, signature, time, icount, table, ip,
+        sparse=False):
+    """Return the intervals of a node kept in columns as PwrIntervals, like
+    load_pwr_file. signatures holds the activeStates of every signature,
+    and the columns signature, time (in seconds) and icount hold the index
+    into signatures, time and iCounts of every interval, e.g. those of a
+    decoding.IntervalColumns or a columnar.Columns. The columns are
+    processed as arrays, without a loop over the intervals."""
+
+    if len(table) == 0:
+        raise CalibrationError, "Node with IP %s is not calibrated! \
+Did you forget to load the calibration file?"%(ip,)
+
+    signature = numpy.asarray(signature, dtype=numpy.int64)
+    time = numpy.asarray(time, dtype=float)
+    icount = numpy.asarray(icount, dtype=numpy.int64)
+    valid = (time > 0) & (icount > 0)
+    if not numpy.all(valid):
+        signature = signature[valid]
+        time = time[valid]
+        icount = icount[valid]
+
+    E = table.get_power_array(icount, time)
+    if numpy.any(E < 0):
+        i = numpy.flatnonzero(E < 0)[0]
+        raise CalibrationError, "Node with IP %s returned a \
+negative Energy value %f for icount %d, time %f!"%(ip, E[i], icount[i],
+                time[i])
+    energy = E*time
+    w = numpy.sqrt(energy)
+    sums = numpy.zeros((len(signatures), 6))
+    for (j, values) in enumerate([w, w*E, w*E*E, time, energy,
+            numpy.ones(len(time))]):
+        sums[:, j] = numpy.bincount(signature, values,
+                minlength=len(signatures))
+
+    # signatures without a valid interval are left out, like in .pwr files
+    used = numpy.flatnonzero(sums[:, 5] > 0)
+    return _pwr_intervals(states, [list(signatures[i]) for i in used],
+            sums[used], sparse)
+
+
+def _add_to_group(group, table, ip, icount, time):
+    E = table.get_power(icount, time)
+    if E < 0:
+        raise CalibrationError, "Node with IP %s returned a \
+negative Energy value %f for icount %d, time %f!"%(ip, E, icount, time)
+    energy = E*time
+    w = numpy.sqrt(energy)
+    group[0] += w
+    group[1] += w*E
+    group[2] += w*E*E
+    group[3] += time
+    group[4] += energy
+    group[5] += 1
+
+
+def _pwr_intervals(states, signatures, groups, sparse):
+    # signatures holds the activeStates and groups the sums of every row
+    if sparse:
+        rows = []
+        for signature in signatures:
+            indices = []
+            values = []
+            for (i, s) in enumerate(signature):
+                if s != 0:
+                    indices.append(i)
+                    values.append(s)
+            # the constant power state
+            indices.append(len(states))
+            values.append(1)
+            rows.append((indices, values))
+        X = SparseStateMatrix.from_rows(rows, len(states)+1)
+    else:
+        # +1 for the constant power state
+        X = numpy.ones((len(signatures), len(states)+1))
+        for i in range(len(signatures)):
+            X[i, :-1] = signatures[i]
+    sums = numpy.array(groups, dtype=float).reshape((len(signatures), 6))
+
+    return PwrIntervals(states, X, sums[:, 0], sums[:, 1], sums[:, 2],
+            sums[:, 3], sums[:, 4], sums[:, 5].astype(int))
+
+
+def classify_state_counts(activeCount, rows):
+    """Classify states by the number of rows in which they are active.
+
+    Returns three boolean arrays (alwaysOff, alwaysOn, varying) marking the
+    states that were never active, active in all rows, and all others.
+    """
+
+    activeCount = numpy.asarray(activeCount)
+    alwaysOff = activeCount == 0
+    alwaysOn = (activeCount == rows) & ~alwaysOff
+    return alwaysOff, alwaysOn, ~(alwaysOff | alwaysOn)
+
+
+def classify_states(X):
+    """Classify the columns of the state matrix X, see
+    classify_state_counts."""
+
+    X = numpy.asarray(X)
+    return classify_state_counts((X != 0).sum(axis=0), X.shape[0])
+
+
+def analyze_pwr_file(fileName, table, ip, convexOpt=False, x0=None,
+        sparse=False, bootstrap=0, confidence=0.95, processes=1):
+    """Estimate the power per state for one node.
+
+    fileName is the .pwr file of the node or its columns directory (see
+    load_pwr_file), table its CalibrationTable and ip
+    is only used in messages. Returns a dictionary with the keys statePower,
+    alwaysOnStates, alwaysOffStates and averagePower, and an error message
+    under the key error if the state matrix turned out to be singular.
+
+    With convexOpt, the state powers are constrained to be non-negative.
+    x0 may then hold the statePower of a previous run to start from. With
+    sparse, the state matrix is kept in a SparseStateMatrix, which pays
+    off for applications with many mostly inactive states.
+
+    If bootstrap is larger than 0, the result also holds confidence
+    intervals at the given confidence level under the key statePowerCI,
+    computed from that many bootstrap replicates by processes processes
+    (see bootstrap_state_power).
+    """
+
+    return analyze_intervals(load_pwr_file(fileName, table, ip, sparse), ip,
+            convexOpt, x0, bootstrap, confidence, processes)
+
+
+def analyze_intervals(intervals, ip, convexOpt=False, x0=None, bootstrap=0,
+        confidence=0.95, processes=1):
+    """Estimate the power per state from PwrIntervals, see
+    analyze_pwr_file."""
+
+    states = intervals.states
+    if isinstance(intervals.X, SparseStateMatrix):
+        counts = intervals.X.column_counts()
+    else:
+        counts = (intervals.X != 0).sum(axis=0)
+    alwaysOff, alwaysOn, varying = classify_state_counts(counts[:-1],
+            len(intervals))
+    alwaysOffStates = [states[i] for i in numpy.flatnonzero(alwaysOff)]
+    alwaysOnStates = [states[i] for i in numpy.flatnonzero(alwaysOn)]
+
+    # always active states can not be told apart from the const state, so
+    # they are put into the "const" category
+    keep = numpy.append(varying, True)
+    if isinstance(intervals.X, SparseStateMatrix):
+        X = intervals.X.select_columns(keep)
+    else:
+        X = intervals.X[:, keep]
+    states = [states[i] for i in numpy.flatnonzero(varying)] + ['const']
+
+    result = {
+            'statePower': {},
+            'alwaysOffStates': [],
+            'alwaysOnStates': [],
+            'averagePower': None,
+            'statePowerCI': {},
+            'error': None,
+    }
+
+    XtWX, XtWY = normal_equations(X, intervals.weight,
+            intervals.weightedPower)
+
+    if convexOpt:
+        # warm start from the states that had a positive power before
+        if x0 is not None:
+            x0 = numpy.array([max(x0.get(str(s), 0.0), 0.0) for s in states])
+        x = nnls(XtWX, XtWY, x0)
+
+    else:
+
+        try:
+            x = numpy.linalg.solve(XtWX, XtWY)
+        except numpy.linalg.LinAlgError, e:
+            result['error'] = "State Matrix X for node with IP %s is singular. \
+We did not collect enough energy and state information. Please run the \
+application for longer!\n%s"%(ip, repr(e))
+            return result
+
+    for i in range(len(states)):
+        result['statePower'][str(states[i])] = float(x[i])
+    result['alwaysOffStates'] = alwaysOffStates
+    result['alwaysOnStates'] = alwaysOnStates
+    result['averagePower'] = intervals.totalEnergy / intervals.totalTime
+
+    if bootstrap > 0:
+        if isinstance(X, SparseStateMatrix):
+            X = X.toarray()
+        samples = bootstrap_state_power(X, intervals, bootstrap,
+                convexOpt=convexOpt, processes=processes)
+        tail = 100 * (1 - confidence) / 2
+        low = numpy.percentile(samples, tail, axis=0)
+        high = numpy.percentile(samples, 100 - tail, axis=0)
+        for i in range(len(states)):
+            result['statePowerCI'][str(states[i])] = (float(low[i]),
+                    float(high[i]))
+    return result
+
+
+def _bootstrap_chunk(args):
+    # Solve a batch of bootstrap replicates. Runs in worker processes, so
+    # all arguments come in a single tuple.
+    (X, weight, meanPower, variance, count, replicates, convexOpt, seed) = args
+
+    rnd = numpy.random.RandomState(seed)
+    # resample the intervals: draw how often each signature is picked
+    picks = rnd.multinomial(count.sum(), count / float(count.sum()),
+            size=replicates)
+    # mean weight of an interval of each signature, times its picks
+    W = picks * (weight / count)
+    # the mean power of the picked intervals of a signature deviates from
+    # the signature mean with the variance of its intervals over the picks
+    noise = rnd.standard_normal(picks.shape) * numpy.sqrt(
+            variance / numpy.maximum(picks, 1))
+    WY = W * (meanPower + noise)
+
+    # X'WX of all replicates in one product: every row of X contributes
+    # its outer product, weighted by the replicate's weight of that row
+    p = X.shape[1]
+    outer = (X[:, :, numpy.newaxis] * X[:, numpy.newaxis, :]).reshape(
+            (len(X), p*p))
+    A = numpy.dot(W, outer).reshape((replicates, p, p))
+    b = numpy.dot(WY, X)
+
+    if convexOpt:
+        return numpy.array([nnls(A[r], b[r]) for r in range(replicates)])
+    try:
+        return numpy.linalg.solve(A, b[:, :, numpy.newaxis])[:, :, 0]
+    except numpy.linalg.LinAlgError:
+        # some replicates missed a state. pinv gives the minimum norm
+        # solution for those.
+        return numpy.einsum('rij,rj->ri', numpy.linalg.pinv(A), b)
+
+
+def bootstrap_state_power(X, intervals, replicates, convexOpt=False,
+        processes=1, seed=None, chunkSize=256):
+    """Return a replicates x states array of bootstrap estimates.
+
+    Every replicate resamples the intervals of the PwrIntervals with
+    replacement. As the intervals are merged by signature, a replicate
+    draws how many intervals it picks of every signature, and the mean
+    power of those picks is approximated by a normal distribution around
+    the signature mean. X is the dense state matrix of the states to
+    estimate. The replicates are solved in batches of chunkSize with one
+    stacked NumPy solve each, spread over processes worker processes.
+    """
+
+    weight = intervals.weight
+    meanPower = intervals.weightedPower / weight
+    variance = numpy.maximum(
+            intervals.weightedPowerSquared / weight - meanPower**2, 0.0)
+    count = intervals.count.astype(float)
+
+    seeds = numpy.random.RandomState(seed).randint(0, 2**31 - 1,
+            size=(replicates + chunkSize - 1) // chunkSize)
+    chunks = []
+    for (i, chunkSeed) in enumerate(seeds):
+        size = min(chunkSize, replicates - i*chunkSize)
+        chunks.append((X, weight, meanPower, variance, count, size,
+            convexOpt, chunkSeed))
+
+    processes = min(processes, len(chunks))
+    if processes <= 1:
+        return numpy.concatenate([_bootstrap_chunk(c) for c in chunks])
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        samples = pool.map(_bootstrap_chunk, chunks, chunksize=1)
+    finally:
+        pool.terminate()
+        pool.join()
+    return numpy.concatenate(samples)
+
+
+def analyze_pooled(intervalsList, ips, shrinkage=0.1):
+    """Estimate the power per state of several similar nodes at once.
+
+    The power of every state on node n is modelled as a power shared by
+    all nodes plus a node specific offset. The offsets are pulled towards
+    zero with a ridge penalty of shrinkage times the mean diagonal entry of
+    the node's X'WX, except for the const state, which is free per node.
+    States one node can not resolve on its own are thus estimated from the
+    other nodes. Larger values of shrinkage pool the nodes more strongly.
+
+    intervalsList holds the PwrIntervals of every node and ips their IPs.
+    Returns a list of results in the format of analyze_pwr_file.
+    """
+
+    # all states of all nodes, in the order of their first appearance
+    allStates = []
+    for intervals in intervalsList:
+        for state in intervals.states:
+            if state not in allStates:
+                allStates.append(state)
+    index = dict([(state, i) for (i, state) in enumerate(allStates)])
+    p = len(allStates) + 1
+
+    results = []
+    varyingAnywhere = numpy.zeros(len(allStates), dtype=bool)
+    A = numpy.zeros((len(intervalsList), p, p))
+    b = numpy.zeros((len(intervalsList), p))
+    for (n, intervals) in enumerate(intervalsList):
+        if isinstance(intervals.X, SparseStateMatrix):
+            counts = intervals.X.column_counts()
+        else:
+            counts = (intervals.X != 0).sum(axis=0)
+        alwaysOff, alwaysOn, varying = classify_state_counts(counts[:-1],
+                len(intervals))
+        columns = [index[state] for state in intervals.states] + [p - 1]
+        varyingAnywhere[columns[:-1]] |= varying
+
+        XtWX, XtWY = normal_equations(intervals.X, intervals.weight,
+                intervals.weightedPower)
+        A[n][numpy.ix_(columns, columns)] = XtWX
+        b[n][columns] = XtWY
+
+        states = intervals.states
+        results.append({
+                'statePower': {},
+                'alwaysOffStates': [states[i]
+                    for i in numpy.flatnonzero(alwaysOff)],
+                'alwaysOnStates': [states[i]
+                    for i in numpy.flatnonzero(alwaysOn)],
+                'averagePower': intervals.totalEnergy / intervals.totalTime,
+                'statePowerCI': {},
+                'error': None,
+                'varying': [states[i] for i in numpy.flatnonzero(varying)],
+        })
+
+    # states that never vary on any node can not be told apart from const
+    keep = list(numpy.flatnonzero(varyingAnywhere)) + [p - 1]
+    A = A[:, keep][:, :, keep]
+    b = b[:, keep]
+    k = len(keep)
+
+    penalty = numpy.ones(k)
+    penalty[-1] = 0
+    scale = shrinkage * numpy.trace(A, axis1=1, axis2=2) / k
+    Lambda = scale[:, numpy.newaxis] * penalty
+    M = A + Lambda[:, :, numpy.newaxis] * numpy.eye(k)
+
+    try:
+        # eliminate the offsets o_n = M_n^-1 (b_n - A_n s), which leaves
+        # sum(A_n - A_n M_n^-1 A_n) s = sum(b_n - A_n M_n^-1 b_n). As
+        # M_n - A_n = Lambda_n, this is sum(Lambda_n M_n^-1 A_n) s =
+        # sum(Lambda_n M_n^-1 b_n), which avoids the cancellation. The const
+        # state is not penalized, so it has no shared part.
+        MinvA = numpy.linalg.solve(M, A)
+        Minvb = numpy.linalg.solve(M, b[:, :, numpy.newaxis])[:, :, 0]
+        S = (Lambda[:, :, numpy.newaxis] * MinvA).sum(axis=0)
+        r = (Lambda * Minvb).sum(axis=0)
+        shared = numpy.zeros(k)
+        shared[:-1] = numpy.linalg.solve(S[:-1, :-1], r[:-1])
+    except numpy.linalg.LinAlgError, e:
+        for (result, ip) in zip(results, ips):
+            result['error'] = "The pooled state matrix for node with IP %s \
+is singular. We did not collect enough energy and state information. \
+Please run the application for longer!\n%s"%(ip, repr(e))
+            result['statePower'] = {}
+            del result['varying']
+        return results
+
+    offsets = Minvb - numpy.einsum('nij,j->ni', MinvA, shared)
+    states = [allStates[i] for i in keep[:-1]] + ['const']
+    for (n, result) in enumerate(results):
+        x = shared + offsets[n]
+        for i in range(k):
+            if states[i] in result['varying'] or states[i] == 'const':
+                result['statePower'][str(states[i])] = float(x[i])
+        del result['varying']
+    return results
+
+
+def _load_pwr_file_kwargs(kwargs):
+    # Pool.map only passes a single argument to the worker function.
+    return load_pwr_file(**kwargs)
+
+
+def load_pwr_files(jobs, processes=None):
+    """Run load_pwr_file for every dictionary of keyword arguments in jobs
+    in a pool of processes worker processes, see analyze_pwr_files."""
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(jobs))
+
+    if processes <= 1:
+        return [load_pwr_file(**job) for job in jobs]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_load_pwr_file_kwargs, jobs, chunksize=1)
+    finally:
+        pool.terminate()
+        pool.join()
+    return results
+
+
+def _solve_passive(A, b, passive):
+    # Unconstrained solution on the passive set, zero elsewhere.
+    z = numpy.zeros(len(b))
+    if not passive.any():
+        return z
+    Ap = A[numpy.ix_(passive, passive)]
+    try:
+        z[passive] = numpy.linalg.solve(Ap, b[passive])
+    except numpy.linalg.LinAlgError:
+        z[passive] = numpy.linalg.lstsq(Ap, b[passive], rcond=None)[0]
+    return z
+
+
+def nnls(A, b, x0=None, tol=None, maxIter=None):
+    """Non-negative least squares on the normal equations.
+
+    Minimizes x'Ax/2 - b'x subject to x >= 0, where A = X'WX and b = X'WY,
+    with the active set method of Lawson and Hanson. If x0 is given, its
+    positive entries are the initial passive set, so that a solution of a
+    similar problem converges in very few iterations.
+    """
+
+    A = numpy.asarray(A, dtype=float)
+    b = numpy.asarray(b, dtype=float)
+    n = len(b)
+    if tol is None:
+        tol = 10 * numpy.finfo(float).eps * max(1.0, numpy.abs(A).max()) * n
+    if maxIter is None:
+        maxIter = 3 * n
+
+    if x0 is None:
+        x = numpy.zeros(n)
+    else:
+        x = numpy.maximum(numpy.asarray(x0, dtype=float), 0.0)
+    passive = x > 0
+
+    for iteration in range(maxIter + 1):
+        if iteration > 0 or not passive.any():
+            # move the variable with the largest gradient into the passive
+            # set
+            w = b - numpy.dot(A, x)
+            w[passive] = -numpy.inf
+            j = numpy.argmax(w)
+            if w[j] <= tol:
+                break
+            passive[j] = True
+
+        # solve on the passive set, stepping back towards the feasible x
+        # whenever the unconstrained solution leaves the feasible region
+        z = _solve_passive(A, b, passive)
+        while passive.any() and (z[passive] <= tol).any():
+            negative = passive & (z <= tol)
+            alpha = numpy.min(x[negative] / numpy.maximum(
+                x[negative] - z[negative], numpy.finfo(float).tiny))
+            x = x + alpha * (z - x)
+            passive &= x > tol
+            z = _solve_passive(A, b, passive)
+        x = z
+
+    return x
+
+
+def parse_pwr_line(line, numStates):
+    """Parse one interval line of a .pwr file with numStates state columns.
+
+    Returns a tuple (activeStates, time, icount, occurences), where
+    activeStates is a list of 0/1 values per state and time is in seconds,
+    or None if the line is not a valid interval.
+    """
+
+    l = line.split()
+    if numStates == 0 or len(l) != numStates+3:
+        return None
+    activeStates = []
+    for s in l[0:-3]:
+        if s == '-':
+            s = '0'
+        activeStates.append(int(s))
+    #time is in uS, convert it to seconds
+    return (activeStates, float(l[-3])/1e6, int(l[-2]), int(l[-1]))
+
+
+class OnlineStateEstimator:
+    """Incremental version of analyze_pwr_file.
+
+    Instead of keeping the state matrix X, the estimator accumulates the
+    normal equations X'WX and X'WY of the weighted least squares problem
+    while the intervals arrive. Memory use only depends on the number of
+    states, and solution() returns the current estimate at any moment.
+
+    Intervals can be added directly with add_interval, or as lines in the
+    format of a .pwr file with feed_line. Instances are callable with a
+    line. During a capture, a decoding.DecodingSink adds the intervals it
+    decodes from the Listen packets of the node.
+    """
+
+    def __init__(self, table, ip=None, states=None):
+        self.table = table
+        self.ip = ip
+        self.lock = threading.Lock()
+        self.set_states(states or [])
+
+    def set_states(self, states):
+        """Set the names of the states and discard all accumulated data."""
+        self.lock.acquire()
+        try:
+            self.states = list(states)
+            # +1 for the constant power state
+            k = len(self.states) + 1
+            self.XtWX = numpy.zeros((k, k))
+            self.XtWY = numpy.zeros(k)
+            self.activeCount = numpy.zeros(k, dtype=numpy.int64)
+            self.intervals = 0
+            self.totalTime = 0.0
+            self.totalEnergy = 0.0
+        finally:
+            self.lock.release()
+
+    def add_interval(self, activeStates, time, icount):
+        """Add an interval of time seconds with icount iCounts, during which
+        the states with a non-zero entry in activeStates were active."""
+
+        if time <= 0 or icount <= 0:
+            return
+        E = self.table.get_power(icount, time)
+        if E < 0:
+            raise CalibrationError, "Node with IP %s returned a \
+negative Energy value %f for icount %d, time %f!"%(self.ip, E, icount, time)
+        x = numpy.ones(len(self.states) + 1)
+        x[:-1] = activeStates
+        w = numpy.sqrt(E*time)
+
+        self.lock.acquire()
+        try:
+            self.XtWX += w * numpy.outer(x, x)
+            self.XtWY += (w * E) * x
+            self.activeCount += (x != 0)
+            self.intervals += 1
+            self.totalTime += time
+            self.totalEnergy += E*time
+        finally:
+            self.lock.release()
+
+    def feed_line(self, line):
+        """Add the interval, or the state names, encoded in a .pwr line."""
+        l = line.strip()
+        if l.startswith("#states:"):
+            self.set_states(l.split()[1:])
+            return
+        interval = parse_pwr_line(l, len(self.states))
+        if interval is not None:
+            self.add_interval(interval[0], interval[1], interval[2])
+
+    __call__ = feed_line
+
+    def solution(self):
+        """Return the current estimate as a dictionary in the format returned
+        by analyze_pwr_file."""
+
+        self.lock.acquire()
+        try:
+            XtWX = self.XtWX.copy()
+            XtWY = self.XtWY.copy()
+            activeCount = self.activeCount.copy()
+            intervals = self.intervals
+            totalTime = self.totalTime
+            totalEnergy = self.totalEnergy
+        finally:
+            self.lock.release()
+
+        result = {
+                'statePower': {},
+                'alwaysOffStates': [],
+                'alwaysOnStates': [],
+                'averagePower': None,
+                'error': None,
+        }
+        if intervals == 0:
+            result['error'] = "No intervals received from node with IP %s \
+yet."%(self.ip,)
+            return result
+
+        # states that were never or always active can not be told apart from
+        # no power or the const state. Leave them out of the solve.
+        k = len(self.states)
+        alwaysOff, alwaysOn, varying = classify_state_counts(
+                activeCount[:k], intervals)
+        result['alwaysOffStates'] = [self.states[i]
+                for i in numpy.flatnonzero(alwaysOff)]
+        result['alwaysOnStates'] = [self.states[i]
+                for i in numpy.flatnonzero(alwaysOn)]
+        keep = list(numpy.flatnonzero(varying)) + [k]
+        states = [self.states[i] for i in keep[:-1]] + ['const']
+
+        try:
+            x = numpy.linalg.solve(XtWX[numpy.ix_(keep, keep)], XtWY[keep])
+        except numpy.linalg.LinAlgError, e:
+            result['error'] = "State Matrix X for node with IP %s is singular. \
+We did not collect enough energy and state information yet.\n%s"%(
+                    self.ip, repr(e))
+            result['alwaysOffStates'] = []
+            result['alwaysOnStates'] = []
+            return result
+
+        for i in range(len(states)):
+            result['statePower'][states[i]] = float(x[i])
+        result['averagePower'] = totalEnergy / totalTime
+        return result
+
+
+def _analyze_pwr_file_kwargs(kwargs):
+    # Pool.map only passes a single argument to the worker function.
+    return analyze_pwr_file(**kwargs)
+
+
+def analyze_pwr_files(jobs, processes=None):
+    """Run analyze_pwr_file for every dictionary of keyword arguments in
+    jobs and return the results in the same order.
+
+    The jobs are spread over a pool of processes worker processes, which
+    defaults to the number of CPUs. With a single job, everything runs in
+    the calling process and the bootstrap, if any, uses the pool instead.
+    """
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    if processes <= 1 or len(jobs) <= 1:
+        results = []
+        for job in jobs:
+            job = dict(job)
+            job['processes'] = processes
+            results.append(analyze_pwr_file(**job))
+        return results
+
+    processes = min(processes, len(jobs))
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_analyze_pwr_file_kwargs, jobs, chunksize=1)
+    finally:
+        pool.terminate()
+        pool.join()
+    return results
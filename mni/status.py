@@ -0,0 +1,224 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Which nodes of a testbed are ready, without configuring them.
+
+sweep reads the node sections of a configuration file and checks every
+node at the same time: whether its Digi Connect box answers an RCI
+get_settings request, whether its serial device exists and can be opened
+for reading and writing, and whether motelist lists it. motelist runs once
+for all nodes, so a sweep takes about as long as the slowest single check.
+
+The report is cached as JSON with the time of the sweep. Commands pass the
+sections of the bad nodes in a recent report as skipNodes to MNI, which
+then does not try to configure them:
+
+    report = status.sweep("config.ini")
+    status.write_cache(report)
+    ...
+    m = mni.MNI("config.ini", skipNodes=status.bad_sections(
+            status.load_cache(maxAge=600, configFile="config.ini")))
+"""
+
+import os
+import json
+import time
+import threading
+import subprocess
+import ConfigParser
+import node
+import rci
+import tracing
+
+DEFAULT_CACHE = "status.json"
+# seconds after which commands stop trusting a cached report
+DEFAULT_MAX_AGE = 600
+# seconds the RCI check waits for a Digi Connect box
+RCI_TIMEOUT = 2.0
+
+
+def motelist():
+    """Run motelist once and return the devices of the listed motes by
+    their reference, or None if motelist failed."""
+    span = tracing.span("motelist", "status")
+    try:
+        try:
+            proc = subprocess.Popen("motelist", shell=True,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except OSError:
+            return None
+        (out, err) = proc.communicate()
+        span.args["exitCode"] = proc.returncode
+        if proc.returncode != 0:
+            return None
+    finally:
+        span.end()
+
+    motes = {}
+    for line in out.splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and fields[1].startswith("/"):
+            motes[fields[0]] = fields[1]
+    return motes
+
+
+def node_targets(config):
+    """What to check for every node section of config, as a list of
+    dictionaries with the keys section, id, host, serial and serialid,
+    each None where it does not apply."""
+    nodeType = config.get("Nodes", "type")
+    targets = []
+    for i in range(config.getint("Nodes", "numNodes")):
+        section = "Node%d"%(i + 1,)
+        target = {"section": section, "id": None, "host": None,
+                "serial": None, "serialid": None}
+        targets.append(target)
+        if not config.has_section(section):
+            continue
+        options = dict(config.items(section))
+        target["id"] = options.get("id")
+        if nodeType == "SimulatedQuantoMote":
+            # nothing to check without hardware
+            continue
+        if "name" in options and nodeType == "QuantoTestbedMote":
+            try:
+                (id, host, serial) = node.QuantoTestbedMote(
+                        ).get_node_info_by_name(options["name"])
+                target["host"] = host
+                target["serial"] = serial
+                if target["id"] is None:
+                    target["id"] = str(id)
+            except KeyError:
+                pass
+        for (key, option) in [("host", "ip"), ("serial", "serial"),
+                ("serialid", "serialid")]:
+            if option in options:
+                target[key] = options[option]
+    return targets
+
+
+def check_rci(host, timeout=RCI_TIMEOUT):
+    r = rci.RCI(host, track="status %s"%(host,))
+    # one probe, and do not let a failure count against the device
+    r.TIMEOUT = timeout
+    r.RETRIES = 0
+    r.health = rci.DeviceHealth()
+    r.get_settings()
+
+
+def check_serial(serial):
+    if not os.path.exists(serial):
+        raise IOError, "%s does not exist"%(serial,)
+    if not os.access(serial, os.R_OK | os.W_OK):
+        raise IOError, "%s can not be opened for reading and writing"%(
+                serial,)
+
+
+def _check(checks, name, function, *args):
+    start = time.time()
+    result = {"ok": True, "error": None}
+    try:
+        function(*args)
+    except Exception, e:
+        result = {"ok": False, "error": "%s: %s"%(e.__class__.__name__, e)}
+    result["seconds"] = time.time() - start
+    checks[name] = result
+
+
+def _check_node(target, motes, timeout):
+    checks = {}
+    serial = target["serial"]
+    if target["serialid"] is not None:
+        def listed():
+            if motes is None:
+                raise IOError, "motelist failed"
+            if target["serialid"] not in motes:
+                raise KeyError, "motelist does not list %s"%(
+                        target["serialid"],)
+        _check(checks, "motelist", listed)
+        if serial is None and motes is not None:
+            serial = motes.get(target["serialid"])
+    if serial is not None:
+        _check(checks, "serial", check_serial, serial)
+    if target["host"] is not None:
+        _check(checks, "rci", check_rci, target["host"], timeout)
+
+    ok = True
+    for name in checks:
+        ok = ok and checks[name]["ok"]
+    result = dict(target)
+    result["serial"] = serial
+    result["checks"] = checks
+    result["ok"] = ok
+    return result
+
+
+def sweep(configFile="config.ini", timeout=RCI_TIMEOUT):
+    """Check all nodes of configFile at the same time. Returns a report
+    dictionary with the time of the sweep, the configFile and, by section
+    name, the result of every node: its target (see node_targets), the
+    checks with their ok, error and seconds, and ok if all checks passed."""
+
+    config = ConfigParser.RawConfigParser()
+    try:
+        config.readfp(open(configFile))
+    except IOError:
+        raise IOError(configFile)
+
+    span = tracing.span("status sweep", "status")
+    start = time.time()
+    targets = node_targets(config)
+    motes = None
+    if len([t for t in targets if t["serialid"] is not None]) > 0:
+        motes = motelist()
+
+    results = {}
+    def run(target):
+        results[target["section"]] = _check_node(target, motes, timeout)
+    threads = [threading.Thread(target=run, args=(t,)) for t in targets]
+    for p in threads:
+        p.start()
+    for p in threads:
+        p.join()
+    span.end()
+
+    return {"time": start, "seconds": time.time() - start,
+            "config": os.path.abspath(configFile), "nodes": results}
+
+
+def write_cache(report, cacheFile=DEFAULT_CACHE):
+    # write to a temporary file first, so readers never see half a report
+    temporary = "%s.%d"%(cacheFile, os.getpid())
+    f = open(temporary, "w")
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.close()
+    os.rename(temporary, cacheFile)
+
+
+def load_cache(cacheFile=DEFAULT_CACHE, maxAge=None, configFile=None):
+    """The cached report, or None if there is none, it is more than maxAge
+    seconds old or, if configFile is given, it is the report of another
+    configuration file."""
+    try:
+        f = open(cacheFile)
+        try:
+            report = json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return None
+    if maxAge is not None and time.time() - report["time"] > maxAge:
+        return None
+    if configFile is not None and \
+            report.get("config") != os.path.abspath(configFile):
+        return None
+    return report
+
+
+def bad_sections(report):
+    """Sections of the nodes that failed a check in report, which may be
+    None."""
+    if report is None:
+        return []
+    sections = [s for s in report["nodes"] if not report["nodes"][s]["ok"]]
+    sections.sort()
+    return sections
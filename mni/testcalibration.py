@@ -0,0 +1,294 @@
+import unittest
+import tempfile
+import shutil
+import threading
+import os
+
+from calibration import *
+
+FREQUENCIES = {
+        100: {'res': '100', 'freq': 5000.0, 'E': 0.5},
+        1000: {'res': '1k', 'freq': 800.0, 'E': 0.4},
+        10000: {'res': '10k', 'freq': 90.0, 'E': 0.3},
+        100000: {'res': '100k', 'freq': 10.0, 'E': 0.2},
+}
+
+def scan_energy(frequencies, icount, time):
+    """Reference implementation: the linear scan QuantoTestbedMote used
+    before the calibration was compiled into a table."""
+    frequency = icount / float(time)
+    keys = frequencies.keys()
+    keys.sort()
+    lastRes = -1
+    for res in keys:
+        if frequency <= frequencies[res]['freq']:
+            lastRes = res
+            continue
+        else:
+            break
+    if res == keys[-1] or res == keys[0]:
+        return icount * frequencies[res]['E']
+    df = frequencies[lastRes]['freq'] - frequencies[res]['freq']
+    dE = frequencies[lastRes]['E'] - frequencies[res]['E']
+    return icount * ((frequency - frequencies[res]['freq']) / df * dE
+            + frequencies[res]['E'])
+
+class TestCalibrationTable(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(CalibrationTable().get_energy(10, 1.0), -1)
+
+    def test_matches_linear_scan(self):
+        t = CalibrationTable(FREQUENCIES)
+        for icount in [1, 9.5, 10, 47.75, 90, 460.75, 800, 4999, 5000,
+                47000.75]:
+            self.assertAlmostEqual(t.get_energy(icount, 1.0),
+                    scan_energy(FREQUENCIES, icount, 1.0))
+
+    def test_power(self):
+        t = CalibrationTable(FREQUENCIES)
+        self.assertEqual(t.get_power(100, 0), 0.0)
+        self.assertAlmostEqual(t.get_power(100, 2.0),
+                t.get_energy(100, 2.0) / 2.0)
+
+
+class TestCalibrationStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_missing_node(self):
+        store = CalibrationStore(self.directory)
+        self.assertEqual(store.latest("172.17.6.102"), None)
+        self.assertEqual(store.history("172.17.6.102"), [])
+
+    def test_history(self):
+        store = CalibrationStore(self.directory)
+        older = dict(FREQUENCIES)
+        del older[100]
+        store.add("172.17.6.102", older, date=1000.0)
+        store.add("172.17.6.102", FREQUENCIES, date=2000.0)
+
+        # a fresh store has to read everything back from disk
+        store = CalibrationStore(self.directory)
+        self.assertEqual(store.latest("172.17.6.102"), FREQUENCIES)
+        history = store.history("172.17.6.102")
+        self.assertEqual([t for (t, f) in history], [1000.0, 2000.0])
+        self.assertEqual(history[0][1], older)
+
+    def test_import_ini(self):
+        fileName = os.path.join(self.directory, "calibration.ini")
+        f = open(fileName, "w")
+        f.write("[Node172.17.6.102]\ncalibration = %s\n"%(str(FREQUENCIES),))
+        f.write("[Node172.17.6.103]\ncalibration = __import__('os')\n")
+        f.close()
+
+        store = CalibrationStore(self.directory)
+        self.assertRaises(ValueError, store.import_ini, fileName)
+        self.assertEqual(store.latest("172.17.6.102"), FREQUENCIES)
+
+    def test_import_ini_again(self):
+        fileName = os.path.join(self.directory, "calibration.ini")
+        f = open(fileName, "w")
+        f.write("[Node172.17.6.102]\ncalibration = %s\n"%(str(FREQUENCIES),))
+        f.write("calibrationDate = Mon Oct 19 10:00:00 2026\n")
+        f.write("[Node172.17.6.103]\ncalibration = %s\n"%(str(FREQUENCIES),))
+        f.close()
+
+        store = CalibrationStore(self.directory)
+        self.assertEqual(sorted(store.import_ini(fileName)),
+                ["172.17.6.102", "172.17.6.103"])
+        for i in range(2):
+            self.assertEqual(store.import_ini(fileName), [])
+        self.assertEqual(len(store.history("172.17.6.102")), 1)
+        self.assertEqual(len(store.history("172.17.6.103")), 1)
+
+    def test_import_ini_keys(self):
+        fileName = os.path.join(self.directory, "calibration.ini")
+        f = open(fileName, "w")
+        f.write("[Node172.17.6.102]\ncalibration = %s\n"%(str(FREQUENCIES),))
+        f.write("[Node172.17.6.103]\ncalibration = %s\n"%(str(FREQUENCIES),))
+        f.close()
+
+        store = CalibrationStore(self.directory)
+        self.assertEqual(store.import_ini(fileName, ["172.17.6.103"]),
+                ["172.17.6.103"])
+        self.assertEqual(store.latest("172.17.6.102"), None)
+
+
+CONFIG = """
+[Nodes]
+numNodes: 1
+type: SimulatedQuantoMote
+makeCmd: pwd -P > %s
+
+[Node1]
+id: 1
+"""
+
+TWO_NODES = """
+[Nodes]
+numNodes: 2
+type: SimulatedQuantoMote
+makeCmd: true
+
+[Node1]
+id: 1
+
+[Node2]
+id: 2
+"""
+
+class FakeNode:
+    ip = "172.17.6.102"
+    serial = "/dev/null"
+    def __init__(self):
+        self.calibrations = []
+    def calibrate(self, frequencies):
+        self.calibrations.append(frequencies)
+
+class TestCalibrationListener(unittest.TestCase):
+
+    def setUp(self):
+        import calibration
+        self.directory = tempfile.mkdtemp()
+        self.reported = threading.Event()
+        self.closed = []
+        reported = self.reported
+        closed = self.closed
+        class CalibrateQuanto:
+            def __init__(self, **args):
+                self.frequencies = None
+            def listen(self):
+                reported.wait()
+                if len(closed) > 0:
+                    raise IOError, "source closed"
+                self.frequencies = FREQUENCIES
+            def close(self):
+                closed.append(self)
+                reported.set()
+        class Module:
+            pass
+        Module.CalibrateQuanto = CalibrateQuanto
+        self.loaded = calibration._calibratequanto
+        calibration._calibratequanto = Module
+
+    def tearDown(self):
+        import calibration
+        calibration._calibratequanto = self.loaded
+        shutil.rmtree(self.directory)
+
+    def test_calibrate(self):
+        node = FakeNode()
+        store = CalibrationStore(self.directory)
+        listener = CalibrationListener(node, store)
+        listener.start()
+        self.reported.set()
+        listener.join()
+        self.assertEqual(listener.error, None)
+        self.assertEqual(node.calibrations, [FREQUENCIES])
+        self.assertEqual(store.latest(node.ip), FREQUENCIES)
+
+    def test_late_calibration(self):
+        node = FakeNode()
+        store = CalibrationStore(self.directory)
+        listener = CalibrationListener(node, store)
+        listener.start()
+        listener.join(0.05)
+        # the deadline passed, and then the node reports
+        listener.cancel()
+        self.reported.set()
+        listener.join()
+        self.assertTrue(isinstance(listener.error, CalibrationCancelled))
+        self.assertEqual(node.calibrations, [])
+        self.assertEqual(store.latest(node.ip), None)
+
+    def test_cancel_closes_port(self):
+        node = FakeNode()
+        listener = CalibrationListener(node)
+        listener.start()
+        listener.join(0.05)
+        listener.cancel()
+        # closing the source ends listen, the port is free again
+        listener.join(1.0)
+        self.assertFalse(listener.isAlive())
+        self.assertEqual(len(self.closed), 1)
+        self.assertTrue(isinstance(listener.error, CalibrationCancelled))
+        self.assertEqual(node.calibrations, [])
+
+    def test_calibrate_all_directory(self):
+        import quanto
+        tosroot = os.path.join(self.directory, "tinyos")
+        application = os.path.join(tosroot, "apps/quantoApps/CalibrateQuanto")
+        os.makedirs(application)
+        tosrootBefore = os.environ.get("TOSROOT")
+        os.environ["TOSROOT"] = tosroot
+        try:
+            config = os.path.join(self.directory, "config.ini")
+            f = open(config, "w")
+            f.write(CONFIG%(os.path.join(self.directory, "make.cwd"),))
+            f.close()
+            m = quanto.QuantoMNI(config)
+            installs = []
+            for n in m.get_nodes():
+                def install(cwd=None, n=n):
+                    installs.append(cwd)
+                    n.installSuccess = True
+                n.install = install
+            self.reported.set()
+            cwd = os.getcwd()
+            m.calibrate_all(calibrationDir=os.path.join(self.directory,
+                "store"))
+            self.assertEqual(os.getcwd(), cwd)
+        finally:
+            if tosrootBefore is None:
+                del os.environ["TOSROOT"]
+            else:
+                os.environ["TOSROOT"] = tosrootBefore
+
+        # make and the installs ran in the CalibrateQuanto application
+        self.assertEqual(open(os.path.join(self.directory,
+            "make.cwd")).read().strip(), os.path.realpath(application))
+        self.assertEqual(installs, [application])
+        self.assertEqual(m.get_nodes()[0].calibrationTable.energies,
+                CalibrationTable(FREQUENCIES).energies)
+
+    def test_read_from_file_migrates(self):
+        import quanto
+        if "TOSROOT" not in os.environ:
+            # QuantoMNI only checks that it is set
+            os.environ["TOSROOT"] = self.directory
+            self.addCleanup(os.environ.pop, "TOSROOT")
+        config = os.path.join(self.directory, "config.ini")
+        f = open(config, "w")
+        f.write(TWO_NODES)
+        f.close()
+        m = quanto.QuantoMNI(config)
+
+        storeDirectory = os.path.join(self.directory, "store")
+        store = CalibrationStore(storeDirectory)
+        older = dict(FREQUENCIES)
+        del older[100]
+        store.add("sim1", older, date=1000.0)
+        fileName = os.path.join(self.directory, "calibration.ini")
+        f = open(fileName, "w")
+        for ip in ["sim1", "sim2"]:
+            f.write("[Node%s]\ncalibration = %s\n"%(ip, str(FREQUENCIES)))
+        f.close()
+
+        for i in range(3):
+            m.calibrate_all(readFromFile=True, calibrationDir=storeDirectory,
+                    configFile=fileName)
+        store = CalibrationStore(storeDirectory)
+        # only the node without a stored calibration was migrated, once
+        self.assertEqual(store.history("sim1"), [(1000.0, older)])
+        self.assertEqual(len(store.history("sim2")), 1)
+        self.assertEqual(m.get_nodes()[1].calibrationTable.energies,
+                CalibrationTable(FREQUENCIES).energies)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import subprocess
+import tempfile
+import sys
+import os
+
+from cli import *
+
+# Control commands have to start quickly on the small machines driving the
+# testbed, so importing the command line interface must stay below this
+# many seconds and must not load any of the analysis dependencies.
+IMPORT_BUDGET = 0.5
+HEAVY_MODULES = ["numpy", "scipy", "mni.statepower"]
+
+CONFIG = """
+[Nodes]
+numNodes: 2
+type: Node
+makeCmd: make telosb
+
+[Node1]
+id: 1
+
+[Node2]
+id: 2
+"""
+
+class TestCli(unittest.TestCase):
+
+    def test_import_time(self):
+        code = """
+import sys
+import time
+start = time.time()
+from mni import cli
+from mni import quanto
+print time.time() - start
+print ",".join([m for m in %r if m in sys.modules])
+"""%(HEAVY_MODULES,)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        p = subprocess.Popen([sys.executable, "-c", code], cwd=root,
+                stdout=subprocess.PIPE)
+        (duration, loaded) = p.communicate()[0].split("\n")[:2]
+        self.assertEqual(loaded, "")
+        self.assertTrue(float(duration) < IMPORT_BUDGET)
+
+    def test_commands(self):
+        fileName = tempfile.mktemp()
+        f = open(fileName, "w")
+        f.write(CONFIG)
+        f.close()
+        try:
+            self.assertEqual(main(["list", "--local", "--plain",
+                "-c", fileName]), 0)
+            # plain nodes can not be stopped
+            self.assertEqual(main(["stop", "--local", "--plain",
+                "-c", fileName, "-n", "2"]), 1)
+            self.assertEqual(main(["fly"]), 1)
+        finally:
+            os.remove(fileName)
+
+
+if __name__ == "__main__":
+    unittest.main()
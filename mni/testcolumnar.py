@@ -0,0 +1,102 @@
+import unittest
+import tempfile
+import random
+import json
+import time
+import os
+import numpy
+
+import simulate
+import statepower
+import calibration
+import columnar
+
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.trace = simulate.QuantoTrace(seed=5)
+        self.pwr = os.path.join(self.dir, "quanto.sim1.log.pwr")
+        self.trace.write_pwr_file(self.pwr, intervals=5000)
+
+    def tearDown(self):
+        for (root, dirs, files) in os.walk(self.dir, topdown=False):
+            for name in files:
+                os.remove(os.path.join(root, name))
+            os.rmdir(root)
+
+    def test_convert(self):
+        directory = columnar.convert_pwr_file(self.pwr, timeoffset=7)
+        self.assertEqual(directory, self.pwr + ".cols")
+        c = columnar.open_columns(directory)
+        self.assertEqual(len(c), 5000)
+        self.assertEqual(c.states, self.trace.states)
+        self.assertEqual(c.timeoffset, 7)
+        self.assertTrue(isinstance(c.time, numpy.memmap))
+
+        parsed = statepower.load_pwr_file(self.pwr, self.trace.table, "t")
+        # load_pwr_file memory-maps columns directories
+        mapped = statepower.load_pwr_file(directory, self.trace.table, "t")
+        self.assertEqual(mapped.states, parsed.states)
+        self.assertTrue(numpy.all(mapped.X == parsed.X))
+        self.assertTrue(numpy.all(mapped.count == parsed.count))
+        for name in ["weight", "weightedPower", "weightedPowerSquared",
+                "time", "energy"]:
+            self.assertTrue(numpy.allclose(getattr(mapped, name),
+                getattr(parsed, name)))
+
+        sparse = statepower.load_pwr_file(directory, self.trace.table, "t",
+                sparse=True)
+        self.assertTrue(numpy.all(sparse.X.toarray() == parsed.X))
+
+    def test_states_change(self):
+        f = open(self.pwr, "a")
+        f.write("#states: a b\n1 - 100 5 1\n- 1 200 8 1\n1 - 0 0 1\n")
+        f.close()
+        c = columnar.open_columns(columnar.convert_pwr_file(self.pwr))
+        self.assertEqual(c.states, ["a", "b"])
+        self.assertEqual(c.signatures.tolist(), [[1, 0], [0, 1]])
+        self.assertEqual(c.signature.tolist(), [0, 1, 0])
+        # the invalid interval is only left out by the analysis
+        intervals = columnar.load_intervals(c.directory, self.trace.table,
+                "t")
+        self.assertEqual(list(intervals.count), [1, 1])
+
+    def test_is_current(self):
+        directory = self.pwr + ".cols"
+        self.assertFalse(columnar.is_current(directory, self.pwr))
+        columnar.convert_pwr_file(self.pwr)
+        self.assertTrue(columnar.is_current(directory, self.pwr))
+        later = time.time() + 10
+        os.utime(self.pwr, (later, later))
+        self.assertFalse(columnar.is_current(directory, self.pwr))
+
+    def test_version(self):
+        directory = columnar.convert_pwr_file(self.pwr)
+        metaFile = os.path.join(directory, columnar.META)
+        meta = json.load(open(metaFile))
+        meta["version"] = columnar.VERSION + 1
+        json.dump(meta, open(metaFile, "w"))
+        self.assertRaises(columnar.ColumnarError, columnar.open_columns,
+                directory)
+
+class TestPowerArray(unittest.TestCase):
+
+    def test_matches_get_power(self):
+        rnd = random.Random(2)
+        tables = [
+            simulate.QuantoTrace(seed=1).table,
+            calibration.CalibrationTable({1: {'res': '1', 'freq': 1e4,
+                'E': 0.001}}),
+        ]
+        for table in tables:
+            icount = [rnd.randint(1, 10 ** rnd.randint(1, 7))
+                    for i in range(1000)]
+            times = [rnd.uniform(1e-4, 1.0) for i in range(1000)]
+            power = table.get_power_array(icount, times)
+            for i in range(1000):
+                self.assertAlmostEqual(power[i] / table.get_power(icount[i],
+                    times[i]), 1.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import tempfile
+import threading
+import time
+import os
+
+from daemon import *
+
+CONFIG = """
+[Nodes]
+numNodes: 2
+type: Node
+makeCmd: make telosb
+listenCmd: echo $id
+
+[Node1]
+id: 1
+
+[Node2]
+id: 2
+"""
+
+class TestDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.fileName = tempfile.mktemp()
+        f = open(self.fileName, "w")
+        f.write(CONFIG)
+        f.close()
+        self.socketPath = tempfile.mktemp()
+        self.daemon = MNIDaemon(self.fileName, self.socketPath, quanto=False)
+        self.thread = threading.Thread(target=self.daemon.serve_forever)
+        self.thread.start()
+        while not is_running(self.socketPath):
+            time.sleep(0.01)
+
+    def tearDown(self):
+        send_command("shutdown", socketPath=self.socketPath)
+        self.thread.join()
+        os.remove(self.fileName)
+
+    def test_commands(self):
+        reply = send_command("list", socketPath=self.socketPath)
+        self.assertTrue(reply["ok"])
+        self.assertEqual([n["id"] for n in reply["result"]], [1, 2])
+
+        reply = send_command("capture_status", [2],
+                socketPath=self.socketPath)
+        self.assertEqual(reply["result"], {"2": 0})
+
+        # plain nodes can not be stopped
+        reply = send_command("stop", [1], socketPath=self.socketPath)
+        self.assertFalse(reply["ok"])
+        self.assertEqual(reply["errors"].keys(), ["1"])
+        self.assertEqual(print_errors({"ok": True, "errors": {}}), 0)
+
+    def test_capture_selected_nodes(self):
+        for n in self.daemon.mni.get_nodes():
+            # plain nodes have no serial device
+            n.serial = None
+        directory = tempfile.mkdtemp()
+        try:
+            reply = send_command("capture_start", [2],
+                    socketPath=self.socketPath,
+                    baseFileName=os.path.join(directory, "test"))
+            self.assertTrue(reply["ok"])
+            self.assertEqual(len(self.daemon.mni.serialProcesses), 1)
+            send_command("capture_stop", socketPath=self.socketPath)
+            self.assertEqual(sorted(os.listdir(directory)),
+                    ["test.2.log", "test.2.stderr.log"])
+        finally:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    def test_capture_two_subsets(self):
+        for n in self.daemon.mni.get_nodes():
+            n.serial = None
+        self.daemon.mni.listenCmd = "sleep 10"
+        directory = tempfile.mkdtemp()
+        try:
+            base = os.path.join(directory, "test")
+            send_command("capture_start", [1], socketPath=self.socketPath,
+                    baseFileName=base)
+            first = self.daemon.mni.serialProcesses[1]
+            send_command("capture_start", [2], socketPath=self.socketPath,
+                    baseFileName=base)
+            # the capture of node 1 goes on
+            self.assertFalse(first.is_dead())
+            self.assertEqual(sorted(self.daemon.mni.serialProcesses.keys()),
+                    [1, 2])
+            send_command("capture_stop", [2], socketPath=self.socketPath)
+            self.assertEqual(self.daemon.mni.serialProcesses.keys(), [1])
+            self.assertFalse(first.is_dead())
+            send_command("capture_stop", socketPath=self.socketPath)
+            self.assertEqual(self.daemon.mni.serialProcesses, {})
+            self.assertTrue(first.is_dead())
+        finally:
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+    def test_press_usr(self):
+        pressed = []
+        for n in self.daemon.mni.get_nodes():
+            n.push_usr = lambda n=n: pressed.append((n.id, "push",
+                time.time()))
+            n.release_usr = lambda n=n: pressed.append((n.id, "release",
+                time.time()))
+        reply = send_command("press_usr", [1], socketPath=self.socketPath,
+                duration=0.2)
+        self.assertTrue(reply["ok"])
+        self.assertEqual([(id, op) for (id, op, t) in pressed],
+                [(1, "push"), (1, "release")])
+        # the button was held
+        self.assertTrue(pressed[1][2] - pressed[0][2] >= 0.15)
+
+    def test_errors(self):
+        self.assertRaises(DaemonError, send_command, "fly",
+                socketPath=self.socketPath)
+        self.assertRaises(DaemonError, send_command, "reset", [3],
+                socketPath=self.socketPath)
+        self.assertEqual(try_command("list", socketPath=tempfile.mktemp()),
+                None)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,264 @@
+import unittest
+import tempfile
+import StringIO
+import sys
+import os
+import numpy
+
+import simulate
+import statepower
+import metrics
+import decoding
+import quanto
+
+CONFIG = """
+[Nodes]
+numNodes: 2
+type: SimulatedQuantoMote
+makeCmd: true
+listenCmd: cat %s.$id
+
+[Node1]
+id: 1
+
+[Node2]
+id: 2
+numStates: 4
+"""
+
+class TestDecodingSink(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.trace = simulate.QuantoTrace(seed=3)
+        self.input = os.path.join(self.dir, "input.pwr")
+        self.trace.write_pwr_file(self.input, intervals=3000)
+
+    def tearDown(self):
+        for (root, dirs, files) in os.walk(self.dir, topdown=False):
+            for name in files:
+                os.remove(os.path.join(root, name))
+            os.rmdir(root)
+
+    def test_sink(self):
+        output = os.path.join(self.dir, "output.pwr")
+        estimator = statepower.OnlineStateEstimator(self.trace.table)
+        sink = decoding.DecodingSink(estimator=estimator, pwrFileName=output,
+                track="decode test")
+        sink("Listen started\n")
+        for line in open(self.input):
+            sink(line)
+        sink.close()
+        self.assertEqual(sink.skipped, 1)
+        self.assertEqual(sink.decoded, 3001)
+        self.assertEqual(metrics.DECODE_QUEUE_DEPTH.labels(
+            "decode test").value, 0)
+
+        # the .pwr file parse_quanto_log would have written
+        self.assertEqual(open(output).read(), open(self.input).read())
+
+        parsed = statepower.load_pwr_file(self.input, self.trace.table, "t")
+        decoded = sink.columns.intervals(self.trace.table, "t")
+        self.assertEqual(len(sink.columns), 3000)
+        self.assertEqual(decoded.states, parsed.states)
+        self.assertTrue(numpy.all(decoded.X == parsed.X))
+        self.assertTrue(numpy.all(decoded.count == parsed.count))
+        self.assertTrue(numpy.allclose(decoded.weightedPower,
+            parsed.weightedPower))
+
+        batch = statepower.analyze_intervals(decoded, "t")
+        online = estimator.solution()
+        for s in batch['statePower']:
+            self.assertAlmostEqual(online['statePower'][s],
+                    batch['statePower'][s])
+
+    def test_listen(self):
+        listen = os.path.join(self.dir, "input.listen")
+        self.assertEqual(self.trace.write_listen_file(listen, 3000), 3000)
+        output = os.path.join(self.dir, "output.pwr")
+        estimator = statepower.OnlineStateEstimator(self.trace.table)
+        sink = decoding.DecodingSink(estimator=estimator, pwrFileName=output,
+                listenDecoder=decoding.ListenDecoder(self.trace.resources()))
+        for line in open(listen):
+            sink(line)
+        sink.close()
+        self.assertEqual(sink.skipped, 0)
+
+        # the intervals of the trace, as read_log.py would have written them
+        self.assertEqual(len(sink.columns), 3000)
+        self.assertEqual(open(output).read(), open(self.input).read())
+        parsed = statepower.load_pwr_file(self.input, self.trace.table, "t")
+        decoded = sink.columns.intervals(self.trace.table, "t")
+        self.assertEqual(decoded.states, parsed.states)
+        self.assertTrue(numpy.all(decoded.X == parsed.X))
+        self.assertTrue(numpy.all(decoded.count == parsed.count))
+
+        batch = statepower.analyze_intervals(decoded, "t")
+        online = estimator.solution()
+        for s in batch['statePower']:
+            self.assertAlmostEqual(online['statePower'][s],
+                    batch['statePower'][s])
+
+    def test_listen_wraparound(self):
+        decoder = decoding.ListenDecoder([(3, "cpu")])
+        entry = decoding.ListenDecoder.ENTRY
+        payload = entry.pack(5, 3, 2**32 - 100, 2**32 - 10, 1) + \
+                entry.pack(0, 255, 900, 30, 0)
+        packet = "\x00\xff\xff\x00\x01%s\x22\x93%s"%(chr(len(payload)),
+                payload)
+        line = " ".join(["%02X"%(ord(b),) for b in packet])
+        self.assertEqual(decoder.decode(line), [([1], 1000 / 1e6, 40)])
+        # not a packet
+        self.assertEqual(decoder.decode("resynchronising\n"), None)
+        self.assertEqual(decoder.decode("00 FF FF 00 01 18 22\n"), None)
+
+    def test_undecodable(self):
+        # output of a listen command that is not a Quanto node
+        output = os.path.join(self.dir, "output.pwr")
+        sink = decoding.DecodingSink(pwrFileName=output,
+                columnsDirectory=output + ".cols")
+        for i in range(10):
+            sink("serial@/dev/ttyUSB0:115200: resynchronising\n")
+        sink.close()
+        self.assertEqual(sink.decoded, 0)
+        self.assertEqual(sink.skipped, 10)
+        self.assertEqual(len(sink.columns), 0)
+        self.assertFalse(os.path.exists(output))
+        self.assertFalse(os.path.exists(output + ".cols"))
+
+    def test_new_states(self):
+        columns = decoding.IntervalColumns(["a", "b"])
+        columns.append([1, 0], 0.1, 10)
+        columns.set_states(["a", "c"])
+        self.assertEqual(len(columns), 1)
+        columns.set_states(["a", "b", "c"])
+        self.assertEqual(len(columns), 0)
+        # intervals of the wrong length are dropped
+        columns.append([1, 0], 0.1, 10)
+        self.assertEqual(len(columns), 0)
+
+    def test_capture(self):
+        if "TOSROOT" not in os.environ:
+            # QuantoMNI only checks that it is set
+            os.environ["TOSROOT"] = self.dir
+            self.addCleanup(os.environ.pop, "TOSROOT")
+        config = os.path.join(self.dir, "config.ini")
+        f = open(config, "w")
+        f.write(CONFIG%(os.path.join(self.dir, "input"),))
+        f.close()
+        m = quanto.QuantoMNI(config)
+        for n in m.get_nodes():
+            n.trace.write_pwr_file(os.path.join(self.dir, "input.%d"%(n.id,)),
+                    intervals=2000)
+            n.calibrate(n.trace.frequencies)
+
+        base = os.path.join(self.dir, "quanto")
+        m.connect_serial_to_file_all(base, decode=True)
+        for n in m.get_nodes():
+            self.assertEqual(len(n.decodedIntervals), 2000)
+            fileName = "%s.pwr"%(m.log_file_name(n, base),)
+            self.assertEqual(open(fileName).read(),
+                    open(os.path.join(self.dir, "input.%d"%(n.id,))).read())
+
+            # the analysis memory-maps the columns the sink wrote
+            self.assertEqual(m.pwr_file_name(n, base), fileName + ".cols")
+
+            m.get_energy_per_quanto_state(n, base, decoded=True)
+            decoded = n.statePower
+            m.get_energy_per_quanto_state(n, base)
+            for s in n.statePower:
+                self.assertAlmostEqual(decoded[s], n.statePower[s])
+
+    def test_capture_listen(self):
+        if "TOSROOT" not in os.environ:
+            os.environ["TOSROOT"] = self.dir
+            self.addCleanup(os.environ.pop, "TOSROOT")
+        config = os.path.join(self.dir, "config.ini")
+        f = open(config, "w")
+        f.write(CONFIG%(os.path.join(self.dir, "input"),))
+        f.close()
+        m = quanto.QuantoMNI(config)
+        for n in m.get_nodes():
+            n.trace.write_listen_file(os.path.join(self.dir,
+                "input.%d"%(n.id,)), 2000)
+            n.calibrate(n.trace.frequencies)
+        m.start_state_estimation_all()
+
+        base = os.path.join(self.dir, "quanto")
+        m.connect_serial_to_file_all(base, decode=True)
+        m.update_state_power_all()
+        online = dict([(n.id, n.statePower) for n in m.get_nodes()])
+        for n in m.get_nodes():
+            self.assertTrue(m.is_decoded(n))
+            self.assertEqual(len(n.decodedIntervals), 2000)
+            pwrFileName = os.path.join(self.dir, "trace.%d.pwr"%(n.id,))
+            n.trace.write_pwr_file(pwrFileName, intervals=2000)
+            self.assertEqual(open("%s.pwr"%(m.log_file_name(n, base),)).read(),
+                    open(pwrFileName).read())
+            m.get_energy_per_quanto_state(n, base, decoded=True)
+            decoded = n.statePower
+            m.get_energy_per_quanto_state(n, base)
+            self.assertEqual(sorted(decoded.keys()),
+                    sorted(n.statePower.keys()))
+            for s in n.statePower:
+                self.assertAlmostEqual(decoded[s], n.statePower[s])
+                # the estimator was fed during the capture
+                self.assertAlmostEqual(online[n.id][s], n.statePower[s])
+
+    def test_estimator_error(self):
+        class FailingEstimator:
+            def set_states(self, states):
+                pass
+            def add_interval(self, activeStates, time, icount):
+                raise statepower.CalibrationError, "negative energy"
+        listen = os.path.join(self.dir, "input.listen")
+        self.trace.write_listen_file(listen, 100)
+        output = os.path.join(self.dir, "output.pwr")
+        sink = decoding.DecodingSink(estimator=FailingEstimator(),
+                pwrFileName=output,
+                listenDecoder=decoding.ListenDecoder(self.trace.resources()))
+        stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            for line in open(listen):
+                sink(line)
+            logged = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+        sink.close()
+        # the capture went on without the estimator
+        self.assertEqual(len(sink.columns), 100)
+        self.assertEqual(sink.estimatorErrors, 100)
+        self.assertEqual(logged.count("negative energy"), 1)
+        self.trace.write_pwr_file(self.input, intervals=100)
+        self.assertEqual(open(output).read(), open(self.input).read())
+
+    def test_capture_undecodable(self):
+        if "TOSROOT" not in os.environ:
+            os.environ["TOSROOT"] = self.dir
+            self.addCleanup(os.environ.pop, "TOSROOT")
+        config = os.path.join(self.dir, "config.ini")
+        f = open(config, "w")
+        f.write(CONFIG%(os.path.join(self.dir, "input"),))
+        f.close()
+        m = quanto.QuantoMNI(config)
+        for n in m.get_nodes():
+            f = open(os.path.join(self.dir, "input.%d"%(n.id,)), "w")
+            f.write("serial@/dev/ttyUSB0:115200: resynchronising\n" * 5)
+            f.close()
+            n.calibrate(n.trace.frequencies)
+        m.start_state_estimation_all()
+
+        base = os.path.join(self.dir, "quanto")
+        m.connect_serial_to_file_all(base, decode=True)
+        for n in m.get_nodes():
+            self.assertFalse(m.is_decoded(n))
+            self.assertEqual(n.stateEstimator.intervals, 0)
+            fileName = "%s.pwr"%(m.log_file_name(n, base),)
+            self.assertFalse(os.path.exists(fileName))
+            self.assertFalse(os.path.exists(fileName + ".cols"))
+            self.assertRaises(quanto.ParseError,
+                    m.get_energy_per_quanto_state, n, base, decoded=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import managedsubproc
+import metrics
 import tempfile
+import threading
 import unittest
 import time
 import os
@@ -115,5 +117,24 @@ class TestManagedSubproc(unittest.TestCase):
         m.stop()
         self.assertEqual(count_on_test, 2)
 
+    def test_exit_code_concurrent_polls(self):
+        # threads that poll the same child must not turn its exit code
+        # into 0
+        exits = metrics.SUBPROCESS_EXITS.labels("poll test", "false", 1)
+        exited = exits.value
+        m = managedsubproc.ManagedSubproc("false", trace_track="poll test")
+        m.start()
+        def poll():
+            while not m.is_dead():
+                pass
+        threads = [threading.Thread(target=poll) for i in range(4)]
+        for p in threads:
+            p.start()
+        for p in threads:
+            p.join()
+        m.stop()
+        self.assertEqual(m.returncode(), 1)
+        self.assertEqual(exits.value, exited + 1)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+import tempfile
+import socket
+import httplib
+import urllib2
+import time
+import os
+
+import metrics
+import managedsubproc
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter(self):
+        c = self.registry.counter("test_total", "A counter.", ["node"])
+        c.labels("node 2").inc()
+        c.labels("node 1").inc(3)
+        c.labels("node 2").inc()
+        self.assertEqual(c.exposition(), "# HELP test_total A counter.\n\
+# TYPE test_total counter\n\
+test_total{node=\"node 1\"} 3\n\
+test_total{node=\"node 2\"} 2\n")
+        self.assertRaises(ValueError, c.labels, "node 1", "extra")
+
+    def test_gauge(self):
+        g = self.registry.gauge("test_gauge", "A gauge.")
+        g.labels().set(2.5)
+        g.labels().dec()
+        self.assertEqual(g.exposition().splitlines()[-1], "test_gauge 1.5")
+
+        f = self.registry.gauge("test_depth", "Computed.", ["node"])
+        f.set_function(lambda: {("a\"b",): 4})
+        self.assertEqual(f.exposition().splitlines()[-1],
+                'test_depth{node="a\\"b"} 4')
+
+    def test_histogram(self):
+        h = self.registry.histogram("test_seconds", "A histogram.",
+                ["node"], [0.1, 1.0])
+        for v in [0.05, 0.1, 0.5, 2.0]:
+            h.labels("node 1").observe(v)
+        self.assertEqual(h.exposition().splitlines()[2:], [
+            'test_seconds_bucket{node="node 1",le="0.1"} 2',
+            'test_seconds_bucket{node="node 1",le="1"} 3',
+            'test_seconds_bucket{node="node 1",le="+Inf"} 4',
+            'test_seconds_sum{node="node 1"} 2.65',
+            'test_seconds_count{node="node 1"} 4'])
+
+    def test_subprocess(self):
+        starts = metrics.SUBPROCESS_STARTS.labels("node 9", "false")
+        exits = metrics.SUBPROCESS_EXITS.labels("node 9", "false", 1)
+        (started, exited) = (starts.value, exits.value)
+        m = managedsubproc.ManagedSubproc("false",
+                trace_track="node 9")
+        m.start()
+        while not m.is_dead():
+            time.sleep(0.01)
+        m.stop()
+        self.assertEqual(starts.value, started + 1)
+        self.assertEqual(exits.value, exited + 1)
+
+    def test_serve_tcp(self):
+        self.registry.counter("test_total", "A counter.").labels().inc()
+        server = metrics.serve(0, registry=self.registry)
+        try:
+            f = urllib2.urlopen("http://127.0.0.1:%d/metrics"%(
+                server.server_address[1],))
+            self.assertEqual(f.info()["Content-Type"],
+                    "text/plain; version=0.0.4")
+            self.assertEqual(f.read(), self.registry.exposition())
+        finally:
+            server.shutdown()
+
+    def test_serve_unix(self):
+        self.registry.counter("test_total", "A counter.").labels().inc()
+        socketPath = tempfile.mktemp()
+        server = metrics.serve(socketPath=socketPath, registry=self.registry)
+        try:
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.connect(socketPath)
+            c = httplib.HTTPConnection("localhost")
+            c.sock = s
+            c.request("GET", "/metrics")
+            r = c.getresponse()
+            self.assertEqual(r.status, 200)
+            self.assertTrue("test_total 1\n" in r.read())
+            c.close()
+        finally:
+            server.shutdown()
+            os.remove(socketPath)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+import unittest
+import tempfile
+import time
+import os
+import threading
+
+from mni import *
+from partition import *
+
+CONFIG = """
+[Nodes]
+numNodes: 4
+type: Node
+makeCmd: make telosb
+
+[Node1]
+id: 1
+
+[Node2]
+id: 2
+
+[Node3]
+id: 3
+
+[Node4]
+id: 4
+
+[Partition left]
+nodes: 1, 2
+makeCmd: make telosb left
+
+[Partition right]
+nodes: 3,4
+
+[Partition all]
+nodes: 1,2,3,4
+"""
+
+class TestPartition(unittest.TestCase):
+
+    def setUp(self):
+        self.fileName = tempfile.mktemp()
+        f = open(self.fileName, "w")
+        f.write(CONFIG)
+        f.close()
+        self.mni = MNI(configFile=self.fileName)
+
+    def tearDown(self):
+        os.remove(self.fileName)
+
+    def test_partitions(self):
+        self.assertEqual(sorted(self.mni.partitions.keys()),
+                ["all", "left", "right"])
+        lease = self.mni.lease_partition("left")
+        self.assertEqual([n.id for n in lease.mni.get_nodes()], [1, 2])
+        self.assertEqual(lease.mni.makeCmd, "make telosb left")
+        self.assertEqual(self.mni.makeCmd, "make telosb")
+        self.assertEqual(len(self.mni.get_nodes()), 4)
+        lease.release()
+
+    def test_exclusive(self):
+        lease = self.mni.lease_partition("left")
+        # disjoint partitions can be leased at the same time
+        self.mni.lease_partition("right", timeout=0).release()
+        self.assertRaises(LeaseError, self.mni.lease_partition, "all",
+                timeout=0.1)
+        lease.release()
+        self.mni.lease_partition("all", timeout=0).release()
+
+    def test_scheduler(self):
+        def experiment(mni):
+            time.sleep(0.2)
+            return [n.id for n in mni.get_nodes()]
+
+        s = ExperimentScheduler(self.mni)
+        s.add("left", experiment)
+        s.add("right", experiment)
+        start = time.time()
+        results = s.run()
+        # both partitions ran at the same time
+        self.assertTrue(time.time() - start < 0.35)
+        self.assertEqual(results, [([1, 2], None), ([3, 4], None)])
+
+        s.add("left", experiment)
+        s.add("all", experiment)
+        start = time.time()
+        results = s.run()
+        self.assertTrue(time.time() - start >= 0.4)
+        self.assertEqual(results[1], ([1, 2, 3, 4], None))
+
+    def test_lease_state(self):
+        lease = self.mni.lease_partition("left")
+        lease.mni.serialSinks[1] = object()
+        lease.mni.serialProcesses[1] = object()
+        self.assertEqual(self.mni.serialSinks, {})
+        self.assertEqual(self.mni.serialProcesses, {})
+        lease.release()
+
+    def test_builds(self):
+        # two partitions compile different applications in the same
+        # directory; every node gets the build of its own partition
+        directory = tempfile.mkdtemp()
+        cwd = os.getcwd()
+        os.chdir(directory)
+        try:
+            installed = {}
+            for n in self.mni.get_nodes():
+                def install(n=n):
+                    time.sleep(0.1)
+                    installed[n.id] = open("build").read().strip()
+                n.install = install
+
+            def experiment(mni):
+                mni.compile()
+                mni.install_all()
+
+            s = ExperimentScheduler(self.mni)
+            s.add("left", experiment)
+            s.add("right", experiment)
+            self.mni.partitions["left"].makeCmd = \
+                    "sleep 0.1; echo left > build"
+            # right uses the testbed wide make command
+            self.mni.makeCmd = "echo right > build"
+            results = s.run()
+            self.assertEqual(results, [(None, None), (None, None)])
+            self.assertEqual(installed,
+                    {1: "left", 2: "left", 3: "right", 4: "right"})
+        finally:
+            os.chdir(cwd)
+            for name in os.listdir(directory):
+                os.remove(os.path.join(directory, name))
+            os.rmdir(directory)
+
+
+class TestBuildDirectory(unittest.TestCase):
+
+    def test_install_rebuilds(self):
+        d = BuildDirectory()
+        output = []
+        d.compile("a", lambda: output.append("a"))
+        d.compile("b", lambda: output.append("b"))
+        d.begin_install("a", lambda: output.append("a"))
+        d.end_install()
+        self.assertEqual(output, ["a", "b", "a"])
+        # the build output is still that of a
+        d.begin_install("a", lambda: output.append("a"))
+        d.end_install()
+        self.assertEqual(output, ["a", "b", "a"])
+
+    def test_compile_waits_for_install(self):
+        d = BuildDirectory()
+        d.compile("a", lambda: None)
+        d.begin_install("a", lambda: None)
+        compiled = []
+        t = threading.Thread(target=d.compile,
+                args=("b", lambda: compiled.append("b")))
+        t.start()
+        time.sleep(0.1)
+        self.assertEqual(compiled, [])
+        d.end_install()
+        t.join()
+        self.assertEqual(compiled, ["b"])
+
+    def test_failed_compile(self):
+        d = BuildDirectory()
+        def fail():
+            raise CompileError, "failed"
+        self.assertRaises(CompileError, d.compile, "a", fail)
+        self.assertEqual(d.makeCmd, None)
+        self.assertFalse(d.compiling)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+import threading
+import time
+
+from pipeline import *
+
+class FakeNode:
+    def __init__(self, id):
+        self.id = id
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.nodes = [FakeNode(i) for i in range(6)]
+        self.lock = threading.Lock()
+        self.active = 0
+        self.maxActive = 0
+
+    def limited(self, node):
+        self.lock.acquire()
+        self.active += 1
+        self.maxActive = max(self.maxActive, self.active)
+        self.lock.release()
+        time.sleep(0.05)
+        self.lock.acquire()
+        self.active -= 1
+        self.lock.release()
+
+    def test_limit(self):
+        p = Pipeline([Stage("first", lambda n: None),
+            Stage("limited", self.limited, 2)])
+        self.assertEqual(p.run(self.nodes), {})
+        self.assertEqual(self.maxActive, 2)
+        self.assertEqual(len(p.timings), 12)
+
+    def test_nodes_move_on_their_own(self):
+        finished = {}
+        def slow_for_node_0(n):
+            if n.id == 0:
+                time.sleep(0.3)
+        def second(n):
+            finished[n.id] = time.time()
+        start = time.time()
+        p = Pipeline([Stage("first", slow_for_node_0), Stage("second", second)])
+        p.run(self.nodes)
+        # the fast nodes did not wait for node 0
+        self.assertTrue(finished[1] - start < 0.2)
+        self.assertTrue(finished[0] - start >= 0.3)
+
+    def test_error(self):
+        def fail_on_node_3(n):
+            if n.id == 3:
+                raise ValueError("broken")
+        reached = []
+        p = Pipeline([Stage("check", fail_on_node_3),
+            Stage("after", lambda n: reached.append(n.id))])
+        errors = p.run(self.nodes)
+        self.assertEqual(errors.keys(), [self.nodes[3]])
+        self.assertEqual(errors[self.nodes[3]][0], "check")
+        self.assertEqual(sorted(reached), [0, 1, 2, 4, 5])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,195 @@
+import unittest
+import threading
+import socket
+import urllib2
+import time
+import SocketServer
+import BaseHTTPServer
+
+import rci
+
+GPIO_REPLY = """<rci_reply version="1.1">
+ <query_setting><gpio_mode>
+  <pin1>serial</pin1><pin3>out</pin3><pin4>out</pin4>
+ </gpio_mode></query_setting>
+ <query_state><gpio>
+  <pin3>asserted</pin3><pin4>unasserted</pin4>
+ </gpio></query_state>
+</rci_reply>
+"""
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests.append(body)
+        if len(self.server.statuses) > 0:
+            status = self.server.statuses.pop(0)
+            if status != 200:
+                self.send_error(status)
+                return
+        reply = '<rci_reply version="1.1"></rci_reply>\n'
+        if "<query_state>" in body:
+            reply = GPIO_REPLY
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+    def log_message(self, format, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        self.requests = []
+        # status of the next replies
+        self.statuses = []
+
+class TestRCI(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server()
+        p = threading.Thread(target=self.server.serve_forever)
+        p.setDaemon(True)
+        p.start()
+        self.host = "127.0.0.1:%d"%(self.server.server_address[1],)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_mode_cache(self):
+        r = rci.RCI(self.host)
+        r.set_gpio_low(rci.RTS)
+        r.set_gpio_high(rci.RTS)
+        requests = self.server.requests
+        self.assertEqual(len(requests), 2)
+        self.assertTrue("<gpio_mode>" in requests[0])
+        self.assertTrue("<pin4>unasserted</pin4>" in requests[0])
+        self.assertFalse("<gpio_mode>" in requests[1])
+        self.assertTrue("<pin4>asserted</pin4>" in requests[1])
+        self.assertEqual(r.pinStates[rci.RTS], rci.ASSERTED)
+
+        # nothing changes, so nothing is sent
+        self.assertEqual(r.set_gpio_mode(rci.RTS, rci.OUT), [])
+        self.assertEqual(len(requests), 2)
+
+        r.set_gpio_mode(rci.RTS, rci.SERIAL)
+        r.set_gpio_high(rci.RTS)
+        self.assertTrue("<pin4>serial</pin4>" in requests[2])
+        self.assertTrue("<pin4>out</pin4>" in requests[3])
+
+        r.forget()
+        r.set_gpio_high(rci.RTS)
+        self.assertTrue("<gpio_mode>" in requests[4])
+
+    def test_read_back(self):
+        r = rci.RCI(self.host, readBack=True)
+        r.set_gpio_high(rci.RTS)
+        requests = self.server.requests
+        self.assertEqual(len(requests), 2)
+        self.assertTrue("<query_setting>" in requests[0])
+        self.assertEqual(r.pinModes, {1: "serial", 3: "out", 4: "out"})
+        # the pin already is an output
+        self.assertFalse("<gpio_mode>" in requests[1])
+        self.assertEqual(r.pinStates[rci.RTS], rci.ASSERTED)
+        self.assertEqual(r.pinStates[rci.DSR], rci.ASSERTED)
+
+        # the pins were read already
+        r.set_gpio_low(rci.DTR)
+        self.assertTrue("<pin5>out</pin5>" in requests[2])
+
+    def test_failure(self):
+        r = rci.RCI(self.host)
+        r.set_gpio_high(rci.RTS)
+        self.tearDown()
+        self.assertRaises(IOError, r.set_gpio_high, rci.RTS)
+        self.assertFalse(rci.RTS in r.pinModes)
+        self.setUp()
+
+    def test_stale_modes(self):
+        r = rci.RCI(self.host)
+        other = rci.RCI(self.host)
+        r.set_gpio_high(rci.RTS)
+
+        # another object of the device failed, it may have restarted
+        other.RETRY_DELAY = 0.01
+        self.server.statuses = [503] * (other.RETRIES + 1)
+        self.assertRaises(urllib2.HTTPError, other.set_gpio_low, rci.DTR)
+        requests = self.server.requests
+        n = len(requests)
+        r.set_gpio_high(rci.RTS)
+        self.assertTrue("<gpio_mode>" in requests[n])
+        r.set_gpio_high(rci.RTS)
+        self.assertFalse("<gpio_mode>" in requests[n + 1])
+
+        # the mode may have been changed by another client meanwhile
+        r.PIN_CACHE_TIME = 0.01
+        time.sleep(0.02)
+        r.set_gpio_high(rci.RTS)
+        self.assertTrue("<gpio_mode>" in requests[n + 2])
+
+    def test_retry(self):
+        r = rci.RCI(self.host)
+        r.RETRY_DELAY = 0.01
+        self.server.statuses = [503, 503]
+        r.set_gpio_high(rci.RTS)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(r.health.failures, 0)
+
+        # the device refuses the request, which is not worth repeating
+        self.server.statuses = [404]
+        self.assertRaises(urllib2.HTTPError, r.set_gpio_low, rci.RTS)
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(r.health.failures, 0)
+
+    def test_circuit_breaker(self):
+        # accepts connections, but never answers
+        dead = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        dead.bind(("127.0.0.1", 0))
+        dead.listen(16)
+        r = rci.RCI("127.0.0.1:%d"%(dead.getsockname()[1],))
+        r.TIMEOUT = 0.1
+        r.RETRIES = 1
+        r.RETRY_DELAY = 0.01
+        try:
+            for i in range(rci.RCI.FAILURE_THRESHOLD):
+                self.assertRaises(IOError, r.set_gpio_high, rci.RTS)
+            self.assertFalse(r.health.available())
+
+            start = time.time()
+            self.assertRaises(rci.DeviceUnavailableError, r.set_gpio_high,
+                    rci.RTS)
+            self.assertTrue(time.time() - start < 0.05)
+            # other nodes behind the same device fail at once as well
+            other = rci.RCI(r.ip)
+            self.assertRaises(rci.DeviceUnavailableError, other.set_gpio_low,
+                    rci.DSR)
+            r.warm()
+            self.assertEqual(r.warmConnections, [])
+
+            # after the cooldown one request probes the device
+            r.health.openUntil = time.time()
+            self.assertTrue(r.health.available())
+            self.assertRaises(IOError, r.set_gpio_high, rci.RTS)
+            self.assertFalse(r.health.available())
+        finally:
+            dead.close()
+
+    def test_probe_error(self):
+        r = rci.RCI(self.host)
+        r.health = rci.DeviceHealth(threshold=1, cooldown=0.0)
+        r.health.failure(IOError("down"))
+        def broken(rcirequest):
+            raise ValueError, "unreadable reply"
+        r._attempt = broken
+        self.assertRaises(ValueError, r.get_settings)
+        # the failed probe closed the half open breaker
+        self.assertFalse(r.health.probing)
+        del r._attempt
+        r.get_settings()
+        self.assertEqual(r.health.openUntil, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
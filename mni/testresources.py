@@ -0,0 +1,157 @@
+import unittest
+import tempfile
+import threading
+import time
+import os
+
+from mni import *
+import resources
+import partition
+
+CONFIG = """
+[Nodes]
+numNodes: 4
+type: SimulatedQuantoMote
+makeCmd: true
+
+[Node1]
+id: 1
+resources: hub1, digi
+
+[Node2]
+id: 2
+resources: hub1
+
+[Node3]
+id: 3
+resources: hub2, digi
+
+[Node4]
+id: 4
+
+[Resources]
+hub1: 1
+default: 2
+"""
+
+class FakeNode:
+    def __init__(self, id, resources):
+        self.id = id
+        self.resources = resources
+
+class Counter:
+    """Counts the calls running at once, per resource."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = {}
+        self.maximum = {}
+    def call(self, n):
+        self.lock.acquire()
+        for r in n.resources + ["all"]:
+            self.running[r] = self.running.get(r, 0) + 1
+            self.maximum[r] = max(self.maximum.get(r, 0), self.running[r])
+        self.lock.release()
+        time.sleep(0.05)
+        self.lock.acquire()
+        for r in n.resources + ["all"]:
+            self.running[r] -= 1
+        self.lock.release()
+
+class TestResources(unittest.TestCase):
+
+    def test_limits(self):
+        limits = resources.ResourceLimits({"hub1": 1, "digi": 2})
+        self.assertEqual(limits.limit("hub1"), 1)
+        self.assertEqual(limits.limit("hub2"), None)
+        nodes = [FakeNode(1, ["hub1", "digi"]), FakeNode(2, ["hub1"]),
+                FakeNode(3, ["digi", "hub2"]), FakeNode(4, ["digi"]),
+                FakeNode(5, ["hub2"]), FakeNode(6, [])]
+        counter = Counter()
+        def run(n):
+            limits.acquire(n)
+            try:
+                counter.call(n)
+            finally:
+                limits.release(n)
+        threads = [threading.Thread(target=run, args=(n,)) for n in nodes]
+        for p in threads:
+            p.start()
+        for p in threads:
+            p.join()
+        self.assertEqual(counter.maximum["hub1"], 1)
+        self.assertEqual(counter.maximum["digi"], 2)
+        self.assertEqual(counter.maximum["hub2"], 2)
+        self.assertEqual(limits.waiting, 0)
+
+    def test_mni(self):
+        configFile = tempfile.mktemp()
+        f = open(configFile, "w")
+        f.write(CONFIG)
+        f.close()
+        try:
+            m = MNI(configFile)
+        finally:
+            os.remove(configFile)
+        nodes = m.get_nodes()
+        self.assertEqual([n.resources for n in nodes],
+                [["hub1", "digi"], ["hub1"], ["hub2", "digi"], []])
+        self.assertEqual(m.resources.limit("hub1"), 1)
+        self.assertEqual(m.resources.limit("digi"), 2)
+
+        counter = Counter()
+        for n in nodes:
+            n.reset = lambda n=n: counter.call(n)
+        self.assertEqual(m.reset_all(), {})
+        self.assertEqual(counter.maximum["hub1"], 1)
+        self.assertEqual(counter.maximum["all"], 3)
+
+        def install(n):
+            counter.call(n)
+            n.installSuccess = True
+        for n in nodes:
+            n.install = lambda n=n: install(n)
+        m.install_all()
+        self.assertEqual(counter.maximum["hub1"], 1)
+
+    def test_install_waiting_for_build(self):
+        # node 1 waits for the compile of another partition; node 2, on the
+        # same hub, installs meanwhile
+        configFile = tempfile.mktemp()
+        f = open(configFile, "w")
+        f.write(CONFIG)
+        f.close()
+        try:
+            m = MNI(configFile)
+        finally:
+            os.remove(configFile)
+        (n1, n2) = m.get_nodes()[:2]
+        directory = tempfile.mkdtemp()
+        build = partition.build_directory(directory)
+        build.compile("other", lambda: None)
+        compiling = threading.Event()
+        done = threading.Event()
+        def compile():
+            compiling.set()
+            done.wait()
+        t = threading.Thread(target=build.compile, args=("other", compile))
+        t.start()
+        compiling.wait()
+        waiting = threading.Thread(target=m._install_node,
+                args=(n1, {}, directory))
+        waiting.start()
+        time.sleep(0.1)
+        try:
+            installed = threading.Thread(target=m._install_node, args=(n2,))
+            installed.start()
+            installed.join(1.0)
+            self.assertFalse(installed.isAlive())
+        finally:
+            done.set()
+            t.join()
+            waiting.join()
+            os.rmdir(directory)
+        self.assertTrue(n1.is_install_success())
+
+
+if __name__ == "__main__":
+    unittest.main()
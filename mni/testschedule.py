@@ -0,0 +1,126 @@
+import unittest
+import threading
+import time
+import SocketServer
+import BaseHTTPServer
+
+import rci
+import schedule
+
+class FakeNode:
+    def __init__(self, id):
+        self.id = id
+        self.log = []
+    def _log(self, operation):
+        self.log.append((time.time(), operation))
+    def start(self):
+        self._log("start")
+    def stop(self):
+        self._log("stop")
+    def push_usr(self):
+        self._log("push_usr")
+    def release_usr(self):
+        self._log("release_usr")
+    def reset(self):
+        raise IOError("unreachable")
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.authorizations.append(self.headers.get("Authorization"))
+        reply = '<rci_reply version="1.1"></rci_reply>\n'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+    def log_message(self, format, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        self.authorizations = []
+        self.connections = 0
+    def get_request(self):
+        self.connections += 1
+        return BaseHTTPServer.HTTPServer.get_request(self)
+
+class TestSchedule(unittest.TestCase):
+
+    def test_timeline(self):
+        nodes = [FakeNode(1), FakeNode(2)]
+        s = schedule.Schedule(warmAhead=0.05)
+        s.add(nodes[0], 0.1, "stop")
+        s.add(nodes[1], 0.0, "stop")
+        s.press(nodes, 0.2, 0.05)
+        start = time.time() + 0.05
+        results = s.run(start)
+
+        self.assertEqual([(r["node"], r["operation"]) for r in results],
+                [(2, "stop"), (1, "stop"), (1, "push_usr"), (2, "push_usr"),
+                    (1, "release_usr"), (2, "release_usr")])
+        for r in results:
+            self.assertEqual(r["error"], None)
+            self.assertAlmostEqual(r["target"], start + r["offset"])
+            self.assertTrue(0 <= r["skew"] < 0.02, r)
+        for n in nodes:
+            self.assertEqual([o for (t, o) in n.log][-2:],
+                    ["push_usr", "release_usr"])
+            self.assertAlmostEqual(n.log[-1][0] - n.log[-2][0], 0.05,
+                    places=1)
+        summary = schedule.summarize(results)
+        self.assertEqual(summary["actions"], 6)
+        self.assertEqual(summary["errors"], 0)
+
+    def test_errors(self):
+        n = FakeNode(1)
+        s = schedule.Schedule(warmAhead=0.0)
+        self.assertRaises(schedule.ScheduleError, s.add, n, 0, "fly")
+        self.assertRaises(schedule.ScheduleError, s.add, n, -1, "start")
+        s.add(n, 0, "reset")
+        s.add(n, 0, "start")
+        results = s.run()
+        self.assertEqual(results[0]["error"], "IOError: unreachable")
+        self.assertEqual(results[1]["error"], None)
+
+    def test_stagger(self):
+        nodes = [FakeNode(i) for i in range(5)]
+        offsets = []
+        for i in range(2):
+            s = schedule.Schedule()
+            end = s.stagger(nodes, "start", 2.0, seed=7, offset=1.0)
+            offsets.append([a.offset for a in s.actions])
+        self.assertEqual(offsets[0], offsets[1])
+        self.assertEqual(offsets[0], sorted(offsets[0]))
+        self.assertEqual(end, offsets[0][-1])
+        self.assertTrue(1.0 <= offsets[0][0] <= 3.0)
+
+    def test_warm(self):
+        server = Server()
+        p = threading.Thread(target=server.serve_forever)
+        p.setDaemon(True)
+        p.start()
+        try:
+            r = rci.RCI("127.0.0.1:%d"%(server.server_address[1],))
+            r.warm(2)
+            self.assertEqual(len(r.warmConnections), 2)
+            r.set_gpio_low(rci.RTS)
+            r.set_gpio_high(rci.RTS)
+            self.assertEqual(r.warmConnections, [])
+            r.set_gpio_high(rci.RTS)
+            self.assertEqual(server.connections, 3)
+            # the credentials are sent without waiting for a challenge
+            self.assertEqual(server.authorizations, [r.authorization] * 3)
+
+            # a warm connection the device closed is replaced
+            r.warm()
+            r.warmConnections[0].sock.close()
+            r.set_gpio_high(rci.RTS)
+            self.assertEqual(len(server.authorizations), 4)
+        finally:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import tempfile
+import shutil
+import json
+import os
+
+from mni import *
+from simulate import *
+import statepower
+
+CONFIG = """
+[Nodes]
+numNodes: 2
+type: SimulatedQuantoMote
+makeCmd: true
+
+[Node1]
+id: 1
+
+[Node2]
+id: 2
+seed: 7
+numStates: 12
+"""
+
+class TestSimulate(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_icount(self):
+        trace = QuantoTrace(seed=3)
+        for (power, time) in [(0.2, 1.0), (5.0, 0.05), (40.0, 0.5)]:
+            icount = trace.icount(power * time, time)
+            self.assertAlmostEqual(trace.table.get_power(icount, time) / power,
+                    1.0, 2)
+
+    def test_ground_truth(self):
+        trace = QuantoTrace(seed=5, numStates=10, noise=0.01)
+        fileName = os.path.join(self.directory, "trace.pwr")
+        self.assertEqual(trace.write_pwr_file(fileName, intervals=5000), 5000)
+
+        result = statepower.analyze_pwr_file(fileName, trace.table, "sim")
+        self.assertEqual(result['error'], None)
+        self.assertEqual(result['alwaysOffStates'], trace.alwaysOffStates)
+        self.assertEqual(result['alwaysOnStates'], trace.alwaysOnStates)
+        expected = trace.expected_state_power()
+        self.assertEqual(sorted(result['statePower'].keys()),
+                sorted(expected.keys()))
+        for s in expected:
+            self.assertTrue(abs(result['statePower'][s] - expected[s]) <
+                    0.05 * expected[s] + 0.05)
+
+    def test_size(self):
+        trace = QuantoTrace()
+        fileName = os.path.join(self.directory, "trace.pwr")
+        trace.write_pwr_file(fileName, size=200000)
+        self.assertTrue(os.path.getsize(fileName) >= 200000)
+        self.assertTrue(os.path.getsize(fileName) < 300000)
+
+    def test_testbed(self):
+        configFile = os.path.join(self.directory, "config.ini")
+        f = open(configFile, "w")
+        f.write(CONFIG)
+        f.close()
+        m = MNI(configFile)
+        nodes = m.get_nodes()
+        self.assertEqual([n.ip for n in nodes], ["sim1", "sim2"])
+        self.assertEqual(len(nodes[1].trace.varyingStates), 12)
+
+        m.reset_all()
+        self.assertTrue(m.install_all())
+        self.assertEqual([o for (t, o) in nodes[0].gpioLog],
+                ["reset", "install"])
+
+        base = os.path.join(self.directory, "sim")
+        self.assertEqual(write_measurement(m, base, intervals=100),
+                {1: 100, 2: 100})
+        truth = json.load(open(m.log_file_name(nodes[1], base) +
+            ".truth.json"))
+        self.assertEqual(truth['alwaysOnStates'], ["on0"])
+        self.assertTrue(len(nodes[0].calibrationTable) > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,277 @@
+import unittest
+import tempfile
+import random
+import os
+import numpy
+
+import calibration
+from statepower import *
+
+# With a constant energy per iCount, the power of an interval is simply
+# proportional to its iCount frequency.
+ENERGY_PER_ICOUNT = 0.001
+TABLE = calibration.CalibrationTable({
+        1: {'res': '1', 'freq': 1e9, 'E': ENERGY_PER_ICOUNT},
+        2: {'res': '2', 'freq': 0.0, 'E': ENERGY_PER_ICOUNT},
+})
+
+STATES = ["cpu", "radio", "led0", "led1", "off", "on"]
+POWER = {"cpu": 3.0, "radio": 20.0, "led0": 4.5, "led1": 2.25, "const": 0.5}
+
+def write_pwr_file(fileName, rows=2000, seed=1, coupled=False):
+    rnd = random.Random(seed)
+    f = open(fileName, "w")
+    f.write("#states: %s\n"%(" ".join(STATES),))
+    for i in range(rows):
+        active = {}
+        for s in ["cpu", "radio", "led0", "led1"]:
+            active[s] = rnd.random() < 0.5
+        if coupled:
+            # the radio is only ever on together with the cpu
+            active["radio"] = active["cpu"]
+        active["off"] = False
+        active["on"] = True
+        power = POWER["const"]
+        for s in ["cpu", "radio", "led0", "led1"]:
+            if active[s]:
+                power += POWER[s]
+        time = rnd.randint(100, 10000)
+        icount = int(round(power * time / 1e6 / ENERGY_PER_ICOUNT * 1000))
+        # the time in the file is in microseconds
+        bits = [active[s] and "1" or "-" for s in STATES]
+        f.write("%s %d %d 1\n"%(" ".join(bits), time * 1000, icount))
+    f.close()
+
+
+class TestAnalyzePwrFile(unittest.TestCase):
+
+    def setUp(self):
+        self.fileName = tempfile.mktemp()
+        write_pwr_file(self.fileName)
+
+    def tearDown(self):
+        os.remove(self.fileName)
+
+    def test_estimates(self):
+        result = analyze_pwr_file(self.fileName, TABLE, "test")
+        self.assertEqual(result['error'], None)
+        self.assertEqual(result['alwaysOffStates'], ["off"])
+        self.assertEqual(result['alwaysOnStates'], ["on"])
+        for s in POWER:
+            self.assertAlmostEqual(result['statePower'][s], POWER[s], 2)
+
+    def test_aggregation(self):
+        intervals = load_pwr_file(self.fileName, TABLE, "test")
+        # 4 independent binary states give at most 16 signatures
+        self.assertTrue(len(intervals) <= 16)
+        self.assertEqual(sum(intervals.count), 2000)
+
+        # solve the same problem with one row per interval
+        X = []
+        Y = []
+        W = []
+        for line in open(self.fileName):
+            interval = parse_pwr_line(line, len(STATES))
+            if interval is None:
+                continue
+            (activeStates, time, icount, occurences) = interval
+            E = TABLE.get_power(icount, time)
+            X.append(activeStates[:4] + [1])
+            Y.append(E)
+            W.append(numpy.sqrt(E*time))
+        X = numpy.array(X)
+        XtW = X.T * numpy.array(W)
+        x = numpy.linalg.solve(numpy.dot(XtW, X), numpy.dot(XtW, Y))
+
+        result = analyze_intervals(intervals, "test")
+        for (i, s) in enumerate(["cpu", "radio", "led0", "led1", "const"]):
+            self.assertAlmostEqual(result['statePower'][s], x[i])
+
+    def test_not_calibrated(self):
+        self.assertRaises(CalibrationError, analyze_pwr_file, self.fileName,
+                calibration.CalibrationTable(), "test")
+
+    def test_process_pool(self):
+        jobs = [{'fileName': self.fileName, 'table': TABLE, 'ip': "test"}] * 3
+        serial = analyze_pwr_files(jobs, processes=1)
+        parallel = analyze_pwr_files(jobs, processes=3)
+        self.assertEqual(serial, parallel)
+
+
+class TestPooled(unittest.TestCase):
+
+    def setUp(self):
+        self.fileNames = [tempfile.mktemp() for i in range(3)]
+        write_pwr_file(self.fileNames[0], rows=500, seed=2)
+        write_pwr_file(self.fileNames[1], rows=500, seed=3)
+        write_pwr_file(self.fileNames[2], rows=500, seed=4, coupled=True)
+
+    def tearDown(self):
+        for fileName in self.fileNames:
+            os.remove(fileName)
+
+    def test_pooled(self):
+        # on its own, the last node can not tell the cpu and radio apart
+        jobs = [{'fileName': f, 'table': TABLE, 'ip': "test"}
+                for f in self.fileNames]
+        results = analyze_pooled(load_pwr_files(jobs, processes=1),
+                ["a", "b", "c"])
+        for result in results:
+            self.assertEqual(result['error'], None)
+            for s in POWER:
+                self.assertAlmostEqual(result['statePower'][s], POWER[s], 1)
+
+
+class TestBootstrap(unittest.TestCase):
+
+    def setUp(self):
+        self.fileName = tempfile.mktemp()
+        write_pwr_file(self.fileName)
+
+    def tearDown(self):
+        os.remove(self.fileName)
+
+    def test_confidence_intervals(self):
+        result = analyze_pwr_file(self.fileName, TABLE, "test",
+                bootstrap=200)
+        for s in result['statePower']:
+            (low, high) = result['statePowerCI'][s]
+            self.assertTrue(low <= result['statePower'][s] <= high)
+
+    def test_parallel(self):
+        intervals = load_pwr_file(self.fileName, TABLE, "test")
+        X = intervals.X[:, [0, 1, 2, 3, 6]]
+        serial = bootstrap_state_power(X, intervals, 100, seed=7,
+                chunkSize=30)
+        parallel = bootstrap_state_power(X, intervals, 100, seed=7,
+                chunkSize=30, processes=2)
+        self.assertEqual(serial.shape, (100, 5))
+        self.assertTrue((serial == parallel).all())
+
+
+class TestSparseStateMatrix(unittest.TestCase):
+
+    def setUp(self):
+        rnd = numpy.random.RandomState(5)
+        self.dense = (rnd.rand(40, 12) < 0.2) * rnd.randint(1, 3, (40, 12))
+        rows = []
+        for r in self.dense:
+            indices = list(numpy.flatnonzero(r))
+            rows.append((indices, list(r[indices])))
+        self.sparse = SparseStateMatrix.from_rows(rows, 12)
+        self.weight = rnd.rand(40)
+        self.value = rnd.rand(40)
+
+    def test_toarray(self):
+        self.assertTrue((self.sparse.toarray() == self.dense).all())
+
+    def test_select_columns(self):
+        mask = numpy.arange(12) % 3 != 0
+        self.assertTrue((self.sparse.select_columns(mask).toarray()
+            == self.dense[:, mask]).all())
+
+    def test_normal_equations(self):
+        XtWX, XtWY = self.sparse.normal_equations(self.weight, self.value)
+        dXtWX, dXtWY = normal_equations(self.dense.astype(float),
+                self.weight, self.value)
+        self.assertTrue(numpy.allclose(XtWX, dXtWX))
+        self.assertTrue(numpy.allclose(XtWY, dXtWY))
+
+    def test_analyze(self):
+        fileName = tempfile.mktemp()
+        write_pwr_file(fileName)
+        dense = analyze_pwr_file(fileName, TABLE, "test")
+        sparse = analyze_pwr_file(fileName, TABLE, "test", sparse=True)
+        os.remove(fileName)
+        self.assertEqual(dense['alwaysOnStates'], sparse['alwaysOnStates'])
+        self.assertEqual(dense['alwaysOffStates'], sparse['alwaysOffStates'])
+        for s in dense['statePower']:
+            self.assertAlmostEqual(dense['statePower'][s],
+                    sparse['statePower'][s])
+
+
+class TestClassifyStates(unittest.TestCase):
+
+    def test_classify(self):
+        X = numpy.array([[0, 1, 1, 0],
+                         [0, 1, 0, 0],
+                         [0, 1, 1, 1]])
+        alwaysOff, alwaysOn, varying = classify_states(X)
+        self.assertEqual(list(alwaysOff), [True, False, False, False])
+        self.assertEqual(list(alwaysOn), [False, True, False, False])
+        self.assertEqual(list(varying), [False, False, True, True])
+
+    def test_no_rows(self):
+        alwaysOff, alwaysOn, varying = classify_states(numpy.zeros((0, 2)))
+        self.assertEqual(list(alwaysOff), [True, True])
+        self.assertFalse(alwaysOn.any())
+
+
+class TestNNLS(unittest.TestCase):
+
+    def setUp(self):
+        rnd = numpy.random.RandomState(3)
+        X = rnd.rand(50, 6)
+        y = numpy.dot(X, [1.0, -2.0, 0.5, 3.0, -0.1, 0.0]) + rnd.rand(50)*0.1
+        self.A = numpy.dot(X.T, X)
+        self.b = numpy.dot(X.T, y)
+
+    def check_kkt(self, x):
+        # x is optimal iff it is feasible, the gradient vanishes on the
+        # positive entries and points outwards on the zero entries
+        self.assertTrue((x >= 0).all())
+        w = self.b - numpy.dot(self.A, x)
+        self.assertTrue((w < 1e-8).all())
+        self.assertTrue((abs(w[x > 0]) < 1e-8).all())
+
+    def test_unconstrained_optimum(self):
+        b = numpy.dot(self.A, [1.0, 2.0, 3.0, 4.0, 5.0, 6.0])
+        x = nnls(self.A, b)
+        self.assertTrue(numpy.allclose(x, [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]))
+
+    def test_constrained(self):
+        self.check_kkt(nnls(self.A, self.b))
+
+    def test_warm_start(self):
+        x = nnls(self.A, self.b)
+        self.assertTrue(numpy.allclose(nnls(self.A, self.b, x), x))
+        self.check_kkt(nnls(self.A, self.b, numpy.ones(6)))
+
+    def test_analyze(self):
+        fileName = tempfile.mktemp()
+        write_pwr_file(fileName)
+        result = analyze_pwr_file(fileName, TABLE, "test", convexOpt=True)
+        os.remove(fileName)
+        for s in POWER:
+            self.assertAlmostEqual(result['statePower'][s], POWER[s], 2)
+
+
+class TestOnlineStateEstimator(unittest.TestCase):
+
+    def setUp(self):
+        self.fileName = tempfile.mktemp()
+        write_pwr_file(self.fileName)
+
+    def tearDown(self):
+        os.remove(self.fileName)
+
+    def test_no_data(self):
+        e = OnlineStateEstimator(TABLE, ip="test")
+        self.assertNotEqual(e.solution()['error'], None)
+
+    def test_matches_batch(self):
+        e = OnlineStateEstimator(TABLE, ip="test")
+        for line in open(self.fileName):
+            e(line)
+        online = e.solution()
+        batch = analyze_pwr_file(self.fileName, TABLE, "test")
+        self.assertEqual(online['alwaysOffStates'], batch['alwaysOffStates'])
+        self.assertEqual(online['alwaysOnStates'], batch['alwaysOnStates'])
+        self.assertAlmostEqual(online['averagePower'], batch['averagePower'])
+        for s in batch['statePower']:
+            self.assertAlmostEqual(online['statePower'][s],
+                    batch['statePower'][s])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import unittest
+import shutil
+import tempfile
+import threading
+import socket
+import time
+import os
+import SocketServer
+import BaseHTTPServer
+
+import status
+
+CONFIG = """
+[Nodes]
+numNodes: 4
+type: QuantoTestbedMote
+makeCmd: true
+
+[Node1]
+id: 1
+ip: %(live)s
+serial: %(serial)s
+
+[Node2]
+id: 2
+ip: %(dead)s
+serial: %(missing)s
+
+[Node3]
+id: 3
+serialid: M4AOQGBQ
+
+[Node4]
+id: 4
+serialid: M49WGSZB
+"""
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+        "benchmarks", "bin")
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        reply = '<rci_reply version="1.1"></rci_reply>\n'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+    def log_message(self, format, *args):
+        pass
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+class TestStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server(("127.0.0.1", 0), Handler)
+        p = threading.Thread(target=self.server.serve_forever)
+        p.setDaemon(True)
+        p.start()
+
+        # a port nothing listens on
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        deadPort = s.getsockname()[1]
+        s.close()
+
+        self.dir = tempfile.mkdtemp()
+        self.serial = os.path.join(self.dir, "ttyUSB0")
+        open(self.serial, "w").close()
+        self.motes = os.path.join(self.dir, "motes")
+        f = open(self.motes, "w")
+        f.write("M4AOQGBQ %s\n"%(self.serial,))
+        f.close()
+        self.config = os.path.join(self.dir, "config.ini")
+        f = open(self.config, "w")
+        f.write(CONFIG%{"live": "127.0.0.1:%d"%(self.server.server_address[1],),
+            "dead": "127.0.0.1:%d"%(deadPort,), "serial": self.serial,
+            "missing": os.path.join(self.dir, "ttyUSB9")})
+        f.close()
+
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = BIN + os.pathsep + self.path
+        os.environ["MNI_FAKE_MOTELIST"] = self.motes
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        del os.environ["MNI_FAKE_MOTELIST"]
+        self.server.shutdown()
+        self.server.server_close()
+        for name in os.listdir(self.dir):
+            os.remove(os.path.join(self.dir, name))
+        os.rmdir(self.dir)
+
+    def test_motelist(self):
+        self.assertEqual(status.motelist(), {"M4AOQGBQ": self.serial})
+
+    def test_sweep(self):
+        report = status.sweep(self.config, timeout=1.0)
+        nodes = report["nodes"]
+        self.assertEqual(len(nodes), 4)
+
+        self.assertTrue(nodes["Node1"]["ok"])
+        self.assertEqual(sorted(nodes["Node1"]["checks"].keys()),
+                ["rci", "serial"])
+
+        self.assertFalse(nodes["Node2"]["ok"])
+        self.assertFalse(nodes["Node2"]["checks"]["rci"]["ok"])
+        self.assertFalse(nodes["Node2"]["checks"]["serial"]["ok"])
+
+        # found by motelist
+        self.assertTrue(nodes["Node3"]["ok"])
+        self.assertEqual(nodes["Node3"]["serial"], self.serial)
+        self.assertFalse(nodes["Node4"]["ok"])
+        self.assertFalse(nodes["Node4"]["checks"]["motelist"]["ok"])
+
+        self.assertEqual(status.bad_sections(report), ["Node2", "Node4"])
+
+    def test_cache(self):
+        cache = os.path.join(self.dir, "status.json")
+        self.assertEqual(status.load_cache(cache), None)
+        self.assertEqual(status.bad_sections(None), [])
+
+        report = status.sweep(self.config, timeout=1.0)
+        status.write_cache(report, cache)
+        self.assertEqual(status.bad_sections(status.load_cache(cache, 60)),
+                ["Node2", "Node4"])
+
+        report["time"] = time.time() - 120
+        status.write_cache(report, cache)
+        self.assertEqual(status.load_cache(cache, 60), None)
+        self.assertNotEqual(status.load_cache(cache), None)
+
+    def test_cache_other_config(self):
+        cache = os.path.join(self.dir, "status.json")
+        report = status.sweep(self.config, timeout=1.0)
+        status.write_cache(report, cache)
+        self.assertEqual(status.load_cache(cache, 60, self.config)["config"],
+                os.path.abspath(self.config))
+
+        # the same section names in another testbed are other nodes
+        other = os.path.join(self.dir, "other.ini")
+        shutil.copy(self.config, other)
+        self.assertEqual(status.load_cache(cache, 60, other), None)
+        self.assertEqual(status.bad_sections(status.load_cache(cache, 60,
+            other)), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import tempfile
+import json
+import time
+import os
+
+import tracing
+import managedsubproc
+
+class FakeNode:
+    def __init__(self, id):
+        self.id = id
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        tracing.clear()
+        tracing.enable()
+
+    def tearDown(self):
+        tracing.disable()
+        tracing.clear()
+
+    def test_disabled(self):
+        tracing.disable()
+        span = tracing.span("install", "install", command="make")
+        span.args["exitCode"] = 0
+        span.end()
+        tracing.record("x", "y", tracing.TESTBED, 0, 1)
+        self.assertEqual(tracing.tracer.spans, [])
+
+    def test_spans(self):
+        track = tracing.node_track(FakeNode(3))
+        s = tracing.span("install", "install", track, command="make")
+        s.args["exitCode"] = 2
+        s.end()
+        try:
+            s = tracing.span("compile", "compile")
+            s.__enter__()
+            raise ValueError("broken")
+        except ValueError, e:
+            s.__exit__(ValueError, e, None)
+
+        events = tracing.tracer.chrome_trace()["traceEvents"]
+        names = [e["args"]["name"] for e in events if e["name"] ==
+                "thread_name"]
+        self.assertEqual(names, ["testbed", "node 3"])
+        spans = [e for e in events if e["ph"] == "X"]
+        self.assertEqual([(e["name"], e["tid"]) for e in spans],
+                [("install", 1), ("compile", 0)])
+        self.assertEqual(spans[0]["args"], {"command": "make", "exitCode": 2})
+        self.assertEqual(spans[1]["args"]["error"], "ValueError: broken")
+        self.assertEqual(min([e["ts"] for e in spans]), 0)
+
+    def test_subprocess(self):
+        m = managedsubproc.ManagedSubproc("sh -c exit",
+                trace_track="node 1")
+        m.start()
+        while not m.is_dead():
+            time.sleep(0.01)
+        m.stop()
+
+        fileName = tempfile.mktemp()
+        tracing.export(fileName)
+        events = json.load(open(fileName))["traceEvents"]
+        os.remove(fileName)
+        spans = [e for e in events if e["ph"] == "X"]
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]["name"], "sh")
+        self.assertEqual(spans[0]["cat"], "subprocess")
+        self.assertEqual(spans[0]["args"], {"command": "sh -c exit",
+            "exitCode": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+# vim: ts=4 et sw=4 sts=4
+
+"""Timed spans of testbed operations.
+
+MNI, the nodes, RCI and ManagedSubproc record a span for every compile,
+install, telnet probe, RCI request, subprocess and analysis step while
+tracing is enabled. Every span belongs to a track, which is the node it
+was done for or the testbed as a whole. export writes the spans in the
+Chrome trace event format, which chrome://tracing and Perfetto display
+with one row per track, so stragglers and steps that run one node after
+the other stand out.
+
+    tracing.enable()
+    m.install_all()
+    tracing.export("install.trace.json")
+"""
+
+import os
+import json
+import time
+import threading
+
+TESTBED = "testbed"
+
+
+def node_track(n):
+    """Name of the track of node n."""
+    return "node %s"%(n.id,)
+
+
+class Span:
+    """A running span. Add details to args, and end it with end or by using
+    it as context manager."""
+
+    def __init__(self, tracer, name, category, track, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.track = track
+        self.args = args
+        self.start = time.time()
+
+    def end(self):
+        self.tracer.record(self.name, self.category, self.track, self.start,
+                time.time(), self.args)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is not None:
+            self.args["error"] = "%s: %s"%(type.__name__, value)
+        self.end()
+        return False
+
+
+class _NullSpan:
+    """Stands in for Span while tracing is disabled."""
+
+    def __init__(self):
+        self.args = {}
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+
+class Tracer:
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self.lock = threading.Lock()
+        self.null = _NullSpan()
+
+    def span(self, name, category, track=TESTBED, **args):
+        """Start a span. args are stored with it, e.g. the command line of
+        a subprocess."""
+        if not self.enabled:
+            # keep the null span free of details from earlier uses
+            self.null.args = {}
+            return self.null
+        return Span(self, name, category, track, args)
+
+    def record(self, name, category, track, start, end, args={}):
+        """Record a span that was measured elsewhere."""
+        if not self.enabled:
+            return
+        self.lock.acquire()
+        self.spans.append((name, category, track, start, end, dict(args)))
+        self.lock.release()
+
+    def clear(self):
+        self.lock.acquire()
+        self.spans = []
+        self.lock.release()
+
+    def chrome_trace(self):
+        """Return the spans as Chrome trace event dictionary."""
+
+        self.lock.acquire()
+        spans = list(self.spans)
+        self.lock.release()
+
+        # the testbed first, then the nodes in the order they appear
+        tracks = [TESTBED]
+        tids = {TESTBED: 0}
+        for span in spans:
+            if span[2] not in tids:
+                tids[span[2]] = len(tracks)
+                tracks.append(span[2])
+        if len(spans) > 0:
+            origin = min([span[3] for span in spans])
+        pid = os.getpid()
+
+        events = []
+        for (tid, track) in enumerate(tracks):
+            events.append({"name": "thread_name", "ph": "M", "pid": pid,
+                "tid": tid, "args": {"name": track}})
+            events.append({"name": "thread_sort_index", "ph": "M",
+                "pid": pid, "tid": tid, "args": {"sort_index": tid}})
+        for (name, category, track, start, end, args) in spans:
+            events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": tids[track],
+                "args": args,
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export(self, fileName):
+        """Write the spans to fileName in the Chrome trace event format."""
+        f = open(fileName, "w")
+        json.dump(self.chrome_trace(), f)
+        f.close()
+
+
+# the tracer all of MNI records to
+tracer = Tracer()
+
+
+def enable():
+    tracer.enabled = True
+
+
+def disable():
+    tracer.enabled = False
+
+
+def span(name, category, track=TESTBED, **args):
+    return tracer.span(name, category, track, **args)
+
+
+def record(name, category, track, start, end, args={}):
+    tracer.record(name, category, track, start, end, args)
+
+
+def clear():
+    tracer.clear()
+
+
+def export(fileName):
+    tracer.export(fileName)
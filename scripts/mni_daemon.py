@@ -0,0 +1,5 @@
+#!/usr/bin/env python
+from mni import cli
+import sys
+
+sys.exit(cli.main(["daemon"] + sys.argv[1:]))
@@ -2,9 +2,11 @@
 
 import sys
 import mni
+from mni import tracing
+from mni import metrics
+from mni import schedule
 import time
 import optparse
-import random
 
 parser = optparse.OptionParser()
 parser.add_option("-r", "--random",
@@ -15,6 +17,13 @@ parser.add_option("-r", "--random",
         help="add randomized delays between resets. The supplied parameter\
 will the the maximum wait time between consecutive starts.")
 
+parser.add_option("--seed",
+        action="store",
+        type="int",
+        dest="seed",
+        default=None,
+        help="seed of the randomized delays, to repeat the start times of an\
+ earlier run.")
 parser.add_option("-R", "--reset",
         action="store_true", dest="reset", default=False,
         help="reset the nodes before measuring energy")
@@ -31,9 +40,34 @@ parser.add_option("-o",
         action="store_false", dest="collectData", default=True,
         help="do not collect data from nodes. Just process the data again.")
 
+parser.add_option("-p", "--pipeline",
+        action="store_true", dest="pipeline", default=False,
+        help="let every node go through capture, parsing and analysis on its\
+ own, instead of waiting for all nodes after every step.")
+
+parser.add_option("-d", "--decode",
+        action="store_true", dest="decode", default=False,
+        help="decode the Quanto messages while they arrive instead of\
+ parsing the logs afterwards. Does not write the .parsed files and plots\
+ of the nodes whose messages were decoded.")
+
+parser.add_option("-T", "--trace",
+        action="store", type="string", dest="trace", default=None,
+        help="write a trace of the measurement in the Chrome trace event\
+ format to this file.")
+
+parser.add_option("-M", "--metrics-port",
+        action="store", type="int", dest="metricsPort", default=None,
+        help="serve metrics of the measurement in the Prometheus text format\
+ on this port of localhost.")
+
 (cmdOptions, args) = parser.parse_args()
 
 collectData = cmdOptions.collectData
+if cmdOptions.trace is not None:
+    tracing.enable()
+if cmdOptions.metricsPort is not None:
+    metrics.serve(port=cmdOptions.metricsPort)
 
 m = mni.QuantoMNI()
 
@@ -43,24 +77,41 @@ m.calibrate_all(readFromFile=True)
 i = 0
 while i<1:
     i+= 1
-    if collectData:
+    pipelined = cmdOptions.pipeline and collectData
+    if pipelined:
+        print "Running the measurement pipeline on all nodes"
+        p = m.experiment_pipeline("quanto", cmdOptions.numMessages,
+                reset=cmdOptions.reset, pressUsr=cmdOptions.userButton,
+                convexOpt=True, decode=cmdOptions.decode)
+        errors = p.run(m.get_nodes())
+        for n in errors:
+            print "Node %d failed in stage %s: %s"%(n.id, errors[n][0],
+                    errors[n][1])
+    elif collectData:
         print "Connecting serial forwarders"
-        m.connect_serial_to_file_all(baseFileName="quanto", blocking=False)
+        m.connect_serial_to_file_all(baseFileName="quanto", blocking=False,
+                decode=cmdOptions.decode)
         if cmdOptions.reset or cmdOptions.random >0:
             if cmdOptions.random > 0:
                 print "Stopping Nodes"
                 m.stop_all()
-                for n in m.get_nodes():
-                    time.sleep(random.random()*cmdOptions.random)
-                    print "Starting Node", n.ip, n.id
-                    n.start()
+                s = schedule.Schedule()
+                s.stagger(m.get_nodes(), "start", cmdOptions.random,
+                        cmdOptions.seed)
+                for r in s.run():
+                    print "Started Node %d at +%.3f s, skew %.1f ms %s"%(
+                            r["node"], r["offset"], r["skew"] * 1000.0,
+                            r["error"] or "")
             else:
                 print "Resetting nodes"
-                m.reset_all()
+                failures = m.reset_all()
+                for id in failures:
+                    print "ERROR: node %s: %s"%(id, failures[id])
 
         if cmdOptions.userButton:
             print "Pressing usr button on nodes"
-            m.press_usr_all()
+            print "Max skew %(maxSkew).1f ms, %(errors)d errors"%(
+                    schedule.summarize(m.press_usr_all()))
 
         print "Waiting for %d Quanto messages"%(cmdOptions.numMessages,)
 
@@ -84,14 +135,23 @@ while i<1:
         sys.stdout.write("\n")
         m.disconnect_serial_to_file_all()
 
-    try:
-        m.parse_quanto_log_all(baseFileName="quanto")
-        m.process_quanto_log_all(baseFileName="quanto")
-        m.get_energy_per_quanto_state_all(baseFileName="quanto",
-                convexOpt=True)
-        #m.get_energy_per_quanto_state_all(baseFileName="quanto")
-    except mni.ParseError, e:
-        print e
+    if not pipelined:
+        try:
+            if not (cmdOptions.decode and collectData):
+                m.parse_quanto_log_all(baseFileName="quanto")
+                m.process_quanto_log_all(baseFileName="quanto")
+            else:
+                for n in m.get_nodes():
+                    if not m.is_decoded(n):
+                        print "No messages of node %d decoded, parsing its\
+ log"%(n.id,)
+                        m.parse_quanto_log(n, "quanto")
+                        m.process_quanto_log(n, "quanto")
+            m.get_energy_per_quanto_state_all(baseFileName="quanto",
+                    convexOpt=True)
+            #m.get_energy_per_quanto_state_all(baseFileName="quanto")
+        except mni.ParseError, e:
+            print e
 
     for n in m.get_nodes():
         p = n.statePower
@@ -106,4 +166,5 @@ while i<1:
         print "Always Off States: ", n.alwaysOffStates
         print "Always On States: ", n.alwaysOnStates
 
-
+if cmdOptions.trace is not None:
+    tracing.export(cmdOptions.trace)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 from mni import quanto
+from mni import daemon
 import sys
 import optparse
 
@@ -9,6 +10,12 @@ parser.add_option("-c", "--calibrate",
         help="calibrate the nodes using the CalibrateQuanto applications, before installing.")
 (options, args) = parser.parse_args()
 
+if not options.calibrate:
+    reply = daemon.try_command("install")
+    if reply is not None:
+        sys.stdout.write("Installing application on nodes\n")
+        sys.exit(daemon.print_errors(reply))
+
 m = quanto.QuantoMNI()
 m.compile()
 if options.calibrate:
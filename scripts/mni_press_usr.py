@@ -2,6 +2,7 @@
 
 import sys
 import mni
+from mni import daemon
 import time
 import optparse
 import time
@@ -18,6 +19,12 @@ parser.add_option(
 
 (options, args) = parser.parse_args()
 
+if options.nodeid >= 0:
+    reply = daemon.try_command("press_usr", [options.nodeid])
+    if reply is not None:
+        print "Pushing user button on node %d"%(options.nodeid)
+        sys.exit(daemon.print_errors(reply))
+
 m = mni.QuantoMNI()
 
 if options.nodeid != -1 and options.nodeid >= 0:
@@ -32,5 +32,7 @@ else:
     # simply reset all nodes
     for n in m.get_nodes():
         print "Node", n.id
-    m.reset_all()
+    failures = m.reset_all()
+    for id in failures:
+        print "ERROR: node %s: %s"%(id, failures[id])
 
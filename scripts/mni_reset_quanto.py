@@ -2,10 +2,10 @@
 
 import sys
 import mni
+from mni import daemon
+from mni import schedule
 import time
 import optparse
-import time
-import random
 
 parser = optparse.OptionParser()
 parser.add_option("-r", "--random",
@@ -15,23 +15,40 @@ parser.add_option("-r", "--random",
         default=-1,
         help="add randomized delays between resets. The supplied parameter\
 will the the maximum wait time between consecutive starts.")
+parser.add_option("--seed",
+        action="store",
+        type="int",
+        dest="seed",
+        default=None,
+        help="seed of the randomized delays, to repeat the start times of an\
+ earlier run.")
 
 (options, args) = parser.parse_args()
 
+if options.random <= 0:
+    reply = daemon.try_command("reset")
+    if reply is not None:
+        print "Resetting nodes"
+        sys.exit(daemon.print_errors(reply))
+
 m = mni.QuantoMNI()
 
 print "Resetting nodes"
 
 if options.random != None and options.random > 0:
     #randomize the startup of the nodes
-    m.stop_all()
-    for n in m.get_nodes():
-        time.sleep(random.random()*options.random)
-        print "Starting Node", n.ip, n.id
-        n.start()
+    failures = m.stop_all()
+    s = schedule.Schedule()
+    s.stagger(m.get_nodes(), "start", options.random, options.seed)
+    for r in s.run():
+        print "Started Node %d at +%.3f s, skew %.1f ms %s"%(r["node"],
+                r["offset"], r["skew"] * 1000.0, r["error"] or "")
 else:
     # simply reset all nodes
     for n in m.get_nodes():
         print "Node", n.ip
-    m.reset_all()
+    failures = m.reset_all()
+for id in failures:
+    print "ERROR: node %s: %s"%(id, failures[id])
+sys.exit(len(failures) > 0 and 1 or 0)
 
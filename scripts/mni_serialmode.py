@@ -2,6 +2,7 @@
 
 import sys
 import mni
+from mni import daemon
 import time
 import optparse
 import time
@@ -18,6 +19,12 @@ parser.add_option(
 
 (options, args) = parser.parse_args()
 
+if options.nodeid >= 0:
+    reply = daemon.try_command("serial_mode", [options.nodeid])
+    if reply is not None:
+        print "Setting node %d into serial mode"%(options.nodeid)
+        sys.exit(daemon.print_errors(reply))
+
 m = mni.QuantoMNI()
 
 if options.nodeid != -1 and options.nodeid >= 0:
@@ -2,13 +2,22 @@
 
 import sys
 import mni
+from mni import daemon
 import time
 
+reply = daemon.try_command("stop")
+if reply is not None:
+    print "stopping nodes"
+    sys.exit(daemon.print_errors(reply))
+
 m = mni.QuantoMNI()
 
 print "stopping nodes:"
 for n in m.get_nodes():
     sys.stdout.write("Node %s\n"%(n.ip,))
 
-m.stop_all()
+failures = m.stop_all()
+for id in failures:
+    print "ERROR: node %s: %s"%(id, failures[id])
+sys.exit(len(failures) > 0 and 1 or 0)
 
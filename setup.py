@@ -3,4 +3,5 @@ from distutils.core import setup
 setup(name='mni',
         version='0.1',
         packages=['mni',],
+        scripts=['scripts/mni',],
         )